@@ -1,4 +1,5 @@
-from app import db, jwt
+from app import db, jwt, redis_client
+from app.utils.constants import AUTH_ACL_CACHE_TTL
 from flask import Flask, jsonify
 import enum
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -72,11 +73,74 @@ class AuthNotebooks(db.Model):
     notebook_id = db.Column(db.String(100), nullable=False, unique=True)
     authorized_users = db.relationship('AuthUsers', secondary=AuthAssociation, back_populates='authorized_notebooks')
 
+# the notebooks each user is authorized on are cached in a redis set, along with an empty member so that the set of a
+# user without notebooks exists too
+def _authorized_notebooks_key(user_id):
+    return f"authorized_notebooks:{user_id}"
+
+# incremented every time the notebooks of the user change
+def _authorized_notebooks_version_key(user_id):
+    return f"authorized_notebooks_version:{user_id}"
+
+# 1 if the notebook is in the cached set of the user, 0 if it is not, -1 if the set is not cached
+_is_cached_authorized = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+return redis.call('SISMEMBER', KEYS[1], ARGV[1])
+""")
+
+# caches the set only if the version did not change since it was read, before the notebooks were read from the
+# database, so notebooks read before a revocation are never cached after its invalidation
+# KEYS: set, version / ARGV: version, ttl, notebook ids
+_cache_authorized = redis_client.register_script("""
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+""")
+
+def _authorized_notebook_ids(user_id):
+    # queried rather than read from the relationship, which may have been loaded in the session before a change
+    return db.session.scalars(
+        db.select(AuthAssociation.c.notebook_id)
+        .join(AuthUsers, AuthUsers.username_hash == AuthAssociation.c.username_hash)
+        .where(AuthUsers.id == user_id)
+    ).all()
+
+# to call once the notebooks of these users changed, after the commit
+def invalidate_authorized_notebooks(*user_ids):
+    if not user_ids:
+        return
+    pipe = redis_client.pipeline()
+    for user_id in user_ids:
+        pipe.incr(_authorized_notebooks_version_key(user_id))
+        pipe.delete(_authorized_notebooks_key(user_id))
+    pipe.execute()
+
+def is_notebook_authorized(user_id, notebook_id):
+    key = _authorized_notebooks_key(user_id)
+    authorized = _is_cached_authorized(keys=[key], args=[notebook_id])
+    if authorized != -1:
+        return authorized == 1
+
+    version_key = _authorized_notebooks_version_key(user_id)
+    version = redis_client.get(version_key) or b"0"
+    notebook_ids = _authorized_notebook_ids(user_id)
+    _cache_authorized(
+        keys=[key, version_key],
+        args=[version, int(AUTH_ACL_CACHE_TTL.total_seconds()), "", *notebook_ids],
+    )
+    return notebook_id in notebook_ids
+
 @jwt.user_lookup_loader
 def user_lookup_callback(_jwt_header, jwt_data):
     identity = jwt_data["sub"]
-    # check if the identity exists in AuthUsers
-    return AuthUsers.query.filter_by(id=identity).one_or_none()
+    # None for a user deleted since the token was issued, which is answered with a 401
+    return db.session.get(AuthUsers, identity)
 
 # change the default response message when an expired token is used
 @jwt.expired_token_loader
@@ -1,48 +1,99 @@
 from app import db
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY
+from sqlalchemy.orm import mapped_column, deferred
+from app.utils.constants import OFF_CLICK_DURATION_BINS
+import datetime
 import enum
 
 # User interaction events
 
+# all the events are stored in the single, append-only "Event" table (single table inheritance) :
+# a click is one INSERT and the dashboard queries don't join anything, the columns
+# specific to one kind of event are nullable and stay null for the other kinds
+
+EVENT_KINDS = (
+    "Event",
+    "CellExecution",
+    "ClickEvent",
+    "CellClickEvent",
+    "NotebookClickEvent",
+    "CellAlteration",
+)
+
+
+# the time the dashboards filter each kind of event on : the end of code executions,
+# the start of markdown executions and the time of clicks and alterations
+def default_event_time(context):
+    params = context.get_current_parameters()
+    return (
+        params.get("time")
+        or params.get("t_finish")
+        or params.get("t_start")
+        or datetime.datetime.now()
+    )
+
 
 class Event(db.Model):
 
     __tablename__ = "Event"
 
-    id = db.Column(db.Integer, primary_key=True)
+    # the table is range partitioned by week on event_time (see app/utils/partitions.py), which has to be part of the primary key
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    event_time = db.Column(db.DateTime, primary_key=True, default=default_event_time)
     notebook_id = db.Column(db.String(100), nullable=False)
     user_id = db.Column(db.String(100), nullable=False)
-    event_type = db.Column(db.String(32), nullable=False)
+    # native enum, stored on 4 bytes instead of the class name
+    event_type = db.Column(db.Enum(*EVENT_KINDS, name="eventkind"), nullable=False)
     
     __mapper_args__ = {"polymorphic_identity": "Event", "polymorphic_on": event_type}
     
     __table_args__ = (
         db.Index("idx_event_notebook_user", "notebook_id", "user_id"),
+        db.Index("idx_event_notebook_type", "notebook_id", "event_type"),
+        db.Index("idx_event_notebook_time", "notebook_id", "event_time"),
+        {"postgresql_partition_by": "RANGE (event_time)"},
     )
 
     def __str__(self):
         return f"Event (id: {self.id}), type : {self.event_type}"
 
 
+# catches the events outside of the weekly partitions, so a freshly created table accepts inserts right away
+event.listen(
+    Event.__table__,
+    "after_create",
+    DDL('CREATE TABLE "Event_default" PARTITION OF "Event" DEFAULT'),
+)
+event.listen(
+    Event.__table__,
+    "after_create",
+    DDL('ALTER TABLE "Event" ALTER COLUMN cell_output_model SET COMPRESSION lz4'),
+)
+
+
 class CellExecution(Event):
 
-    __tablename__ = "CellExecution"
+    # no table of its own, also keeps Flask-SQLAlchemy from generating a table name, which breaks use_existing_column
+    __tablename__ = None
 
-    id = db.Column(
-        db.Integer, db.ForeignKey("Event.id", ondelete="CASCADE"), primary_key=True
-    )
-    cell_id = db.Column(db.String(100), nullable=False)
-    orig_cell_id = db.Column(
-        db.String(100), nullable=False
+    # columns shared by several kinds of events are declared on each of them but map to the same table column
+    cell_id = mapped_column(db.String(100), nullable=True, use_existing_column=True)
+    orig_cell_id = mapped_column(
+        db.String(100), nullable=True, use_existing_column=True
     )  # can be null or undefined when not available in the metadata
-    t_start = db.Column(db.DateTime, nullable=False)
-    cell_input = db.Column(db.Text, nullable=False)
-    cell_type = db.Column(db.String(32), nullable=False)
+    t_start = db.Column(db.DateTime)
+    cell_input = db.Column(db.Text)
+    cell_type = db.Column(db.String(32))
 
     # attributes specific to code cell executions (nullable) :
     language_mimetype = db.Column(db.String(50))
     t_finish = db.Column(db.DateTime)
     status = db.Column(db.String(20))  # 'ok', 'error' or 'abort'
-    cell_output_model = db.Column(db.PickleType)
+    # the full outputs can weigh megabytes (plots, dataframes), they are only loaded on demand
+    cell_output_model = deferred(db.Column(JSONB))
+    cell_output_preview = db.Column(JSONB)  # size-capped version of the outputs for the list views
+    cell_output_truncated = db.Column(db.Boolean)  # whether the preview misses some of the outputs
     cell_output_length = db.Column(db.Integer)
 
     __mapper_args__ = {"polymorphic_identity": "CellExecution"}
@@ -58,14 +109,11 @@ class ClickType(enum.Enum):
 
 class ClickEvent(Event):
 
-    __tablename__ = "ClickEvent"
+    __tablename__ = None
 
-    id = db.Column(
-        db.Integer, db.ForeignKey("Event.id", ondelete="CASCADE"), primary_key=True
-    )
-    time = db.Column(db.DateTime, nullable=False)
+    time = mapped_column(db.DateTime, nullable=True, use_existing_column=True)
     click_duration = db.Column(db.Float, nullable=True)
-    click_type = db.Column(db.Enum(ClickType), nullable=False)
+    click_type = db.Column(db.Enum(ClickType))
 
     __mapper_args__ = {"polymorphic_identity": "ClickEvent"}
 
@@ -75,14 +123,11 @@ class ClickEvent(Event):
 
 class CellClickEvent(ClickEvent):
 
-    __tablename__ = "CellClickEvent"
+    __tablename__ = None
 
-    id = db.Column(
-        db.Integer, db.ForeignKey("ClickEvent.id", ondelete="CASCADE"), primary_key=True
-    )
-    cell_id = db.Column(db.String(100), nullable=False)
-    orig_cell_id = db.Column(
-        db.String(100), nullable=False
+    cell_id = mapped_column(db.String(100), nullable=True, use_existing_column=True)
+    orig_cell_id = mapped_column(
+        db.String(100), nullable=True, use_existing_column=True
     )  # can be null or undefined when not available in the metadata
 
     __mapper_args__ = {"polymorphic_identity": "CellClickEvent"}
@@ -93,11 +138,7 @@ class CellClickEvent(ClickEvent):
 
 class NotebookClickEvent(ClickEvent):
 
-    __tablename__ = "NotebookClickEvent"
-
-    id = db.Column(
-        db.Integer, db.ForeignKey("ClickEvent.id", ondelete="CASCADE"), primary_key=True
-    )
+    __tablename__ = None
 
     __mapper_args__ = {"polymorphic_identity": "NotebookClickEvent"}
 
@@ -112,19 +153,93 @@ class AlterationType(enum.Enum):
 
 class CellAlteration(Event):
 
-    __tablename__ = "CellAlteration"
+    __tablename__ = None
+
+    cell_id = mapped_column(db.String(100), nullable=True, use_existing_column=True)
+    alteration_type = db.Column(db.Enum(AlterationType))
+    time = mapped_column(db.DateTime, nullable=True, use_existing_column=True)
+
+    __mapper_args__ = {"polymorphic_identity": "CellAlteration"}
+
+    def __str__(self):
+        return f"Cell Alteration Event (id: {self.id}), [{self.alteration_type}], cell : {self.cell_id}, notebook :  {self.notebook_id}"
+
+
+# Dashboard rollups
+
+
+def empty_duration_histogram():
+    return [0] * len(OFF_CLICK_DURATION_BINS)
+
 
-    id = db.Column(
-        db.Integer, db.ForeignKey("Event.id", ondelete="CASCADE"), primary_key=True
+class CellRollup(db.Model):
+    """Per-minute aggregates of the events of each user on each cell, maintained at ingestion for the notebook dashboard."""
+
+    __tablename__ = "CellRollup"
+
+    notebook_id = db.Column(db.String(100), primary_key=True)
+    cell_id = db.Column(db.String(100), primary_key=True)
+    user_id = db.Column(db.String(100), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # event_time truncated to the minute
+
+    click_count = db.Column(db.Integer, nullable=False, default=0)  # cell clicks, on and off
+    # number of non-null durations of the off clicks in each of the OFF_CLICK_DURATION_BINS
+    off_click_histogram = db.Column(ARRAY(db.Integer), nullable=False, default=empty_duration_histogram)
+    # sum and count of the off click durations up to CELL_DURATION_OUTLIER_LIMIT, for the average durations
+    capped_duration_sum = db.Column(db.Float, nullable=False, default=0)
+    capped_duration_count = db.Column(db.Integer, nullable=False, default=0)
+    code_exec_count = db.Column(db.Integer, nullable=False, default=0)
+    code_exec_ok_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("idx_cellrollup_notebook_bucket", "notebook_id", "bucket_start"),
     )
+
+    def __str__(self):
+        return f"CellRollup {self.notebook_id}, cell : {self.cell_id}, user : {self.user_id}, at {self.bucket_start}"
+
+
+class LatestCellClick(db.Model):
+    """Last ON cell click of each user in each notebook, maintained at ingestion for the ToC dashboard."""
+
+    __tablename__ = "LatestCellClick"
+
+    notebook_id = db.Column(db.String(100), primary_key=True)
+    user_id = db.Column(db.String(100), primary_key=True)
     cell_id = db.Column(db.String(100), nullable=False)
-    alteration_type = db.Column(db.Enum(AlterationType), nullable=False)
+    orig_cell_id = db.Column(db.String(100), nullable=False)
     time = db.Column(db.DateTime, nullable=False)
 
-    __mapper_args__ = {"polymorphic_identity": "CellAlteration"}
+    def __str__(self):
+        return f"LatestCellClick {self.notebook_id}, user : {self.user_id}, cell : {self.orig_cell_id}, at {self.time}"
+
+
+class LatestCellExecution(db.Model):
+    """Last execution of each user on each cell, maintained at ingestion for the cell dashboard."""
+
+    __tablename__ = "LatestCellExecution"
+
+    notebook_id = db.Column(db.String(100), primary_key=True)
+    cell_id = db.Column(db.String(100), primary_key=True)
+    user_id = db.Column(db.String(100), primary_key=True)
+    # primary key of the execution in the Event table
+    exec_id = db.Column(db.Integer, nullable=False)
+    event_time = db.Column(db.DateTime, nullable=False)
+
+    t_start = db.Column(db.DateTime, nullable=False)
+    # sort keys of the attempts, the output length is 0 for markdown executions
+    input_length = db.Column(db.Integer, nullable=False)
+    output_length = db.Column(db.Integer, nullable=False)
+
+    # one index per sort of the cell dashboard, including the filtered columns so the pages are read from the index
+    __table_args__ = (
+        db.Index("idx_latestexec_time", "notebook_id", "cell_id", "exec_id", postgresql_include=["user_id", "t_start", "event_time"]),
+        db.Index("idx_latestexec_input", "notebook_id", "cell_id", "input_length", "exec_id", postgresql_include=["user_id", "t_start", "event_time"]),
+        db.Index("idx_latestexec_output", "notebook_id", "cell_id", "output_length", "exec_id", postgresql_include=["user_id", "t_start", "event_time"]),
+    )
 
     def __str__(self):
-        return f"Cell Alteration Event (id: {self.id}), [{self.alteration_type}], cell : {self.cell_id}, notebook :  {self.notebook_id}"
+        return f"LatestCellExecution {self.notebook_id}, cell : {self.cell_id}, user : {self.user_id}, execution : {self.exec_id}"
 
 
 # Notebook registration
@@ -272,5 +387,10 @@ class PendingUpdateInteraction(db.Model):
     sender_type = db.Column(db.String(20), nullable=True)  # 'teacher' or 'teammate'
     timestamp = db.Column(db.DateTime, nullable=False)
 
+    __table_args__ = (
+        # the responses to an update, and the later actions on it, for the pending updates stats of the dashboard
+        db.Index("idx_pendingupdate_notebook_update_action", "notebook_id", "update_id", "action"),
+    )
+
     def __str__(self):
         return f"PendingUpdateInteraction({self.user_id}, {self.action}, {self.notebook_id})"
@@ -1,49 +1,254 @@
-from flask import current_app
-from app import db
-from app.models.models import RefreshDashboardCache
-from app.utils.constants import DASHBOARD_REFRESH_RATE_LIMIT_DURATION
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime
-from sqlalchemy.sql import text
-from sqlalchemy.exc import IntegrityError
-
-# returns a boolean value that reflects if a refresh dashboard should be sent or not
-def check_refresh_cache(notebook_id):
-    current_time = datetime.now()
-
-    try:
-
-        # to avoid having concurrent requests coming from different workers/instances, lock the database row
-        with db.session.begin():
-            # lock the row for notebook_id if it exists or lock a non-existent row
-            query = text(f"SELECT * FROM \"RefreshDashboardCache\" WHERE notebook_id = :notebook_id FOR UPDATE")
-            cache_row = db.session.execute(query, {"notebook_id": notebook_id}).first()
-
-            if cache_row is None: 
-                # nothing for notebook_id in the cache, create an entry
-                cache_row = RefreshDashboardCache(notebook_id=notebook_id, last_refresh_time=current_time)
-                db.session.add(cache_row)
-                db.session.commit()
-                return True
-
-            elif current_time - cache_row.last_refresh_time >= DASHBOARD_REFRESH_RATE_LIMIT_DURATION : 
-                # enough time since last refresh, update the cached timestamp
-                update_query = text(
-                    "UPDATE \"RefreshDashboardCache\" "
-                    "SET last_refresh_time = :last_refresh_time "
-                    "WHERE notebook_id = :notebook_id"
-                )
-                db.session.execute(
-                    update_query,
-                    {"notebook_id": notebook_id, "last_refresh_time": current_time},
-                )
-                db.session.commit()
-                return True
-
-            else : 
-                # not enough time since last refresh
-                return False
-        
-    # used to happen with the second request trying to add a new entry while the first just did (notebook_id is a unique primary key)
-    except IntegrityError:
-        db.session.rollback()
-        return False
\ No newline at end of file
+from functools import wraps
+from flask import request, make_response, Response
+from app import socketio, redis_client
+from app.models.models import Notebook
+from app.utils.constants import (
+    REGISTERED_NOTEBOOKS_KEY,
+    NOTEBOOK_CACHE_MAX_SIZE,
+    NOTEBOOK_CACHE_TTL,
+    PROGRESS_CACHE_TTL,
+    PROGRESS_CACHE_MAX_ENTRIES,
+    DASHBOARD_CACHE_TTL,
+    DASHBOARD_CACHE_LOCK_DURATION,
+)
+from app.utils.progress import ProgressSnapshot
+
+
+### Notebook existence ###
+
+# in-process LRU of the notebook ids known to exist, mapped to their expiry time
+_known_notebooks = OrderedDict()
+_known_notebooks_lock = threading.Lock()
+notebook_cache_stats = {"local_hits": 0, "redis_hits": 0, "db_hits": 0, "misses": 0}
+
+
+def _remember_notebook(notebook_id):
+    with _known_notebooks_lock:
+        _known_notebooks[notebook_id] = time.monotonic() + NOTEBOOK_CACHE_TTL.total_seconds()
+        _known_notebooks.move_to_end(notebook_id)
+        while len(_known_notebooks) > NOTEBOOK_CACHE_MAX_SIZE:
+            _known_notebooks.popitem(last=False)
+
+
+def _is_known_locally(notebook_id):
+    with _known_notebooks_lock:
+        expiry = _known_notebooks.get(notebook_id)
+        if expiry is None:
+            return False
+        if expiry < time.monotonic():
+            del _known_notebooks[notebook_id]
+            return False
+        _known_notebooks.move_to_end(notebook_id)
+        return True
+
+
+# add a notebook to the registered notebooks, to call once it is committed to the database
+def register_notebook(notebook_id):
+    redis_client.sadd(REGISTERED_NOTEBOOKS_KEY, notebook_id)
+    _remember_notebook(notebook_id)
+
+
+# to call when a notebook is deleted, the other workers forget it once their local entry expires
+def invalidate_notebook(notebook_id):
+    redis_client.srem(REGISTERED_NOTEBOOKS_KEY, notebook_id)
+    with _known_notebooks_lock:
+        _known_notebooks.pop(notebook_id, None)
+
+
+# to call when all the notebooks are deleted
+def invalidate_all_notebooks():
+    redis_client.delete(REGISTERED_NOTEBOOKS_KEY)
+    with _known_notebooks_lock:
+        _known_notebooks.clear()
+
+
+# checks the in-process cache, then the redis set, and only then the database
+def notebook_exists(notebook_id):
+    if not notebook_id:
+        return False
+
+    if _is_known_locally(notebook_id):
+        notebook_cache_stats["local_hits"] += 1
+        return True
+
+    if redis_client.sismember(REGISTERED_NOTEBOOKS_KEY, notebook_id):
+        notebook_cache_stats["redis_hits"] += 1
+        _remember_notebook(notebook_id)
+        return True
+
+    # notebooks uploaded before the cache existed are only in the database, add them to the set on first use
+    if Notebook.query.filter_by(notebook_id=notebook_id).first():
+        notebook_cache_stats["db_hits"] += 1
+        register_notebook(notebook_id)
+        return True
+
+    notebook_cache_stats["misses"] += 1
+    return False
+
+
+### Execution progress snapshots ###
+
+_PROGRESS_LRU_KEY = "progress_snapshots_lru"
+
+# appends the new snapshots only if no other worker extended the entry meanwhile (computed_until unchanged)
+# KEYS: snapshots list, computed_until, lru sorted set / ARGV: expected computed_until, new computed_until, ttl in s, lru score, max entries, snapshots...
+_append_progress = redis_client.register_script("""
+local computed_until = redis.call('GET', KEYS[2]) or ''
+if computed_until ~= ARGV[1] then
+    return 0
+end
+-- pushed one by one, unpack() fails beyond a few thousand values
+for i = 6, #ARGV do
+    redis.call('RPUSH', KEYS[1], ARGV[i])
+end
+redis.call('SET', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('ZADD', KEYS[3], ARGV[4], KEYS[1])
+local evicted = redis.call('ZRANGE', KEYS[3], 0, -tonumber(ARGV[5]) - 1)
+for _, key in ipairs(evicted) do
+    redis.call('DEL', key, key .. ':until')
+    redis.call('ZREM', KEYS[3], key)
+end
+return 1
+""")
+
+
+# the snapshots depend on everything that shapes the computation, not only on the notebook and the start time
+def _progress_key(notebook_id, time_start, cell_order, selected_groups):
+    parameters = json.dumps([time_start, cell_order, sorted(selected_groups or [])])
+    digest = hashlib.sha256(parameters.encode("utf-8")).hexdigest()[:32]
+    return f"progress_snapshots:{notebook_id}:{digest}"
+
+
+def _serialize_snapshot(s):
+    return json.dumps([s.timestamp.isoformat(), s.mean, s.median, s.q1, s.q3, s.n_users])
+
+
+def _deserialize_snapshot(raw):
+    timestamp, mean, median, q1, q3, n_users = json.loads(raw)
+    return ProgressSnapshot(datetime.fromisoformat(timestamp), mean, median, q1, q3, n_users)
+
+
+# returns the cached snapshots and the time until which they were computed (None if nothing is cached)
+def get_progress_snapshots(notebook_id, time_start, cell_order, selected_groups):
+    key = _progress_key(notebook_id, time_start, cell_order, selected_groups)
+    pipe = redis_client.pipeline()
+    pipe.lrange(key, 0, -1)
+    pipe.get(key + ":until")
+    pipe.zadd(_PROGRESS_LRU_KEY, {key: time.time()}, xx=True)
+    raw_snapshots, computed_until, _ = pipe.execute()
+
+    if computed_until is None:
+        return [], None
+    return (
+        [_deserialize_snapshot(raw) for raw in raw_snapshots],
+        datetime.fromisoformat(computed_until.decode("utf-8")),
+    )
+
+
+# previous_until is the computed_until returned by get_progress_snapshots, the append is dropped if it changed since
+def append_progress_snapshots(notebook_id, time_start, cell_order, selected_groups, snapshots, previous_until, computed_until):
+    key = _progress_key(notebook_id, time_start, cell_order, selected_groups)
+    _append_progress(
+        keys=[key, key + ":until", _PROGRESS_LRU_KEY],
+        args=[
+            previous_until.isoformat() if previous_until else "",
+            computed_until.isoformat(),
+            int(PROGRESS_CACHE_TTL.total_seconds()),
+            time.time(),
+            PROGRESS_CACHE_MAX_ENTRIES,
+            *[_serialize_snapshot(s) for s in snapshots],
+        ],
+    )
+
+
+### Dashboard responses ###
+
+# query arguments that shape the responses, with the value the routes assume when they are missing
+_DASHBOARD_CACHE_ARGS = {
+    "t1": None,
+    "t2": None,
+    "selectedGroups": None,
+    "displayRealTime": "true",
+    "sortBy": "timeDesc",
+    "limit": None,
+    "offset": None,
+    "after": None,
+}
+
+# deletes the lock only if it is still the one taken, it may have expired and been taken by another worker meanwhile
+_release_lock = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def _dashboard_version_key(notebook_id):
+    return f"dashboard_version:{notebook_id}"
+
+
+# to call once new data of a notebook is committed (events, connected students, groups), the responses cached
+# before are keyed with the previous version so they are not served anymore and expire on their own
+def invalidate_dashboard_cache(notebook_id):
+    redis_client.incr(_dashboard_version_key(notebook_id))
+
+
+def _dashboard_response_key(notebook_id, version):
+    args = {name: request.args.get(name, default) for name, default in _DASHBOARD_CACHE_ARGS.items()}
+    if args["selectedGroups"]:
+        args["selectedGroups"] = sorted(json.loads(args["selectedGroups"]))
+    parameters = json.dumps([request.endpoint, request.view_args, args], sort_keys=True)
+    digest = hashlib.sha256(parameters.encode("utf-8")).hexdigest()[:32]
+    return f"dashboard_response:{notebook_id}:{version}:{digest}"
+
+
+def _cached_response(body):
+    return Response(body, mimetype="application/json")
+
+
+# caches the JSON responses of a dashboard route, so the teachers refreshing after the same refreshDashboard share them
+# on a miss, a single worker computes the response while the others wait for it instead of running the same queries
+def cached_dashboard_response(view):
+    @wraps(view)
+    def wrapper(notebook_id, **kwargs):
+        version = int(redis_client.get(_dashboard_version_key(notebook_id)) or 0)
+        key = _dashboard_response_key(notebook_id, version)
+
+        cached = redis_client.get(key)
+        if cached is not None:
+            return _cached_response(cached)
+
+        lock_key = key + ":lock"
+        lock_token = uuid.uuid4().hex
+        lock_ms = int(DASHBOARD_CACHE_LOCK_DURATION.total_seconds() * 1000)
+        if redis_client.set(lock_key, lock_token, nx=True, px=lock_ms):
+            try:
+                response = make_response(view(notebook_id, **kwargs))
+                if response.status_code == 200:
+                    redis_client.set(key, response.get_data(), ex=DASHBOARD_CACHE_TTL)
+                return response
+            finally:
+                _release_lock(keys=[lock_key], args=[lock_token])
+
+        # poll until the response is cached, or compute it anyway if the worker holding the lock takes too long
+        deadline = time.monotonic() + DASHBOARD_CACHE_LOCK_DURATION.total_seconds()
+        while time.monotonic() < deadline:
+            socketio.sleep(0.05)
+            cached = redis_client.get(key)
+            if cached is not None:
+                return _cached_response(cached)
+            if not redis_client.exists(lock_key):
+                break
+        return view(notebook_id, **kwargs)
+
+    return wrapper
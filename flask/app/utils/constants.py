@@ -1,3 +1,5 @@
+import os
+
 SELECTOR_ID = 'unianalytics'
 Selectors = {
     "cellMapping": f"{SELECTOR_ID}_cell_mapping",
@@ -5,6 +7,64 @@ Selectors = {
 }
 
 MAX_PAYLOAD_SIZE = 1048576 # 1*1024*1024 = 1MB in bytes
+MAX_BATCH_EVENTS = 500 # maximum number of events accepted by a single /send/batch request
 
 from datetime import timedelta
-DASHBOARD_REFRESH_RATE_LIMIT_DURATION = timedelta(seconds=5)
\ No newline at end of file
+DASHBOARD_REFRESH_RATE_LIMIT_DURATION = timedelta(seconds=5)
+
+# 'refresh' only broadcasts refreshDashboard to the teachers, 'push' also sends the notebook dashboard views to the teachers subscribed over Socket.IO
+DASHBOARD_UPDATE_MODE = os.environ.get('DASHBOARD_UPDATE_MODE', 'refresh')
+DASHBOARD_SUBSCRIPTION_TTL = timedelta(days=1) # subscriptions left behind by crashed workers are dropped after that long
+DASHBOARD_PUSH_LOCK_DURATION = timedelta(seconds=60) # longest a worker can hold the push of a notebook
+
+AUTH_ACL_CACHE_TTL = timedelta(hours=1) # the cached sets of authorized notebooks are invalidated on change, this bounds a missed invalidation
+
+REGISTERED_NOTEBOOKS_KEY = 'registered_notebooks' # redis set of the notebook ids present in the database
+NOTEBOOK_CACHE_MAX_SIZE = 10000 # maximum number of notebook ids kept in the in-process cache of each worker
+NOTEBOOK_CACHE_TTL = timedelta(minutes=10) # bounds how long a worker can keep accepting events for a deleted notebook
+
+PROGRESS_CACHE_TTL = timedelta(hours=6) # execution progress snapshots unused for that long are evicted
+PROGRESS_CACHE_MAX_ENTRIES = 500 # beyond that, the least recently used execution progress snapshots are evicted
+
+DASHBOARD_CACHE_TTL = timedelta(minutes=10) # cached dashboard responses are dropped after that long, if not invalidated before
+DASHBOARD_CACHE_LOCK_DURATION = timedelta(seconds=20) # longest a request waits for another one computing the same response
+
+# 'sync' commits the events within the /send requests, 'stream' acknowledges them once pushed to a Redis Stream that flusher.py drains into the database
+INGEST_MODE = os.environ.get('INGEST_MODE', 'sync')
+INGEST_STREAM_KEY = 'ingest_stream'
+INGEST_DEAD_LETTER_STREAM_KEY = 'ingest_stream_dead_letters' # entries that could not be inserted, kept for inspection
+INGEST_DEAD_LETTER_MAX_LENGTH = 10000 # only the latest dead letters are kept, the stream is trimmed beyond that
+INGEST_CONSUMER_GROUP = 'ingest_flushers'
+INGEST_FLUSH_BATCH_SIZE = 1000 # maximum number of entries inserted per transaction by the flusher
+INGEST_CLAIM_IDLE_TIME = timedelta(seconds=60) # entries pending for longer are taken over from crashed flushers
+INGEST_RETRY_DELAY = timedelta(seconds=1) # first wait of the flusher when the database is unavailable, doubled up to INGEST_CLAIM_IDLE_TIME
+
+# export jobs are queued in a Redis list that exporter.py workers pop, their files are written to the storage volume
+EXPORT_JOB_QUEUE_KEY = 'export_jobs'
+EXPORT_JOB_TTL = timedelta(days=1) # the status of an export job, and thus the download of its file, is kept that long
+EXPORT_JOB_DEDUPE_TTL = timedelta(hours=1) # longest identical requests are given an in-flight job, bounds the wait on a job left behind by a crashed worker
+EXPORT_WORKER_TIMEOUT = timedelta(minutes=5) # exporters without a heartbeat for that long are considered dead, and their jobs are queued again
+EXPORT_JOB_MAX_ATTEMPTS = 3 # jobs whose exporter died that many times are marked as failed instead of being queued again
+S3_PATH_EXPORTS = os.environ.get('S3_PATH_EXPORTS', 'exports/')
+EXPORT_FILES_KEY = 'export_files' # redis sorted set of the export files, scored by the time they were written, deleted EXPORT_JOB_TTL later
+
+TEAMMATE_LOCATION_TTL = timedelta(minutes=5) # teammate locations not updated for that long are not shown anymore
+
+TEAMMATE_GRAPH_TTL = timedelta(hours=1) # the teammates of the users of a notebook are rebuilt from the group tables after that long, if not invalidated before
+TEAMMATE_GRAPH_CACHE_MAX_SIZE = 1000 # maximum number of notebook teammate graphs kept in the in-process cache of each worker
+
+LOCATION_UPDATE_RATE = float(os.environ.get('LOCATION_UPDATE_RATE', 4)) # maximum number of location updates of a socket stored and broadcast per second, the others are coalesced
+STUDENT_SOCKETS_TTL = timedelta(days=1) # socket ids of a student left behind by crashed workers are dropped after that long
+
+PRESENCE_HEARTBEAT_INTERVAL = timedelta(seconds=25) # each worker refreshes the presence of its open sockets this often, as often as the engine.io pings
+PRESENCE_TIMEOUT = timedelta(seconds=75) # users without a heartbeat for that long are not considered connected anymore, and are swept
+
+CELL_DURATION_OUTLIER_LIMIT = 5000 # cell focus durations longer than this are left out of the average durations
+OFF_CLICK_DURATION_BINS = (0, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600) # lower bounds (in seconds) of the bins of the cell focus duration histograms, the first one also takes the shorter durations
+
+CELL_OUTPUT_PREVIEW_MAX_SIZE = 16384 # 16*1024 = 16KB of JSON, outputs larger than that are trimmed in the list views
+CELL_OUTPUT_PREVIEW_TEXT_LENGTH = 2000 # maximum number of characters of each text output kept in a trimmed preview
+
+EVENT_PARTITION_WEEKS_AHEAD = 4 # number of future weekly Event partitions kept created in advance
+EVENT_PARTITION_MAINTENANCE_KEY = 'event_partitions_maintenance'
+EVENT_PARTITION_MAINTENANCE_INTERVAL = timedelta(hours=6) # the flushers create the coming weekly partitions that often, one of them at a time
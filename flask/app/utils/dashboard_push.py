@@ -0,0 +1,252 @@
+import hashlib
+import json
+from flask import current_app
+from flask_jwt_extended import decode_token
+from app import socketio, redis_client
+from app.models.auth import is_notebook_authorized
+from app.models.models import ConnectionType
+from app.utils.constants import (
+    DASHBOARD_SUBSCRIPTION_TTL,
+    DASHBOARD_PUSH_LOCK_DURATION,
+    DASHBOARD_REFRESH_RATE_LIMIT_DURATION,
+    DASHBOARD_UPDATE_MODE,
+)
+from app.utils.dashboard_views import (
+    getViewFilters,
+    getCellExecutionData,
+    getCellAccessTimeData,
+    getCellDurationTimeData,
+    getTocData,
+)
+
+# the notebook dashboard views pushed to the subscribed teachers, named after their routes
+PUSHED_VIEWS = {
+    "user_code_execution": getCellExecutionData,
+    "user_cell_time": getCellAccessTimeData,
+    "user_cell_duration_time": getCellDurationTimeData,
+    "toc": getTocData,
+}
+
+# the query arguments of these routes that a subscription can set, there is no t2 since a live view has no end
+SUBSCRIPTION_ARGS = ("t1", "selectedGroups", "displayRealTime")
+
+# the teachers subscribed with the same arguments share a room, and the views are computed once for all of them
+# KEYS: arguments hash, subscriber counts hash, last pushed state / ARGV: digest
+_unsubscribe = redis_client.register_script("""
+if redis.call('HINCRBY', KEYS[2], ARGV[1], -1) <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('DEL', KEYS[3])
+end
+""")
+
+# a single worker pushes the updates of a notebook at a time, the others mark the push as pending for it to go again
+_acquire_push = redis_client.register_script("""
+if redis.call('SET', KEYS[1], 1, 'NX', 'PX', ARGV[1]) then
+    return 1
+end
+redis.call('SET', KEYS[2], 1, 'PX', ARGV[1])
+return 0
+""")
+
+# keeps the lock and returns 1 if a push was requested meanwhile, releases it otherwise
+_release_push = redis_client.register_script("""
+if redis.call('DEL', KEYS[2]) == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+    return 1
+end
+redis.call('DEL', KEYS[1])
+return 0
+""")
+
+
+def _subscriptions_keys(notebook_id):
+    return [f"dashboard_subscriptions:{notebook_id}", f"dashboard_subscribers:{notebook_id}"]
+
+
+def _state_key(notebook_id, digest):
+    return f"dashboard_state:{notebook_id}:{digest}"
+
+
+def subscription_room(notebook_id, digest):
+    return ConnectionType.TEACHER.name.lower() + "_" + notebook_id + "_dashboard_" + digest
+
+
+# returns the user id of a dashboard access token if it is allowed to view the notebook, None otherwise
+def authorized_dashboard_user(token, notebook_id):
+    try:
+        claims = decode_token(token)
+    except Exception:
+        return None
+    if not is_notebook_authorized(claims["sub"], notebook_id):
+        return None
+    return claims["sub"]
+
+
+# same values as in the query strings of the routes, whatever the form the client sent them in
+def _normalize_args(data):
+    args = {}
+    if data.get("t1"):
+        args["t1"] = data["t1"]
+    selected_groups = data.get("selectedGroups")
+    if isinstance(selected_groups, str):
+        selected_groups = json.loads(selected_groups)
+    if selected_groups:
+        args["selectedGroups"] = json.dumps(sorted(selected_groups))
+    if data.get("displayRealTime") is not None:
+        args["displayRealTime"] = str(data["displayRealTime"]).lower()
+    return args
+
+
+def _digest(args):
+    return hashlib.sha256(json.dumps(args, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def compute_views(notebook_id, args):
+    filters = getViewFilters(args)
+    views = {name: compute(notebook_id, *filters) for name, compute in PUSHED_VIEWS.items()}
+    # what the clients receive, and what the next views are compared to once reloaded from redis
+    return json.loads(json.dumps(views))
+
+
+def _is_cell_list(value):
+    return isinstance(value, list) and all(isinstance(entry, dict) and "cell" in entry for entry in value)
+
+
+# the views that changed: the per-cell lists as the entries to upsert and the cells to remove, the others as a whole
+def diff_views(previous, current):
+    changes = {}
+    for name, value in current.items():
+        old_value = previous.get(name)
+        if old_value == value:
+            continue
+        if _is_cell_list(old_value) and _is_cell_list(value):
+            old_entries = {entry["cell"]: entry for entry in old_value}
+            entries = {entry["cell"]: entry for entry in value}
+            changes[name] = {
+                "upsert": [entry for cell, entry in entries.items() if old_entries.get(cell) != entry],
+                "remove": [cell for cell in old_entries if cell not in entries],
+            }
+        else:
+            changes[name] = {"value": value}
+    return changes
+
+
+# registers the subscription and returns its digest along with the current views, sent in full to the new subscriber
+def subscribe_dashboard(notebook_id, data):
+    args = _normalize_args(data)
+    digest = _digest(args)
+    subscriptions_key, subscribers_key = _subscriptions_keys(notebook_id)
+    ttl = int(DASHBOARD_SUBSCRIPTION_TTL.total_seconds())
+
+    pipe = redis_client.pipeline()
+    pipe.hset(subscriptions_key, digest, json.dumps(args))
+    pipe.hincrby(subscribers_key, digest, 1)
+    pipe.expire(subscriptions_key, ttl)
+    pipe.expire(subscribers_key, ttl)
+    pipe.execute()
+
+    views = compute_views(notebook_id, args)
+    # the first subscriber sets the state the next deltas are computed against
+    redis_client.set(_state_key(notebook_id, digest), json.dumps(views), nx=True, ex=ttl)
+    return digest, views
+
+
+def unsubscribe_dashboard(notebook_id, digest):
+    _unsubscribe(keys=[*_subscriptions_keys(notebook_id), _state_key(notebook_id, digest)], args=[digest])
+
+
+def _push_subscriptions(notebook_id):
+    subscriptions_key, _ = _subscriptions_keys(notebook_id)
+    ttl = int(DASHBOARD_SUBSCRIPTION_TTL.total_seconds())
+
+    for digest, args in redis_client.hgetall(subscriptions_key).items():
+        digest = digest.decode("utf-8")
+        views = compute_views(notebook_id, json.loads(args))
+        previous = redis_client.getset(_state_key(notebook_id, digest), json.dumps(views))
+        redis_client.expire(_state_key(notebook_id, digest), ttl)
+
+        room_name = subscription_room(notebook_id, digest)
+        if previous is None:
+            socketio.emit("dashboardUpdate", {"full": True, "views": views}, to=room_name)
+            continue
+        changes = diff_views(json.loads(previous), views)
+        if changes:
+            socketio.emit("dashboardUpdate", {"full": False, "changes": changes}, to=room_name)
+
+
+# computes the views of every subscription of the notebook and pushes what changed since the last push
+def push_dashboard_updates(notebook_id):
+    lock_keys = [f"dashboard_push_lock:{notebook_id}", f"dashboard_push_pending:{notebook_id}"]
+    lock_ms = int(DASHBOARD_PUSH_LOCK_DURATION.total_seconds() * 1000)
+    if not _acquire_push(keys=lock_keys, args=[lock_ms]):
+        return
+
+    try:
+        while True:
+            _push_subscriptions(notebook_id)
+            if not _release_push(keys=lock_keys, args=[lock_ms]):
+                break
+    except Exception:
+        redis_client.delete(lock_keys[0])
+        raise
+
+
+# leading edge: the first call of a window takes the throttle key and emits right away
+# trailing edge: the first throttled call of a window takes the pending key and gets the delay after which to emit
+# returns -1 to emit now, 0 to do nothing, or the delay in ms before the trailing emit
+_throttle_refresh = redis_client.register_script("""
+if redis.call('SET', KEYS[1], 1, 'NX', 'PX', ARGV[1]) then
+    return -1
+end
+local remaining = redis.call('PTTL', KEYS[1])
+if remaining <= 0 then
+    remaining = 1
+end
+if redis.call('SET', KEYS[2], 1, 'NX', 'PX', remaining + ARGV[1]) then
+    return remaining
+end
+return 0
+""")
+
+# the trailing emit opens a new window, so the events that keep coming are throttled the same way
+_open_trailing_window = redis_client.register_script("""
+redis.call('SET', KEYS[1], 1, 'PX', ARGV[1])
+redis.call('DEL', KEYS[2])
+""")
+
+
+def _refresh_keys(notebook_id):
+    return [f"refresh_throttle:{notebook_id}", f"refresh_pending:{notebook_id}"]
+
+
+def _push_updates(app, notebook_id):
+    with app.app_context():
+        push_dashboard_updates(notebook_id)
+
+
+def _emit_refresh(app, notebook_id):
+    room_name = ConnectionType.TEACHER.name.lower() + "_" + notebook_id
+    socketio.emit("refreshDashboard", to=room_name)
+    # the views are computed in the background, not within the request that sent the events
+    if DASHBOARD_UPDATE_MODE == "push":
+        socketio.start_background_task(_push_updates, app, notebook_id)
+
+
+def _trailing_refresh(app, notebook_id, delay_ms, window_ms):
+    socketio.sleep(delay_ms / 1000)
+    _open_trailing_window(keys=_refresh_keys(notebook_id), args=[window_ms])
+    _emit_refresh(app, notebook_id)
+
+
+# broadcast a refresh dashboard message to all the teachers of a notebook, at most once per rate limit window
+# and once more at the end of the window if other events came in meanwhile, so the last burst is not missed
+def request_dashboard_refresh(notebook_id):
+    window_ms = int(DASHBOARD_REFRESH_RATE_LIMIT_DURATION.total_seconds() * 1000)
+    delay_ms = _throttle_refresh(keys=_refresh_keys(notebook_id), args=[window_ms])
+    app = current_app._get_current_object()
+
+    if delay_ms < 0:
+        _emit_refresh(app, notebook_id)
+    elif delay_ms > 0:
+        socketio.start_background_task(_trailing_refresh, app, notebook_id, delay_ms, window_ms)
@@ -0,0 +1,313 @@
+import json
+from sqlalchemy import func, and_, select, bindparam, any_, true
+from sqlalchemy.dialects.postgresql import ARRAY
+from app import db
+from app.models.models import (
+    Event,
+    CellClickEvent,
+    UserGroupAssociation,
+    CellRollup,
+    LatestCellClick,
+    ConnectionType,
+)
+from app.utils.utils import get_fetch_real_time, get_time_boundaries
+from app.utils.rollups import rollup_bucket
+from app.utils.constants import OFF_CLICK_DURATION_BINS
+from app.utils.presence import active_users
+
+# the computations of the notebook dashboard views, shared by their routes and the pushes to the subscribed teachers
+
+
+def getConnectedStudentUserIds(notebook_id):
+    # the students with a recent heartbeat
+    return active_users(ConnectionType.STUDENT, notebook_id)
+
+
+# the connected students as a single array parameter, unlike an IN list that has a parameter per student, the
+# SQL of the real-time queries stays the same whatever the number of connected students
+def connectedStudentsFilter(user_id_column, notebook_id):
+    connected_user_ids = bindparam(
+        "connected_user_ids",
+        getConnectedStudentUserIds(notebook_id),
+        type_=ARRAY(db.String),
+        unique=True,
+    )
+    return user_id_column == any_(connected_user_ids)
+
+
+def getGroupsUserIdsSubquery(notebook_id, groups):
+    group_pks = [f"{group_name}-{notebook_id}" for group_name in groups]
+
+    return (
+        db.session.query(UserGroupAssociation.c.user_id)
+        .filter(UserGroupAssociation.c.group_pk.in_(group_pks))
+        .subquery()
+    )
+
+
+# the Event table is partitioned on event_time, bounding it lets postgres skip the partitions out of the time window
+# event_time is the time of clicks and alterations, the end of code executions and the start of markdown executions
+def getEventTimeFilter(t_start, t_end):
+    return and_(
+        Event.event_time > t_start if t_start is not None else True,
+        Event.event_time <= t_end if t_end is not None else True,
+    )
+
+
+# time window, real-time flag and selected groups of the dashboard views, from their query arguments
+def getViewFilters(args):
+    t_start, t_end = get_time_boundaries(args)
+    # if t_end is defined, real time is ignored and set to False since what happens in real-time is not included anymore
+    fetch_real_time = get_fetch_real_time(args, t_end)
+    selected_groups = args.get("selectedGroups", None)
+    if selected_groups:
+        selected_groups = json.loads(selected_groups)
+    return t_start, t_end, fetch_real_time, selected_groups
+
+
+# the rollups are per minute, so the window is widened to the minutes it starts and ends in
+def getRollupTimeFilter(t_start, t_end):
+    return and_(
+        CellRollup.bucket_start >= rollup_bucket(t_start) if t_start is not None else True,
+        CellRollup.bucket_start <= t_end if t_end is not None else True,
+    )
+
+
+def filterRollupUsers(query, notebook_id, fetch_real_time, selected_groups):
+    if fetch_real_time:
+        query = query.filter(connectedStudentsFilter(CellRollup.user_id, notebook_id))
+    if selected_groups:
+        query = query.filter(
+            CellRollup.user_id.in_(
+                select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
+            )
+        )
+    return query
+
+
+
+# number of clicks, code executions and successful code executions of each cell
+def getCellExecutionData(notebook_id, t_start, t_end, fetch_real_time, selected_groups):
+    cell_click_count = func.sum(CellRollup.click_count)
+    code_exec_count = func.sum(CellRollup.code_exec_count)
+    query = (
+        db.session.query(
+            CellRollup.cell_id,
+            cell_click_count,
+            code_exec_count,
+            func.sum(CellRollup.code_exec_ok_count),
+        )
+        .filter(
+            CellRollup.notebook_id == notebook_id,
+            getRollupTimeFilter(t_start, t_end),
+        )
+        .group_by(CellRollup.cell_id)
+        # only the cells that were both clicked and executed
+        .having(and_(cell_click_count > 0, code_exec_count > 0))
+    )
+    query = filterRollupUsers(query, notebook_id, fetch_real_time, selected_groups)
+
+    return [
+        {
+            "cell": cell,
+            "cell_click_pct": cell_click_pct,
+            "code_exec_pct": code_exec_pct,
+            "code_exec_ok_pct": code_exec_ok_pct,
+        }
+        for cell, cell_click_pct, code_exec_pct, code_exec_ok_pct in query.all()
+    ]
+
+
+
+# durations of the visits of each cell
+# the list of all the durations is not kept by the rollups, so it is read from the click events
+def getCellAccessTimeData(notebook_id, t_start, t_end, fetch_real_time, selected_groups):
+    cell_click_events = db.session.query(
+        CellClickEvent.cell_id,
+        func.array_agg(CellClickEvent.click_duration).label("durations"),
+    ).filter(
+        CellClickEvent.notebook_id == notebook_id,
+        # event_time is the time of the clicks
+        getEventTimeFilter(t_start, t_end),
+        CellClickEvent.click_type == "OFF",
+        CellClickEvent.click_duration.isnot(None),
+    )  # use isnot to check for non-null values
+
+    if fetch_real_time:
+        cell_click_events = cell_click_events.filter(
+            connectedStudentsFilter(CellClickEvent.user_id, notebook_id)
+        )
+
+    if selected_groups:
+        cell_click_events = cell_click_events.filter(
+            CellClickEvent.user_id.in_(
+                select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
+            )
+        )
+
+    cell_click_events = cell_click_events.group_by(CellClickEvent.cell_id).all()
+
+    return [
+        {"cell": cell, "durations": durations}
+        for cell, durations in cell_click_events
+    ]
+
+
+
+# counts of the visit durations of each cell in the OFF_CLICK_DURATION_BINS bins, read from the rollups
+def getCellAccessTimeHistogramData(notebook_id, t_start, t_end, fetch_real_time, selected_groups):
+    # the histograms of the rollups are summed bin by bin, one row per cell and bin
+    histogram = (
+        func.unnest(CellRollup.off_click_histogram)
+        .table_valued("count", with_ordinality="bin")
+        .render_derived()
+    )
+    cell_click_events = db.session.query(
+        CellRollup.cell_id,
+        histogram.c.bin,
+        func.sum(histogram.c.count),
+    ).select_from(CellRollup).join(histogram, true()).filter(
+        CellRollup.notebook_id == notebook_id,
+        getRollupTimeFilter(t_start, t_end),
+    )
+    cell_click_events = filterRollupUsers(
+        cell_click_events, notebook_id, fetch_real_time, selected_groups
+    )
+
+    cell_click_events = cell_click_events.group_by(CellRollup.cell_id, histogram.c.bin).all()
+
+    cell_counts = {}
+    for cell, bin, count in cell_click_events:
+        counts = cell_counts.setdefault(cell, [0] * len(OFF_CLICK_DURATION_BINS))
+        counts[bin - 1] = int(count)
+
+    # the cells without off click durations are left out
+    return [
+        {"cell": cell, "bins": list(OFF_CLICK_DURATION_BINS), "counts": counts}
+        for cell, counts in cell_counts.items()
+        if any(counts)
+    ]
+
+
+
+# average visit duration of each cell, averaged per user first
+def getCellDurationTimeData(notebook_id, t_start, t_end, fetch_real_time, selected_groups):
+    # subquery to average cell focus duration per user, durations longer than CELL_DURATION_OUTLIER_LIMIT are outliers left out
+    per_user_avg_subquery = (
+        db.session.query(
+            CellRollup.cell_id,
+            CellRollup.user_id,
+            (
+                func.sum(CellRollup.capped_duration_sum)
+                / func.sum(CellRollup.capped_duration_count)
+            ).label("user_avg_duration"),
+        )
+        .filter(
+            CellRollup.notebook_id == notebook_id,
+            getRollupTimeFilter(t_start, t_end),
+        )
+        .group_by(CellRollup.cell_id, CellRollup.user_id)
+        .having(func.sum(CellRollup.capped_duration_count) > 0)
+    )
+    per_user_avg_subquery = filterRollupUsers(
+        per_user_avg_subquery, notebook_id, fetch_real_time, selected_groups
+    ).subquery()
+
+    # main query to average the user averages per cell
+    cell_click_events = (
+        db.session.query(
+            per_user_avg_subquery.c.cell_id.label("cell"),
+            func.avg(per_user_avg_subquery.c.user_avg_duration).label("average_duration"),
+            func.count(per_user_avg_subquery.c.user_id).label("user_count"),
+        )
+        .group_by(per_user_avg_subquery.c.cell_id)
+        .all()
+    )
+
+    # total count of distinct users
+    total_user_count = db.session.query(
+        func.distinct(per_user_avg_subquery.c.user_id)
+    ).count()
+
+    return {
+        "durations": [
+            {
+                "average_duration": avg_duration,
+                "cell": cell,
+                "user_count": user_count,
+            }
+            for cell, avg_duration, user_count in cell_click_events
+        ],
+        "total_user_count": total_user_count,
+    }
+
+
+
+# number of users whose last cell click is on each cell
+def getTocData(notebook_id, t_start, t_end, fetch_real_time, selected_groups):
+    # without an end to the window, the last click of each user is the one kept up to date in LatestCellClick
+    if t_end is None:
+        query = db.session.query(
+            LatestCellClick.orig_cell_id,
+            func.count(LatestCellClick.user_id).label("user_count"),
+        ).filter(
+            LatestCellClick.notebook_id == notebook_id,
+            LatestCellClick.time > t_start if t_start is not None else True,
+        )
+
+        if fetch_real_time:
+            query = query.filter(connectedStudentsFilter(LatestCellClick.user_id, notebook_id))
+
+        if selected_groups:
+            query = query.filter(
+                LatestCellClick.user_id.in_(
+                    select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
+                )
+            )
+
+        return dict(query.group_by(LatestCellClick.orig_cell_id).all())
+
+    # retrieve the ids of the last event for each user_id
+    subquery = db.session.query(
+        CellClickEvent.user_id, func.max(CellClickEvent.id).label("last_event_id")
+    ).filter(
+        CellClickEvent.notebook_id == notebook_id,
+        CellClickEvent.click_type == "ON",
+        getEventTimeFilter(t_start, t_end),
+    )
+
+    if fetch_real_time:
+        subquery = subquery.filter(connectedStudentsFilter(CellClickEvent.user_id, notebook_id))
+
+    if selected_groups:
+        subquery = subquery.filter(
+            CellClickEvent.user_id.in_(
+                select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
+            )
+        )
+
+    subquery = subquery.group_by(CellClickEvent.user_id).subquery()
+
+    # first join with the previous subquery to only keep the rows with an id = last_event_id, then group by orig_cell_id
+    query = (
+        db.session.query(
+            CellClickEvent.orig_cell_id,
+            func.count(func.distinct(CellClickEvent.user_id)).label("user_count"),
+        )
+        .join(
+            subquery,
+            and_(
+                CellClickEvent.user_id == subquery.c.user_id,
+                CellClickEvent.id == subquery.c.last_event_id,
+            ),
+        )
+        .group_by(CellClickEvent.orig_cell_id)
+    )
+
+    location_count = {}
+    for orig_cell_id, user_count in query:
+        location_count[orig_cell_id] = user_count
+
+    return location_count
+
+
@@ -0,0 +1,253 @@
+import zlib
+from flask import request, Response, stream_with_context
+from sqlalchemy import func, select, cast, case, and_, literal, Text
+from app import db
+from app.models.models import Event, ClickType, AlterationType
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # the columnar exports are unavailable without it
+    pa = None
+
+EXPORT_CHUNK_SIZE = 65536  # postgres sends a message per row, they are sent to the client in chunks of that size
+EXPORT_BATCH_ROWS = 50000  # rows fetched from the server-side cursor, and written as one record batch / row group
+
+# same format as datetime.isoformat(), in which the exports used to write the times
+ISO_TIME_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.US'
+ISO_SECONDS_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS'
+
+
+# the CSV exports used to be written by csv.writer from the ORM objects, the columns below keep the text it wrote
+
+
+def iso_time(column):
+    # isoformat() leaves the microseconds out when they are 0
+    return case(
+        (func.date_trunc("second", column) == column, func.to_char(column, ISO_SECONDS_FORMAT)),
+        else_=func.to_char(column, ISO_TIME_FORMAT),
+    )
+
+
+def enum_repr(column, enum_class):
+    # str() of the python enum members, e.g. ClickType.ON
+    return literal(f"{enum_class.__name__}.") + cast(column, Text)
+
+
+def float_repr(column):
+    # postgres writes the integral floats without the .0 that repr() keeps below 1e16
+    text = cast(column, Text)
+    return case((and_(column == func.trunc(column), func.abs(column) < 1e16), text + ".0"), else_=text)
+
+
+# columns of the columnar exports: (expression, kind of arrow column)
+def event_export_columns():
+    events = Event.__table__.c
+    return {
+        "id": (events.id, "int"),
+        "event_type": (cast(events.event_type, Text), "dictionary"),
+        "notebook_id": (events.notebook_id, "dictionary"),
+        "user_id": (events.user_id, "dictionary"),
+        "status": (events.status, "dictionary"),
+        "cell_input": (events.cell_input, "string"),
+        "cell_type": (events.cell_type, "dictionary"),
+        "cell_id": (events.cell_id, "dictionary"),
+        "orig_cell_id": (events.orig_cell_id, "dictionary"),
+        "language_mimetype": (events.language_mimetype, "dictionary"),
+        "cell_output_length": (events.cell_output_length, "int"),
+        "click_type": (cast(events.click_type, Text), "dictionary"),
+        "click_duration": (events.click_duration, "float"),
+        "alteration_type": (cast(events.alteration_type, Text), "dictionary"),
+        "t_start": (events.t_start, "timestamp"),
+        "t_finish": (events.t_finish, "timestamp"),
+        # time is encoded in t_start or t_finish in CellExecution rows, not in time
+        "time": (func.coalesce(events.time, events.t_finish, events.t_start), "timestamp"),
+    }
+
+
+def unknown_export_columns(names):
+    export_columns = event_export_columns()
+    return [name for name in names if name not in export_columns]
+
+
+def _notebook_events(statement, notebook_id, t1, t2):
+    events = Event.__table__.c
+    statement = statement.where(events.notebook_id == notebook_id)
+    # event_time is t_start for markdown executions, t_finish for code executions and time for the others
+    if t1 is not None:
+        statement = statement.where(events.event_time >= t1)
+    if t2 is not None:
+        statement = statement.where(events.event_time <= t2)
+    return statement
+
+
+# the events of a notebook as exported in CSV, between t1 and t2 when they are not None
+def notebook_csv_statement(notebook_id, t1, t2):
+    events = Event.__table__.c
+    statement = select(
+        events.id,
+        # all the events share one table, the event type holds what used to be the name of their table
+        events.event_type.label("__tablename__"),
+        events.notebook_id,
+        events.user_id,
+        events.status,
+        events.cell_input,  # cell_output_model
+        events.cell_type,
+        events.cell_id,
+        events.orig_cell_id,
+        enum_repr(events.click_type, ClickType).label("click_type"),
+        float_repr(events.click_duration).label("click_duration"),
+        enum_repr(events.alteration_type, AlterationType).label("alteration_type"),
+        # time is encoded in t_start or t_finish in CellExecution rows, not in time
+        iso_time(func.coalesce(events.time, events.t_finish, events.t_start)).label("time (UTC !)"),
+    )
+    return _notebook_events(statement, notebook_id, t1, t2)
+
+
+# the given columns of the events of a notebook, and the kinds of these columns
+def notebook_columnar_statement(notebook_id, names, t1, t2):
+    export_columns = event_export_columns()
+    statement = select(*[export_columns[name][0].label(name) for name in names])
+    return _notebook_events(statement, notebook_id, t1, t2), [export_columns[name][1] for name in names]
+
+
+# streams the rows of a select statement as CSV, with a header of their labels, straight from postgres with COPY
+def copy_csv(statement):
+    # COPY does not take server-side parameters, psycopg binds them client-side
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+    connection = db.session.connection().connection.dbapi_connection
+
+    with connection.cursor() as cursor:
+        with cursor.copy(
+            f"COPY ({compiled.string}) TO STDOUT WITH (FORMAT csv, HEADER)", compiled.params
+        ) as copy:
+            chunk = bytearray()
+            for data in copy:
+                chunk += data
+                if len(chunk) >= EXPORT_CHUNK_SIZE:
+                    yield bytes(chunk)
+                    chunk.clear()
+            if chunk:
+                yield bytes(chunk)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# the CSV download of a select statement, gzip encoded if the client accepts it
+def csv_export_response(statement, filename):
+    chunks = copy_csv(statement)
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+    if gzipped:
+        chunks = gzip_chunks(chunks)
+
+    # stream the response as the data is copied
+    response = Response(stream_with_context(chunks), mimetype="text/csv")
+    if gzipped:
+        response.headers.set("Content-Encoding", "gzip")
+    response.headers.set("Vary", "Accept-Encoding")
+    # add the filename
+    response.headers.set("Content-Disposition", "attachment", filename=filename)
+    response.headers.set("Access-Control-Expose-Headers", "Content-Disposition")
+    return response
+
+
+# arrow types of the kinds of columns of the columnar exports, the ids and enums are dictionary-encoded per batch
+COLUMN_KINDS = ("int", "float", "timestamp", "string", "dictionary")
+
+COLUMNAR_FORMATS = {
+    # format: (extension, mimetype)
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrows", "application/vnd.apache.arrow.stream"),
+}
+
+
+def columnar_export_available():
+    return pa is not None
+
+
+def _arrow_type(kind):
+    return {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "timestamp": pa.timestamp("us", tz="UTC"),  # the times are stored in UTC, without a time zone
+        "string": pa.large_string(),
+        "dictionary": pa.dictionary(pa.int32(), pa.string()),
+    }[kind]
+
+
+def _arrow_array(values, kind):
+    if kind == "dictionary":
+        return pa.array(values, pa.string()).dictionary_encode()
+    return pa.array(values, _arrow_type(kind))
+
+
+class _ChunkSink:
+    """Write-only file the arrow writers write to, drained after every batch so the output is streamed."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+# streams the rows of a select statement as parquet or an arrow IPC stream, one record batch per batch of rows
+# fetched from a server-side cursor, kinds being the COLUMN_KINDS of its columns
+def columnar_chunks(statement, kinds, format):
+    names = [column.name for column in statement.selected_columns]
+    schema = pa.schema([pa.field(name, _arrow_type(kind)) for name, kind in zip(names, kinds)])
+    sink = _ChunkSink()
+    if format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        # the dictionaries of the batches differ, which the stream format allows but not the file format
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    result = db.session.execute(statement, execution_options={"yield_per": EXPORT_BATCH_ROWS})
+    for rows in result.partitions():
+        columns = zip(*rows)
+        batch = pa.record_batch(
+            [_arrow_array(values, kind) for values, kind in zip(columns, kinds)], schema=schema
+        )
+        writer.write_batch(batch)
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+# the parquet or arrow download of a select statement, already compressed by the writers
+def columnar_export_response(statement, kinds, format, filename):
+    extension, mimetype = COLUMNAR_FORMATS[format]
+    chunks = columnar_chunks(statement, kinds, format)
+
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers.set("Content-Disposition", "attachment", filename=f"{filename}.{extension}")
+    response.headers.set("Access-Control-Expose-Headers", "Content-Disposition")
+    return response
@@ -0,0 +1,304 @@
+import datetime
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from flask import current_app, request, Response, stream_with_context
+from werkzeug.datastructures import ContentRange
+from app import db, redis_client
+from app.utils.constants import (
+    EXPORT_JOB_QUEUE_KEY,
+    EXPORT_JOB_TTL,
+    EXPORT_JOB_DEDUPE_TTL,
+    EXPORT_WORKER_TIMEOUT,
+    EXPORT_JOB_MAX_ATTEMPTS,
+    S3_PATH_EXPORTS,
+    EXPORT_FILES_KEY,
+)
+from app.utils.export import (
+    EXPORT_CHUNK_SIZE,
+    COLUMNAR_FORMATS,
+    copy_csv,
+    columnar_chunks,
+    notebook_csv_statement,
+    notebook_columnar_statement,
+)
+from app.utils.storage import upload_chunks_to_volume, read_volume_range, delete_from_volume
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
+
+EXPORT_FORMATS = {
+    # format: (extension, mimetype)
+    "csv": ("csv", "text/csv"),
+    **COLUMNAR_FORMATS,
+}
+
+JOB_KEY_PREFIX = "export_job:"
+WORKER_KEY_PREFIX = "export_worker:"
+PROCESSING_KEY_PREFIX = "export_jobs_processing:"
+
+# identical requests are given the job already queued or running for them, if any, a new job is queued otherwise
+# KEYS: in-flight request, new job, queue / ARGV: job key prefix, new job id, request ttl, job ttl, new job fields
+_submit = redis_client.register_script("""
+local job_id = redis.call('GET', KEYS[1])
+if job_id then
+    local status = redis.call('HGET', ARGV[1] .. job_id, 'status')
+    if status == 'queued' or status == 'running' then
+        return job_id
+    end
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+for field, value in pairs(cjson.decode(ARGV[5])) do
+    redis.call('HSET', KEYS[2], field, value)
+end
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('LPUSH', KEYS[3], ARGV[2])
+return ARGV[2]
+""")
+
+# the request stops being in flight once its job is over, unless it was already given to a newer job
+_release_request = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+# the jobs taken by a dead exporter are queued again, or failed once they were attempted EXPORT_JOB_MAX_ATTEMPTS times
+# KEYS: exporter heartbeat, its processing list, queue / ARGV: job key prefix, max attempts, now
+# returns the ids of the failed jobs
+_recover_jobs = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return {}
+end
+local failed = {}
+for _, job_id in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    local job_key = ARGV[1] .. job_id
+    local status = redis.call('HGET', job_key, 'status')
+    -- the jobs that expired or were over before the exporter died are dropped
+    if status == 'queued' or status == 'running' then
+        if tonumber(redis.call('HGET', job_key, 'attempts') or '0') >= tonumber(ARGV[2]) then
+            redis.call('HSET', job_key, 'status', 'failed', 'error', 'The exporter running the job stopped', 'finished_at', ARGV[3])
+            table.insert(failed, job_id)
+        else
+            redis.call('HSET', job_key, 'status', 'queued')
+            redis.call('RPUSH', KEYS[3], job_id)
+        end
+    end
+end
+redis.call('DEL', KEYS[2])
+return failed
+""")
+
+
+def _job_key(job_id):
+    return JOB_KEY_PREFIX + job_id
+
+
+def _request_key(notebook_id, export_format, params):
+    digest = hashlib.sha256(
+        json.dumps([notebook_id, export_format, params], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return f"export_request:{digest}"
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+# queues the export of the events of a notebook, params being the t1, t2 (as strings) and columns of the export
+def submit_export_job(notebook_id, export_format, params):
+    fields = {
+        "status": "queued",
+        "notebook_id": notebook_id,
+        "format": export_format,
+        "params": json.dumps(params),
+        "created_at": _now(),
+    }
+    job_id = str(uuid.uuid4())
+    job_id = _submit(
+        keys=[_request_key(notebook_id, export_format, params), _job_key(job_id), EXPORT_JOB_QUEUE_KEY],
+        args=[
+            JOB_KEY_PREFIX,
+            job_id,
+            int(EXPORT_JOB_DEDUPE_TTL.total_seconds()),
+            int(EXPORT_JOB_TTL.total_seconds()),
+            json.dumps(fields),
+        ],
+    )
+    return job_id.decode("utf-8") if isinstance(job_id, bytes) else job_id
+
+
+# the fields of a job, None if it does not exist (anymore)
+def get_export_job(job_id):
+    job = redis_client.hgetall(_job_key(job_id))
+    if not job:
+        return None
+    return {field.decode("utf-8"): value.decode("utf-8") for field, value in job.items()}
+
+
+def export_job_status(job_id, job):
+    status = {"job_id": job_id, "status": job["status"], "format": job["format"], "created_at": job["created_at"]}
+    for field in ("started_at", "finished_at", "error"):
+        if field in job:
+            status[field] = job[field]
+    if "size" in job:
+        status["size"] = int(job["size"])
+    return status
+
+
+def _export_chunks(job):
+    params = json.loads(job["params"])
+    t1 = datetime.datetime.strptime(params["t1"], TIME_FORMAT) if params.get("t1") else None
+    t2 = datetime.datetime.strptime(params["t2"], TIME_FORMAT) if params.get("t2") else None
+    if job["format"] == "csv":
+        return copy_csv(notebook_csv_statement(job["notebook_id"], t1, t2))
+    statement, kinds = notebook_columnar_statement(job["notebook_id"], params["columns"], t1, t2)
+    return columnar_chunks(statement, kinds, job["format"])
+
+
+def run_export_job(job_id):
+    job = get_export_job(job_id)
+    # expired before a worker got to it
+    if job is None:
+        return
+
+    job_key = _job_key(job_id)
+    request_key = _request_key(job["notebook_id"], job["format"], json.loads(job["params"]))
+    extension, _ = EXPORT_FORMATS[job["format"]]
+    object_key = f"{S3_PATH_EXPORTS}{job['notebook_id']}/{job_id}.{extension}"
+    redis_client.hset(job_key, mapping={"status": "running", "started_at": _now()})
+    redis_client.hincrby(job_key, "attempts", 1)
+    # registered before it is written, so the file is deleted with its job even if the upload is interrupted
+    redis_client.zadd(EXPORT_FILES_KEY, {object_key: time.time()})
+
+    try:
+        # the data is streamed from the database to the storage, never held in memory as a whole
+        chunks = _export_chunks(job)
+        size = 0
+
+        def counted(chunks):
+            nonlocal size
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+
+        upload_chunks_to_volume(os.environ.get("S3_BUCKET_NAME"), object_key, counted(chunks))
+        redis_client.hset(
+            job_key, mapping={"status": "done", "object_key": object_key, "size": size, "finished_at": _now()}
+        )
+        current_app.logger.info(f"Export job {job_id} done, {size} bytes")
+    except Exception as e:
+        current_app.logger.exception(f"Export job {job_id} failed")
+        redis_client.hset(job_key, mapping={"status": "failed", "error": str(e), "finished_at": _now()})
+    finally:
+        db.session.remove()
+        _release_request(keys=[request_key], args=[job_id])
+
+
+# keeps the key of an exporter alive as long as its process is, whatever the job it runs
+def _heartbeat(worker_key):
+    while True:
+        time.sleep(EXPORT_WORKER_TIMEOUT.total_seconds() / 10)
+        redis_client.set(worker_key, 1, ex=EXPORT_WORKER_TIMEOUT)
+
+
+def _release_failed_jobs(job_ids):
+    for job_id in job_ids:
+        job_id = job_id.decode("utf-8")
+        job = get_export_job(job_id)
+        if job is not None:
+            _release_request(
+                keys=[_request_key(job["notebook_id"], job["format"], json.loads(job["params"]))], args=[job_id]
+            )
+        current_app.logger.warning(f"Export job {job_id} failed, its exporter stopped {EXPORT_JOB_MAX_ATTEMPTS} times")
+
+
+# queues again the jobs of the exporters that stopped without finishing them
+def recover_export_jobs():
+    for processing_key in redis_client.scan_iter(match=PROCESSING_KEY_PREFIX + "*"):
+        worker_name = processing_key.decode("utf-8")[len(PROCESSING_KEY_PREFIX):]
+        failed = _recover_jobs(
+            keys=[WORKER_KEY_PREFIX + worker_name, processing_key, EXPORT_JOB_QUEUE_KEY],
+            args=[JOB_KEY_PREFIX, EXPORT_JOB_MAX_ATTEMPTS, _now()],
+        )
+        _release_failed_jobs(failed)
+
+
+# deletes the files of the jobs that expired, and returns how many were deleted
+def prune_export_files():
+    expired = redis_client.zrangebyscore(EXPORT_FILES_KEY, "-inf", time.time() - EXPORT_JOB_TTL.total_seconds())
+    n_deleted = 0
+    for object_key in expired:
+        # another exporter may be deleting it too
+        if not redis_client.zrem(EXPORT_FILES_KEY, object_key):
+            continue
+        try:
+            delete_from_volume(os.environ.get("S3_BUCKET_NAME"), object_key.decode("utf-8"))
+            n_deleted += 1
+        except Exception:
+            current_app.logger.exception(f"Deleting the export file {object_key} failed")
+            # tried again at the next pruning
+            redis_client.zadd(EXPORT_FILES_KEY, {object_key: 0})
+    return n_deleted
+
+
+# the jobs are moved to a processing list of the exporter while they run, so those of a dead exporter are not lost
+def run_export_worker(worker_name=None, block_s=5):
+    worker_name = worker_name or f"{socket.gethostname()}-{os.getpid()}"
+    worker_key = WORKER_KEY_PREFIX + worker_name
+    processing_key = PROCESSING_KEY_PREFIX + worker_name
+    current_app.logger.info(f"Export worker {worker_name} started")
+
+    # the jobs left in the processing list by the previous run under that name are queued again
+    redis_client.delete(worker_key)
+    recover_export_jobs()
+    prune_export_files()
+    redis_client.set(worker_key, 1, ex=EXPORT_WORKER_TIMEOUT)
+    threading.Thread(target=_heartbeat, args=(worker_key,), daemon=True).start()
+
+    last_maintenance = time.monotonic()
+    while True:
+        if time.monotonic() - last_maintenance >= EXPORT_WORKER_TIMEOUT.total_seconds():
+            recover_export_jobs()
+            prune_export_files()
+            last_maintenance = time.monotonic()
+
+        job_id = redis_client.blmove(EXPORT_JOB_QUEUE_KEY, processing_key, block_s, "RIGHT", "LEFT")
+        if job_id:
+            run_export_job(job_id.decode("utf-8"))
+            redis_client.lrem(processing_key, 0, job_id)
+
+
+# the file of a done job, or the part of it asked for with a Range header to resume an interrupted download
+def export_job_download_response(job_id, job):
+    extension, mimetype = EXPORT_FORMATS[job["format"]]
+    size = int(job["size"])
+    start, stop = 0, size
+
+    # a Range with an If-Range for another file (another job id) gets the whole file
+    if_range = request.if_range
+    range_applies = request.range is not None and if_range.date is None and if_range.etag in (None, job_id)
+    if range_applies:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response = Response(status=416)
+            response.content_range = ContentRange("bytes", None, None, size)
+            return response
+        start, stop = byte_range
+
+    chunks = read_volume_range(os.environ.get("S3_BUCKET_NAME"), job["object_key"], start, stop, EXPORT_CHUNK_SIZE)
+    response = Response(stream_with_context(chunks), status=206 if range_applies else 200, mimetype=mimetype)
+    response.content_length = stop - start
+    if range_applies:
+        response.content_range = ContentRange("bytes", start, stop, size)
+    response.headers.set("Accept-Ranges", "bytes")
+    # the job id identifies the file, clients resume with If-Range set to it
+    response.set_etag(job_id)
+    response.headers.set("Content-Disposition", "attachment", filename=f"log_{job['notebook_id']}.{extension}")
+    response.headers.set("Access-Control-Expose-Headers", "Content-Disposition, ETag, Content-Range")
+    return response
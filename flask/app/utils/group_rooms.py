@@ -0,0 +1,70 @@
+from flask_socketio import join_room, leave_room, close_room
+from app import socketio, redis_client
+from app.utils.constants import STUDENT_SOCKETS_TTL
+from app.utils.teammates import get_user_groups
+
+# the connected students are in a room per group, so the teammate events are emitted once to the rooms of the groups of
+# the sender rather than once per teammate. The socket ids of each student are kept to exclude all the sockets of the
+# sender, and to move the sockets into or out of the rooms when the groups change
+
+NAMESPACE = "/"
+
+
+def group_room(group_pk):
+    return f"group_{group_pk}"
+
+
+def _sockets_key(notebook_id, user_id):
+    return f"student_sockets:{notebook_id}:{user_id}"
+
+
+def _student_sids(notebook_id, user_ids):
+    pipe = redis_client.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.smembers(_sockets_key(notebook_id, user_id))
+    return {
+        user_id: [sid.decode("utf-8") for sid in sids]
+        for user_id, sids in zip(user_ids, pipe.execute())
+    }
+
+
+# to call on connection, joins the rooms of the groups of the student
+def register_student_socket(notebook_id, user_id, sid):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.sadd(_sockets_key(notebook_id, user_id), sid)
+    pipe.expire(_sockets_key(notebook_id, user_id), STUDENT_SOCKETS_TTL)
+    pipe.execute()
+    for group_pk in get_user_groups(notebook_id, user_id):
+        join_room(group_room(group_pk), sid=sid, namespace=NAMESPACE)
+
+
+# to call on disconnection, the socket leaves its rooms on its own
+def unregister_student_socket(notebook_id, user_id, sid):
+    redis_client.srem(_sockets_key(notebook_id, user_id), sid)
+
+
+# emits the event once to the rooms of the groups of the student, none of the sockets of the student receive it
+def emit_to_teammates(notebook_id, user_id, event, data):
+    rooms = [group_room(group_pk) for group_pk in get_user_groups(notebook_id, user_id)]
+    if not rooms:
+        return
+    socketio.emit(
+        event, data, to=rooms, skip_sid=_student_sids(notebook_id, [user_id])[user_id], namespace=NAMESPACE
+    )
+
+
+# to call once users are added to or removed from a group, moves their connected sockets
+def enter_group_room(notebook_id, group_pk, user_ids):
+    for sids in _student_sids(notebook_id, list(user_ids)).values():
+        for sid in sids:
+            join_room(group_room(group_pk), sid=sid, namespace=NAMESPACE)
+
+
+def leave_group_room(notebook_id, group_pk, user_ids):
+    for sids in _student_sids(notebook_id, list(user_ids)).values():
+        for sid in sids:
+            leave_room(group_room(group_pk), sid=sid, namespace=NAMESPACE)
+
+
+def close_group_room(group_pk):
+    close_room(group_room(group_pk), namespace=NAMESPACE)
@@ -0,0 +1,391 @@
+import datetime
+import json
+import os
+import socket
+import time
+from flask import current_app
+from app import db, redis_client
+from app.models.models import (
+    CellExecution,
+    CellClickEvent,
+    NotebookClickEvent,
+    CellAlteration,
+    ClickType,
+    AlterationType,
+    PendingUpdateInteraction,
+    PendingUpdateAction,
+)
+from app.utils.utils import hash_user_id_with_salt
+from app.utils.rollups import update_dashboard_projections
+from app.utils.partitions import run_scheduled_partition_maintenance
+from app.utils.cache import invalidate_dashboard_cache
+from app.utils.dashboard_push import request_dashboard_refresh
+from app.utils.constants import (
+    INGEST_MODE,
+    INGEST_STREAM_KEY,
+    INGEST_DEAD_LETTER_STREAM_KEY,
+    INGEST_DEAD_LETTER_MAX_LENGTH,
+    INGEST_CONSUMER_GROUP,
+    INGEST_FLUSH_BATCH_SIZE,
+    INGEST_CLAIM_IDLE_TIME,
+    INGEST_RETRY_DELAY,
+    CELL_OUTPUT_PREVIEW_MAX_SIZE,
+    CELL_OUTPUT_PREVIEW_TEXT_LENGTH,
+)
+from redis.exceptions import ResponseError
+from sqlalchemy.exc import OperationalError, InterfaceError, IntegrityError, DataError, StatementError
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
+
+# errors of the database itself (outage, restart, lost connection), which the entries of a batch are not the cause of
+INGEST_UNAVAILABLE_ERRORS = (OperationalError, InterfaceError)
+# errors of the rows of a batch, checked after INGEST_UNAVAILABLE_ERRORS as StatementError is their base class
+INGEST_ROW_ERRORS = (IntegrityError, DataError, StatementError)
+
+
+def parse_time(time_str):
+    return datetime.datetime.strptime(time_str, TIME_FORMAT)
+
+
+def _truncate_text(text):
+    # nbformat allows multiline strings to be split in a list of lines
+    if isinstance(text, list):
+        text = "".join(text)
+    return text[:CELL_OUTPUT_PREVIEW_TEXT_LENGTH]
+
+
+def _trim_output(output):
+    trimmed = {"output_type": output.get("output_type")}
+    if "name" in output:
+        trimmed["name"] = output["name"]
+        trimmed["text"] = _truncate_text(output.get("text", ""))
+    if "data" in output:
+        # only the plain text of rich outputs is kept, images and html are dropped
+        plain_text = output["data"].get("text/plain")
+        trimmed["data"] = {"text/plain": _truncate_text(plain_text)} if plain_text else {}
+        trimmed["metadata"] = {}
+        if "execution_count" in output:
+            trimmed["execution_count"] = output["execution_count"]
+    if "ename" in output:
+        trimmed["ename"] = output["ename"]
+        trimmed["evalue"] = _truncate_text(output.get("evalue", ""))
+        trimmed["traceback"] = [_truncate_text("\n".join(output.get("traceback", [])))]
+    return trimmed
+
+
+# returns the outputs as is if they are small enough, a trimmed version of them otherwise, and whether it was trimmed
+def build_output_preview(output_model):
+    if not output_model or len(json.dumps(output_model)) <= CELL_OUTPUT_PREVIEW_MAX_SIZE:
+        return output_model, False
+
+    preview = []
+    size = 0
+    for output in output_model:
+        trimmed = _trim_output(output)
+        size += len(json.dumps(trimmed))
+        if size > CELL_OUTPUT_PREVIEW_MAX_SIZE:
+            break
+        preview.append(trimmed)
+    return preview, True
+
+
+# the builders below turn a /send payload, with hashed user ids, into the row to insert, they raise on malformed payloads
+
+
+# the enum values are checked while building, the database would otherwise reject the whole transaction of the event
+def _enum_member(enum_class, name):
+    try:
+        return enum_class[name]
+    except KeyError:
+        raise ValueError(f"Invalid {enum_class.__name__}: {name}")
+
+
+def build_code_exec(data):
+    cell_output_preview, cell_output_truncated = build_output_preview(
+        data["cell_output_model"]
+    )
+    return CellExecution(
+        notebook_id=data["notebook_id"],
+        user_id=data["user_id"],
+        cell_id=data["cell_id"],
+        orig_cell_id=data["orig_cell_id"],
+        t_start=parse_time(data["t_start"]),
+        cell_input=data["cell_input"],
+        cell_type="CodeExecution",
+        language_mimetype=data["language_mimetype"],
+        t_finish=parse_time(data["t_finish"]),
+        status=data["status"],
+        cell_output_model=data["cell_output_model"],
+        cell_output_preview=cell_output_preview,
+        cell_output_truncated=cell_output_truncated,
+        cell_output_length=data["cell_output_length"],
+    )
+
+
+def build_markdown_exec(data):
+    return CellExecution(
+        notebook_id=data["notebook_id"],
+        user_id=data["user_id"],
+        cell_id=data["cell_id"],
+        orig_cell_id=data["orig_cell_id"],
+        t_start=parse_time(data["time"]),
+        cell_input=data["cell_content"],
+        cell_type="MarkdownExecution",
+    )
+
+
+def build_cell_click_event(data):
+    return CellClickEvent(
+        notebook_id=data["notebook_id"],
+        user_id=data["user_id"],
+        cell_id=data["cell_id"],
+        orig_cell_id=data["orig_cell_id"],
+        time=parse_time(data["time"]),
+        click_duration=data["click_duration"],
+        click_type=_enum_member(ClickType, data["click_type"]),
+    )
+
+
+def build_notebook_click_event(data):
+    return NotebookClickEvent(
+        notebook_id=data["notebook_id"],
+        user_id=data["user_id"],
+        time=parse_time(data["time"]),
+        click_duration=data["click_duration"],
+        click_type=_enum_member(ClickType, data["click_type"]),
+    )
+
+
+def build_alter_event(data):
+    return CellAlteration(
+        notebook_id=data["notebook_id"],
+        user_id=data["user_id"],
+        cell_id=data["cell_id"],
+        alteration_type=_enum_member(AlterationType, data["alteration_type"]),
+        time=parse_time(data["time"]),
+    )
+
+
+def build_pending_update_interaction(data):
+    return PendingUpdateInteraction(
+        notebook_id=data["notebook_id"],
+        user_id=data["user_id"],
+        cell_id=data.get("cell_id"),  # optional
+        update_id=data.get("update_id"),
+        action=_enum_member(PendingUpdateAction, data.get("action")),
+        # hashed user_id of the sender, if provided
+        sender=data.get("sender") or None,
+        sender_type=data.get("sender_type"),  # 'teacher' or 'teammate'
+        timestamp=parse_time(data["time"]),
+    )
+
+
+# event types accepted by /send/batch, named after the single-event /send routes
+EVENT_BUILDERS = {
+    "exec/code": build_code_exec,
+    "exec/markdown": build_markdown_exec,
+    "clickevent/cell": build_cell_click_event,
+    "clickevent/notebook": build_notebook_click_event,
+    "alter": build_alter_event,
+    "pending_update_interaction": build_pending_update_interaction,
+}
+
+
+# the user ids of the payloads are hashed before the payloads are persisted or pushed to the ingestion stream
+def hash_user_ids(data):
+    hashed = dict(data)
+    hashed["user_id"] = hash_user_id_with_salt(data["user_id"])
+    # the sender is optional
+    if data.get("sender"):
+        hashed["sender"] = hash_user_id_with_salt(data["sender"])
+    return hashed
+
+
+def build_hashed_event(event_type, data):
+    builder = EVENT_BUILDERS.get(event_type)
+    if builder is None:
+        raise ValueError(f"Unknown event type: {event_type}")
+    return builder(data)
+
+
+# the row of a /send payload as received, with the raw user ids
+def build_event(event_type, data):
+    return build_hashed_event(event_type, hash_user_ids(data))
+
+
+### Persisting the events ###
+
+
+def save_event(event_type, data):
+    save_events([(event_type, data, build_event(event_type, data))])
+
+
+# persist a list of (event_type, data, built_event), in a single transaction or a single stream push depending on the INGEST_MODE
+def save_events(typed_events):
+    if INGEST_MODE == "stream":
+        # the events were built to validate the payloads, but the flusher rebuilds them from the data, whose user ids
+        # are hashed first so the raw ones are never stored
+        pipe = redis_client.pipeline(transaction=False)
+        for event_type, data, _ in typed_events:
+            pipe.xadd(
+                INGEST_STREAM_KEY,
+                {"type": event_type, "data": json.dumps(hash_user_ids(data))},
+            )
+        pipe.execute()
+    else:
+        # a single flush lets SQLAlchemy group the rows of each table into multi-row INSERTs
+        events = [event for _, _, event in typed_events]
+        db.session.add_all(events)
+        update_dashboard_projections(events)
+        db.session.commit()
+        for notebook_id in {event.notebook_id for event in events}:
+            invalidate_dashboard_cache(notebook_id)
+
+
+### Draining the ingestion stream (run by flusher.py) ###
+
+
+def ensure_consumer_group():
+    try:
+        redis_client.xgroup_create(
+            INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, id="0", mkstream=True
+        )
+    except ResponseError as e:
+        # the group already exists
+        if "BUSYGROUP" not in str(e):
+            raise e
+
+
+def _build_entry(fields):
+    # the user ids of the entries were hashed before they were pushed
+    return build_hashed_event(fields[b"type"].decode("utf-8"), json.loads(fields[b"data"]))
+
+
+def _acknowledge(entry_ids):
+    pipe = redis_client.pipeline()
+    pipe.xack(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, *entry_ids)
+    # acknowledged entries are not needed anymore, delete them to keep the stream small
+    pipe.xdel(INGEST_STREAM_KEY, *entry_ids)
+    pipe.execute()
+
+
+def _dead_letter(entry_id, fields, error):
+    redis_client.xadd(
+        INGEST_DEAD_LETTER_STREAM_KEY,
+        {**fields, b"entry_id": entry_id, b"error": str(error)},
+        maxlen=INGEST_DEAD_LETTER_MAX_LENGTH,
+        approximate=True,
+    )
+
+
+def _insert_events(events):
+    db.session.add_all(events)
+    update_dashboard_projections(events)
+    db.session.commit()
+
+
+# insert a batch of stream entries in one transaction and return the notebooks that received new events
+# the entries are left pending, and the error raised, when the database is unavailable: they are retried once claimed
+def flush_entries(entries):
+    # the entries inserted or set aside, acknowledged at the end
+    done_ids = []
+    built = []
+    for entry_id, fields in entries:
+        # entries deleted from the stream while pending are returned without fields
+        if fields is None:
+            done_ids.append(entry_id)
+            continue
+        try:
+            built.append((entry_id, fields, _build_entry(fields)))
+        except Exception as e:
+            # malformed entries would be retried forever, set them aside
+            _dead_letter(entry_id, fields, e)
+            done_ids.append(entry_id)
+
+    inserted = []
+    try:
+        try:
+            _insert_events([event for _, _, event in built])
+            inserted = built
+        except INGEST_UNAVAILABLE_ERRORS:
+            raise
+        except INGEST_ROW_ERRORS:
+            db.session.rollback()
+            # find the culprit(s) by inserting the entries one by one, so a single bad row does not block the stream
+            for entry_id, fields, event in built:
+                try:
+                    _insert_events([event])
+                    inserted.append((entry_id, fields, event))
+                except INGEST_UNAVAILABLE_ERRORS:
+                    raise
+                except INGEST_ROW_ERRORS as e:
+                    db.session.rollback()
+                    _dead_letter(entry_id, fields, e)
+                    done_ids.append(entry_id)
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        # acknowledging after the commit gives at-least-once delivery: a crash in between replays the batch
+        done_ids += [entry_id for entry_id, _, _ in inserted]
+        if done_ids:
+            _acknowledge(done_ids)
+
+        notebook_ids = {event.notebook_id for _, _, event in inserted}
+        for notebook_id in notebook_ids:
+            invalidate_dashboard_cache(notebook_id)
+            request_dashboard_refresh(notebook_id)
+    return notebook_ids
+
+
+# flushes the entries, and waits before going on if the database is unavailable, doubling the wait while it stays so
+def _flush_or_wait(entries, retry_delay):
+    try:
+        flush_entries(entries)
+        return INGEST_RETRY_DELAY
+    except INGEST_UNAVAILABLE_ERRORS:
+        current_app.logger.exception(
+            f"Database unavailable, {len(entries)} entries left pending, retrying in {retry_delay.total_seconds()}s"
+        )
+        time.sleep(retry_delay.total_seconds())
+        return min(retry_delay * 2, INGEST_CLAIM_IDLE_TIME)
+
+
+def run_flusher(consumer_name=None, batch_size=INGEST_FLUSH_BATCH_SIZE, block_ms=1000):
+    consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+    claim_idle_ms = int(INGEST_CLAIM_IDLE_TIME.total_seconds() * 1000)
+    ensure_consumer_group()
+    current_app.logger.info(f"Ingestion flusher {consumer_name} started")
+
+    last_claim = 0
+    retry_delay = INGEST_RETRY_DELAY
+    while True:
+        # periodically take over the entries left pending by crashed flushers (or by this one before a restart)
+        if time.monotonic() - last_claim >= claim_idle_ms / 1000:
+            last_claim = time.monotonic()
+            run_scheduled_partition_maintenance()
+            claim_start = "0-0"
+            while True:
+                claim_start, claimed, *_ = redis_client.xautoclaim(
+                    INGEST_STREAM_KEY,
+                    INGEST_CONSUMER_GROUP,
+                    consumer_name,
+                    min_idle_time=claim_idle_ms,
+                    start_id=claim_start,
+                    count=batch_size,
+                )
+                if claimed:
+                    retry_delay = _flush_or_wait(claimed, retry_delay)
+                if claim_start in (b"0-0", "0-0"):
+                    break
+
+        response = redis_client.xreadgroup(
+            INGEST_CONSUMER_GROUP,
+            consumer_name,
+            {INGEST_STREAM_KEY: ">"},
+            count=batch_size,
+            block=block_ms,
+        )
+        for _, entries in response or []:
+            if entries:
+                retry_delay = _flush_or_wait(entries, retry_delay)
@@ -0,0 +1,93 @@
+import threading
+import time
+from flask import current_app
+from app import socketio
+from app.utils.constants import LOCATION_UPDATE_RATE
+from app.utils.locations import set_location
+from app.utils.group_rooms import emit_to_teammates
+
+# the location updates of each socket are stored and broadcast at most LOCATION_UPDATE_RATE times per second: the
+# first update of an interval is flushed right away, the next ones wait for the end of the interval, where only the
+# latest of them is flushed. The sockets are handled by the worker they are connected to, so the state is in-process
+
+# per socket id, the location waiting for the end of the interval, the time of the last flush, and a lock held during
+# the flushes, which the disconnection waits for so no location is stored after it was cleared
+_pending_locations = {}
+_last_flushes = {}
+_socket_locks = {}
+_locations_lock = threading.Lock()
+location_update_stats = {"received": 0, "flushed": 0, "coalesced": 0}
+
+
+def _flush(notebook_id, user_id, cell_id, cell_index):
+    set_location(notebook_id, user_id, cell_id, cell_index)
+    emit_to_teammates(
+        notebook_id,
+        user_id,
+        "teammate_location_update",
+        {"userId": user_id, "cellId": cell_id, "cellIndex": cell_index},
+    )
+    location_update_stats["flushed"] += 1
+
+
+# flushes the location unless the socket disconnected, the lock of the socket being held
+def _flush_if_connected(sid, socket_lock, location):
+    with socket_lock:
+        with _locations_lock:
+            connected = _socket_locks.get(sid) is socket_lock
+        if connected:
+            _flush(*location)
+
+
+def _trailing_flush(app, sid, delay):
+    socketio.sleep(delay)
+    with _locations_lock:
+        location = _pending_locations.pop(sid, None)
+        socket_lock = _socket_locks.get(sid)
+        # the socket disconnected meanwhile
+        if location is None or socket_lock is None:
+            return
+        _last_flushes[sid] = time.monotonic()
+
+    with app.app_context():
+        try:
+            _flush_if_connected(sid, socket_lock, location)
+        except Exception:
+            current_app.logger.exception(f"Location update of socket {sid} failed")
+
+
+def submit_location(sid, notebook_id, user_id, cell_id, cell_index):
+    location = (notebook_id, user_id, cell_id, cell_index)
+    now = time.monotonic()
+    with _locations_lock:
+        location_update_stats["received"] += 1
+        socket_lock = _socket_locks.setdefault(sid, threading.Lock())
+        if sid in _pending_locations:
+            # replaces the location that was waiting, which is never sent
+            _pending_locations[sid] = location
+            location_update_stats["coalesced"] += 1
+            return
+
+        last_flush = _last_flushes.get(sid)
+        delay = 0 if last_flush is None else last_flush + 1 / LOCATION_UPDATE_RATE - now
+        if delay <= 0:
+            _last_flushes[sid] = now
+        else:
+            _pending_locations[sid] = location
+
+    if delay <= 0:
+        _flush_if_connected(sid, socket_lock, location)
+    else:
+        socketio.start_background_task(_trailing_flush, current_app._get_current_object(), sid, delay)
+
+
+# to call on disconnection before clearing the location, the location waiting is dropped and the flush in progress,
+# if any, is waited for
+def discard_socket(sid):
+    with _locations_lock:
+        _pending_locations.pop(sid, None)
+        _last_flushes.pop(sid, None)
+        socket_lock = _socket_locks.pop(sid, None)
+    if socket_lock is not None:
+        with socket_lock:
+            pass
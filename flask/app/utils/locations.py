@@ -0,0 +1,94 @@
+import json
+from datetime import datetime, timezone
+from sqlalchemy.dialects.postgresql import insert
+from app import db, redis_client
+from app.models.models import TeammateLocation, ConnectionType
+from app.utils.constants import TEAMMATE_LOCATION_TTL
+from app.utils.presence import queue_active_users, decode_active_users
+
+# the current cell of each student is kept in a redis hash per notebook, the user ids mapping to their location as
+# JSON. Hash fields cannot expire on their own, so each location holds its update time and is ignored once older than
+# TEAMMATE_LOCATION_TTL, while the hash of a notebook expires once none of its students moved for that long
+
+
+def _locations_key(notebook_id):
+    return f"teammate_locations:{notebook_id}"
+
+
+def set_location(notebook_id, user_id, cell_id, cell_index):
+    location = {
+        "cellId": cell_id,
+        "cellIndex": cell_index,
+        "updatedAt": datetime.now(timezone.utc).isoformat(),
+    }
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(_locations_key(notebook_id), user_id, json.dumps(location))
+    pipe.expire(_locations_key(notebook_id), TEAMMATE_LOCATION_TTL)
+    pipe.execute()
+
+
+def clear_location(notebook_id, user_id):
+    redis_client.hdel(_locations_key(notebook_id), user_id)
+
+
+def _is_recent(location, now):
+    return now - datetime.fromisoformat(location["updatedAt"]) <= TEAMMATE_LOCATION_TTL
+
+
+# the recent locations of the users among user_ids who are connected to the notebook, read in a single round trip
+def get_connected_locations(notebook_id, user_ids):
+    if not user_ids:
+        return []
+    pipe = redis_client.pipeline(transaction=False)
+    queue_active_users(pipe, ConnectionType.STUDENT, notebook_id)
+    pipe.hmget(_locations_key(notebook_id), user_ids)
+    connected_raw, locations_raw = pipe.execute()
+
+    connected = set(decode_active_users(connected_raw))
+    now = datetime.now(timezone.utc)
+    result = []
+    for user_id, location_raw in zip(user_ids, locations_raw):
+        if user_id not in connected or location_raw is None:
+            continue
+        location = json.loads(location_raw)
+        if _is_recent(location, now):
+            result.append({"userId": user_id, **location})
+    return result
+
+
+# copies the recent locations of every notebook to the TeammateLocation table, for the analyses
+def snapshot_locations():
+    now = datetime.now(timezone.utc)
+    n_locations = 0
+    for key in redis_client.scan_iter(match=_locations_key("*"), count=1000):
+        notebook_id = key.decode("utf-8").split(":", 1)[1]
+        rows = []
+        for user_id, location_raw in redis_client.hgetall(key).items():
+            location = json.loads(location_raw)
+            if _is_recent(location, now):
+                rows.append(
+                    {
+                        "user_id": user_id.decode("utf-8"),
+                        "notebook_id": notebook_id,
+                        "cell_id": location["cellId"],
+                        "cell_index": location["cellIndex"],
+                        "updated_at": datetime.fromisoformat(location["updatedAt"]),
+                    }
+                )
+        if not rows:
+            continue
+
+        statement = insert(TeammateLocation).values(rows)
+        db.session.execute(
+            statement.on_conflict_do_update(
+                constraint="unique_user_notebook_location",
+                set_={
+                    "cell_id": statement.excluded.cell_id,
+                    "cell_index": statement.excluded.cell_index,
+                    "updated_at": statement.excluded.updated_at,
+                },
+            )
+        )
+        db.session.commit()
+        n_locations += len(rows)
+    return n_locations
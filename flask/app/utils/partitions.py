@@ -0,0 +1,100 @@
+import datetime
+from flask import current_app
+from app import db, redis_client
+from sqlalchemy.sql import text
+from app.utils.constants import (
+    EVENT_PARTITION_WEEKS_AHEAD,
+    EVENT_PARTITION_MAINTENANCE_KEY,
+    EVENT_PARTITION_MAINTENANCE_INTERVAL,
+)
+
+# the Event table is range partitioned by week on event_time, each partition is named after the monday it starts on
+PARTITION_PREFIX = "Event_p"
+PARTITION_DATE_FORMAT = "%Y%m%d"
+
+
+def week_start(day):
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def partition_name(monday):
+    return f"{PARTITION_PREFIX}{monday.strftime(PARTITION_DATE_FORMAT)}"
+
+
+# returns the monday of each weekly partition currently attached to the Event table
+def list_event_partitions():
+    rows = db.session.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = '\"Event\"'::regclass"
+        )
+    ).all()
+    return sorted(
+        datetime.datetime.strptime(name[len(PARTITION_PREFIX):], PARTITION_DATE_FORMAT).date()
+        for (name,) in rows
+        if name.startswith(PARTITION_PREFIX)
+    )
+
+
+def create_event_partition(monday):
+    name = partition_name(monday)
+    bounds = {"lower": monday, "upper": monday + datetime.timedelta(weeks=1)}
+
+    # events of that week may already be in the default partition (e.g. clients with a clock ahead), and
+    # postgres refuses to attach a partition whose range has rows in the default one, so they are moved first
+    db.session.execute(text(f'CREATE TABLE "{name}" (LIKE "Event" INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING COMPRESSION)'))
+    db.session.execute(
+        text(
+            f'WITH moved AS (DELETE FROM "Event_default" WHERE event_time >= :lower AND event_time < :upper RETURNING *) '
+            f'INSERT INTO "{name}" SELECT * FROM moved'
+        ),
+        bounds,
+    )
+    db.session.execute(
+        text(f"ALTER TABLE \"Event\" ATTACH PARTITION \"{name}\" FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')")
+    )
+    db.session.commit()
+
+
+# the table is kept as a standalone table (archived), unless drop is set
+def detach_event_partition(monday, drop=False):
+    name = partition_name(monday)
+    db.session.execute(text(f'ALTER TABLE "Event" DETACH PARTITION "{name}"'))
+    if drop:
+        db.session.execute(text(f'DROP TABLE "{name}"'))
+    db.session.commit()
+
+
+# pre-creates the partitions of the coming weeks and detaches the ones that ended more than retention_weeks ago
+def maintain_event_partitions(weeks_ahead=EVENT_PARTITION_WEEKS_AHEAD, retention_weeks=None, drop=False):
+    this_week = week_start(datetime.date.today())
+    existing = set(list_event_partitions())
+
+    for week in range(weeks_ahead + 1):
+        monday = this_week + datetime.timedelta(weeks=week)
+        if monday not in existing:
+            create_event_partition(monday)
+            current_app.logger.info(f"Created partition {partition_name(monday)}")
+
+    if retention_weeks is not None:
+        oldest_kept = this_week - datetime.timedelta(weeks=retention_weeks)
+        for monday in existing:
+            if monday + datetime.timedelta(weeks=1) <= oldest_kept:
+                detach_event_partition(monday, drop=drop)
+                current_app.logger.info(
+                    f"{'Dropped' if drop else 'Detached'} partition {partition_name(monday)}"
+                )
+
+
+# runs maintain_event_partitions unless a process did in the last EVENT_PARTITION_MAINTENANCE_INTERVAL, called
+# periodically by the flushers so that the partitions keep being created ahead, by a single one of them at a time
+def run_scheduled_partition_maintenance():
+    if not redis_client.set(EVENT_PARTITION_MAINTENANCE_KEY, 1, nx=True, ex=EVENT_PARTITION_MAINTENANCE_INTERVAL):
+        return
+    try:
+        maintain_event_partitions()
+    except Exception:
+        db.session.rollback()
+        # retried by the next call rather than after a whole interval
+        redis_client.delete(EVENT_PARTITION_MAINTENANCE_KEY)
+        current_app.logger.exception("Event partition maintenance failed")
@@ -0,0 +1,110 @@
+import threading
+import time
+from flask import current_app
+from app import socketio, redis_client
+from app.models.models import ConnectionType
+from app.utils.cache import invalidate_dashboard_cache
+from app.utils.constants import PRESENCE_TIMEOUT, PRESENCE_HEARTBEAT_INTERVAL
+
+# the users connected to a notebook are kept in a redis sorted set per connection type, scored by the time of their
+# last heartbeat. Each worker refreshes the scores of the sockets it holds every PRESENCE_HEARTBEAT_INTERVAL, as long as
+# the engine.io pings keep them open, so the users of a crashed worker or a lost disconnection are not active anymore
+# after PRESENCE_TIMEOUT, and are swept from the sets
+
+# per socket id, the presence key and user id of the sockets connected to this worker
+_local_sockets = {}
+_sockets_lock = threading.Lock()
+_heartbeat_started = False
+
+
+def _presence_key(con_type, notebook_id):
+    return f"presence_{con_type.name.lower()}s:{notebook_id}"
+
+
+def _min_active_score():
+    return time.time() - PRESENCE_TIMEOUT.total_seconds()
+
+
+def _refresh(entries):
+    now = time.time()
+    pipe = redis_client.pipeline(transaction=False)
+    for key, user_id in entries:
+        pipe.zadd(key, {user_id: now})
+        # a set nobody refreshed for that long only holds inactive users
+        pipe.expire(key, PRESENCE_TIMEOUT)
+    pipe.execute()
+
+
+def mark_connected(con_type, notebook_id, user_id, sid):
+    key = _presence_key(con_type, notebook_id)
+    with _sockets_lock:
+        _local_sockets[sid] = (key, user_id)
+    _refresh([(key, user_id)])
+    _start_heartbeat()
+
+
+def mark_disconnected(con_type, notebook_id, user_id, sid):
+    with _sockets_lock:
+        _local_sockets.pop(sid, None)
+    # the other sockets of the user, if any, add them back with their next heartbeat
+    redis_client.zrem(_presence_key(con_type, notebook_id), user_id)
+
+
+# the users whose last heartbeat is more recent than PRESENCE_TIMEOUT
+def active_users(con_type, notebook_id):
+    return decode_active_users(
+        redis_client.zrangebyscore(_presence_key(con_type, notebook_id), _min_active_score(), "+inf")
+    )
+
+
+def is_active(con_type, notebook_id, user_id):
+    score = redis_client.zscore(_presence_key(con_type, notebook_id), user_id)
+    return score is not None and score >= _min_active_score()
+
+
+# to read the active users in a pipeline, decoded with decode_active_users
+def queue_active_users(pipe, con_type, notebook_id):
+    pipe.zrangebyscore(_presence_key(con_type, notebook_id), _min_active_score(), "+inf")
+
+
+def decode_active_users(user_ids):
+    return [user_id.decode("utf-8") for user_id in user_ids]
+
+
+# removes the inactive users from every presence set, and returns how many were removed
+def sweep_presence():
+    max_score = f"({_min_active_score()}"
+    student_prefix = _presence_key(ConnectionType.STUDENT, "")
+    n_removed = 0
+    for key in redis_client.scan_iter(match="presence_*s:*", count=1000):
+        removed = redis_client.zremrangebyscore(key, "-inf", max_score)
+        key = key.decode("utf-8")
+        # the real-time dashboard views only include the connected students
+        if removed and key.startswith(student_prefix):
+            invalidate_dashboard_cache(key[len(student_prefix):])
+        n_removed += removed
+    return n_removed
+
+
+def _heartbeat(app):
+    while True:
+        socketio.sleep(PRESENCE_HEARTBEAT_INTERVAL.total_seconds())
+        with _sockets_lock:
+            entries = list(_local_sockets.values())
+        with app.app_context():
+            try:
+                if entries:
+                    _refresh(entries)
+                sweep_presence()
+            except Exception:
+                current_app.logger.exception("Presence heartbeat failed")
+
+
+# started by the first connection to the worker
+def _start_heartbeat():
+    global _heartbeat_started
+    with _sockets_lock:
+        if _heartbeat_started:
+            return
+        _heartbeat_started = True
+    socketio.start_background_task(_heartbeat, current_app._get_current_object())
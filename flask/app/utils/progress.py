@@ -0,0 +1,104 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+
+@dataclass
+class ProgressSnapshot:
+    timestamp: datetime
+    mean: float
+    median: float
+    q1: float
+    q3: float
+    n_users: int
+
+
+class PositionHistogram:
+    """Number of users at each cell position, as a Fenwick tree so the k-th smallest position is found in O(log n_cells)."""
+
+    def __init__(self, n_positions):
+        self.size = n_positions
+        self.tree = [0] * (n_positions + 1)
+        self.count = 0
+        self.total = 0  # sum of the positions, for the mean
+
+    def add(self, position, delta):
+        self.count += delta
+        self.total += position * delta
+        while position <= self.size:
+            self.tree[position] += delta
+            position += position & -position
+
+    # position of the k-th user (0-indexed) when sorted by position
+    def kth(self, k):
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            next_position = position + step
+            if next_position <= self.size and self.tree[next_position] <= k:
+                position = next_position
+                k -= self.tree[next_position]
+            step >>= 1
+        return position + 1
+
+    def median(self):
+        half = self.count // 2
+        if self.count % 2:
+            return float(self.kth(half))
+        return (self.kth(half - 1) + self.kth(half)) / 2
+
+    # same values as statistics.quantiles(positions, n=4), whose default method is 'exclusive'
+    def quartiles(self):
+        n = self.count
+        m = n + 1
+        result = []
+        for i in range(1, 4):
+            j = min(max(i * m // 4, 1), n - 1)
+            delta = i * m - j * 4
+            result.append((self.kth(j - 1) * (4 - delta) + self.kth(j) * delta) / 4)
+        return result
+
+
+def build_snapshots(executions, cell_order, from_time, to_time):
+    """Snapshot, every minute from from_time to to_time, the distribution of the users' positions in the notebook.
+
+    The position of a user is the one of the cell of their last execution. executions are
+    (user_id, orig_cell_id, t_start) tuples sorted by t_start: they are swept once alongside the
+    minutes while the histogram of the positions is updated, instead of being rescanned every minute.
+    """
+    cell_position = {cid: i + 1 for i, cid in enumerate(cell_order)}
+    histogram = PositionHistogram(len(cell_order))
+    # position of the last execution of each user, None if that cell is not in cell_order
+    user_position = {}
+
+    snapshots = []
+    next_execution = 0
+    t = from_time
+    while t <= to_time:
+        while next_execution < len(executions) and executions[next_execution][2] <= t:
+            user_id, orig_cell_id, _ = executions[next_execution]
+            next_execution += 1
+
+            previous = user_position.get(user_id)
+            position = cell_position.get(orig_cell_id)
+            user_position[user_id] = position
+            if previous is not None:
+                histogram.add(previous, -1)
+            if position is not None:
+                histogram.add(position, 1)
+
+        if histogram.count == 1:
+            v = float(histogram.kth(0))
+            snapshots.append(ProgressSnapshot(t, v, v, v, v, 1))
+        elif histogram.count > 1:
+            q1, _, q3 = histogram.quartiles()
+            snapshots.append(ProgressSnapshot(
+                timestamp=t,
+                mean=histogram.total / histogram.count,
+                median=histogram.median(),
+                q1=q1,
+                q3=q3,
+                n_users=histogram.count,
+            ))
+        t += timedelta(minutes=1)
+
+    return snapshots
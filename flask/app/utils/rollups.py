@@ -0,0 +1,175 @@
+from bisect import bisect_right
+from collections import defaultdict
+from app import db
+from app.models.models import (
+    CellRollup,
+    LatestCellClick,
+    LatestCellExecution,
+    CellClickEvent,
+    CellExecution,
+    ClickType,
+    empty_duration_histogram,
+)
+from app.utils.constants import CELL_DURATION_OUTLIER_LIMIT, OFF_CLICK_DURATION_BINS
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import literal_column
+
+
+def rollup_bucket(event_time):
+    return event_time.replace(second=0, microsecond=0)
+
+
+# index of the OFF_CLICK_DURATION_BINS bin of a duration, same as width_bucket in postgres (1-based) minus one
+def duration_bin(duration):
+    return max(bisect_right(OFF_CLICK_DURATION_BINS, duration) - 1, 0)
+
+
+def _empty_rollup():
+    return {
+        "click_count": 0,
+        "off_click_histogram": empty_duration_histogram(),
+        "capped_duration_sum": 0,
+        "capped_duration_count": 0,
+        "code_exec_count": 0,
+        "code_exec_ok_count": 0,
+    }
+
+
+# element-wise sum of the stored and the new histograms
+_HISTOGRAM_SUM = literal_column(
+    'ARRAY(SELECT stored_count + new_count FROM unnest("CellRollup".off_click_histogram, excluded.off_click_histogram) '
+    "WITH ORDINALITY AS bins(stored_count, new_count, bin) ORDER BY bin)"
+)
+
+
+# adds the contribution of new events to the CellRollup rows, in the transaction that inserts the events
+def update_cell_rollups(events):
+    rollups = defaultdict(_empty_rollup)
+
+    for event in events:
+        if isinstance(event, CellClickEvent):
+            rollup = rollups[(event.notebook_id, event.cell_id, event.user_id, rollup_bucket(event.time))]
+            rollup["click_count"] += 1
+            if event.click_type == ClickType.OFF and event.click_duration is not None:
+                rollup["off_click_histogram"][duration_bin(event.click_duration)] += 1
+                if event.click_duration <= CELL_DURATION_OUTLIER_LIMIT:
+                    rollup["capped_duration_sum"] += event.click_duration
+                    rollup["capped_duration_count"] += 1
+
+        elif isinstance(event, CellExecution) and event.cell_type == "CodeExecution":
+            # same time as the event_time of the execution
+            execution_time = event.t_finish or event.t_start
+            rollup = rollups[(event.notebook_id, event.cell_id, event.user_id, rollup_bucket(execution_time))]
+            rollup["code_exec_count"] += 1
+            if event.status == "ok":
+                rollup["code_exec_ok_count"] += 1
+
+    if not rollups:
+        return
+
+    # sorted so concurrent transactions lock the rows in the same order and cannot deadlock
+    rows = [
+        {"notebook_id": key[0], "cell_id": key[1], "user_id": key[2], "bucket_start": key[3], **rollup}
+        for key, rollup in sorted(rollups.items(), key=lambda item: item[0])
+    ]
+    statement = insert(CellRollup).values(rows)
+    excluded = statement.excluded
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["notebook_id", "cell_id", "user_id", "bucket_start"],
+            set_={
+                "click_count": CellRollup.click_count + excluded.click_count,
+                "off_click_histogram": _HISTOGRAM_SUM,
+                "capped_duration_sum": CellRollup.capped_duration_sum + excluded.capped_duration_sum,
+                "capped_duration_count": CellRollup.capped_duration_count + excluded.capped_duration_count,
+                "code_exec_count": CellRollup.code_exec_count + excluded.code_exec_count,
+                "code_exec_ok_count": CellRollup.code_exec_ok_count + excluded.code_exec_ok_count,
+            },
+        )
+    )
+
+
+# moves the users to the cell of their last ON click, unless a later click was already recorded (events sent out of order)
+def update_latest_cell_clicks(events):
+    latest_clicks = {}
+    for event in events:
+        if isinstance(event, CellClickEvent) and event.click_type == ClickType.ON:
+            key = (event.notebook_id, event.user_id)
+            if key not in latest_clicks or latest_clicks[key].time <= event.time:
+                latest_clicks[key] = event
+
+    if not latest_clicks:
+        return
+
+    # sorted so concurrent transactions lock the rows in the same order and cannot deadlock
+    rows = [
+        {
+            "notebook_id": event.notebook_id,
+            "user_id": event.user_id,
+            "cell_id": event.cell_id,
+            "orig_cell_id": event.orig_cell_id,
+            "time": event.time,
+        }
+        for _, event in sorted(latest_clicks.items(), key=lambda item: item[0])
+    ]
+    statement = insert(LatestCellClick).values(rows)
+    excluded = statement.excluded
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["notebook_id", "user_id"],
+            set_={
+                "cell_id": excluded.cell_id,
+                "orig_cell_id": excluded.orig_cell_id,
+                "time": excluded.time,
+            },
+            where=LatestCellClick.time <= excluded.time,
+        )
+    )
+
+
+# same as the max(id) of the executions of each user on each cell, so the ids of the new events must be assigned
+def update_latest_cell_executions(events):
+    latest_executions = {}
+    for event in events:
+        if isinstance(event, CellExecution):
+            key = (event.notebook_id, event.cell_id, event.user_id)
+            if key not in latest_executions or latest_executions[key].id < event.id:
+                latest_executions[key] = event
+
+    if not latest_executions:
+        return
+
+    rows = [
+        {
+            "notebook_id": event.notebook_id,
+            "cell_id": event.cell_id,
+            "user_id": event.user_id,
+            "exec_id": event.id,
+            "event_time": event.event_time,
+            "t_start": event.t_start,
+            "input_length": len(event.cell_input or ""),
+            "output_length": event.cell_output_length or 0,
+        }
+        for _, event in sorted(latest_executions.items(), key=lambda item: item[0])
+    ]
+    statement = insert(LatestCellExecution).values(rows)
+    excluded = statement.excluded
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["notebook_id", "cell_id", "user_id"],
+            set_={
+                column: excluded[column]
+                for column in ("exec_id", "event_time", "t_start", "input_length", "output_length")
+            },
+            where=LatestCellExecution.exec_id < excluded.exec_id,
+        )
+    )
+
+
+# the tables derived from the events, updated in the transaction that inserts them
+def update_dashboard_projections(events):
+    # assigns the ids and event times of the new events
+    db.session.flush()
+    update_cell_rollups(events)
+    update_latest_cell_clicks(events)
+    update_latest_cell_executions(events)
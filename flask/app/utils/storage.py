@@ -1,5 +1,7 @@
 import os
+import tempfile
 import boto3
+import botocore
 
 # define the S3 client
 s3_client = boto3.client('s3')
@@ -38,3 +40,56 @@ def download_file_from_volume(bucket_name, object_key):
             else:
                 raise e
 
+def upload_chunks_to_volume(bucket_name, object_key, chunks):
+    # the chunks are spooled to disk so a large file is never held in memory
+    if os.environ.get('LOCAL_DEV') == 'true':
+        local_path = f'/app/S3/{bucket_name}/{object_key}'
+        local_dir = os.path.dirname(local_path)
+        if not os.path.exists(local_dir):
+            os.makedirs(local_dir)
+        # written next to its destination and renamed once complete, a partial file is never served
+        with tempfile.NamedTemporaryFile(dir=local_dir, delete=False) as local_file:
+            try:
+                for chunk in chunks:
+                    local_file.write(chunk)
+            except Exception:
+                os.remove(local_file.name)
+                raise
+        os.replace(local_file.name, local_path)
+    else:
+        with tempfile.TemporaryFile() as spooled_file:
+            for chunk in chunks:
+                spooled_file.write(chunk)
+            spooled_file.seek(0)
+            # upload_fileobj switches to a multipart upload for large files
+            s3_client.upload_fileobj(spooled_file, bucket_name, object_key)
+
+def read_volume_range(bucket_name, object_key, start, stop, chunk_size=65536):
+    # yields the bytes from start to stop (excluded) of the file, in chunks
+    if os.environ.get('LOCAL_DEV') == 'true':
+        local_path = f'/app/S3/{bucket_name}/{object_key}'
+        with open(local_path, 'rb') as local_file:
+            local_file.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = local_file.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    else:
+        if stop <= start:
+            return
+        s3_object = s3_client.get_object(Bucket=bucket_name, Key=object_key, Range=f'bytes={start}-{stop - 1}')
+        yield from s3_object['Body'].iter_chunks(chunk_size)
+
+def delete_from_volume(bucket_name, object_key):
+    # deleting a file that does not exist is not an error
+    if os.environ.get('LOCAL_DEV') == 'true':
+        local_path = f'/app/S3/{bucket_name}/{object_key}'
+        try:
+            os.remove(local_path)
+        except FileNotFoundError:
+            pass
+    else:
+        s3_client.delete_object(Bucket=bucket_name, Key=object_key)
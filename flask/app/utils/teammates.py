@@ -0,0 +1,97 @@
+import json
+import threading
+from collections import OrderedDict
+from app import db, redis_client
+from app.models.models import UserGroups, UserGroupAssociation
+from app.utils.constants import TEAMMATE_GRAPH_TTL, TEAMMATE_GRAPH_CACHE_MAX_SIZE
+
+# the teammates of each user of a notebook (the other members of their groups) and their groups are built at once from
+# the group tables and cached in redis and in each worker, tagged with the version of the groups of the notebook, which
+# the group routes increment. A lookup then costs the GET of that version, and the graph is only rebuilt once it changed
+
+# in-process LRU of the notebook ids mapped to the version and the teammates and groups of their graph
+_local_graphs = OrderedDict()
+_local_graphs_lock = threading.Lock()
+
+
+def _version_key(notebook_id):
+    return f"teammate_graph_version:{notebook_id}"
+
+
+def _graph_key(notebook_id):
+    return f"teammate_graph:{notebook_id}"
+
+
+# memberships are (group_pk, user_id) pairs, returns the sorted teammates and the sorted groups of each user in a group
+def build_teammate_graph(memberships):
+    group_members = {}
+    for group_pk, user_id in memberships:
+        group_members.setdefault(group_pk, set()).add(user_id)
+
+    teammates = {}
+    groups = {}
+    for group_pk, members in group_members.items():
+        for user_id in members:
+            teammates.setdefault(user_id, set()).update(members)
+            groups.setdefault(user_id, set()).add(group_pk)
+    return {
+        "teammates": {user_id: sorted(others - {user_id}) for user_id, others in teammates.items()},
+        "groups": {user_id: sorted(group_pks) for user_id, group_pks in groups.items()},
+    }
+
+
+def _load_graph(notebook_id):
+    memberships = (
+        db.session.query(UserGroupAssociation.c.group_pk, UserGroupAssociation.c.user_id)
+        .join(UserGroups, UserGroupAssociation.c.group_pk == UserGroups.group_pk)
+        .filter(UserGroups.notebook_id == notebook_id)
+        .all()
+    )
+    return build_teammate_graph(memberships)
+
+
+def _remember_graph(notebook_id, version, graph):
+    with _local_graphs_lock:
+        _local_graphs[notebook_id] = (version, graph)
+        _local_graphs.move_to_end(notebook_id)
+        while len(_local_graphs) > TEAMMATE_GRAPH_CACHE_MAX_SIZE:
+            _local_graphs.popitem(last=False)
+
+
+def _get_graph(notebook_id):
+    version = int(redis_client.get(_version_key(notebook_id)) or 0)
+
+    with _local_graphs_lock:
+        local = _local_graphs.get(notebook_id)
+    if local is not None and local[0] == version:
+        return local[1]
+
+    cached = redis_client.get(_graph_key(notebook_id))
+    if cached is not None:
+        cached = json.loads(cached)
+        if cached["version"] == version:
+            _remember_graph(notebook_id, version, cached["graph"])
+            return cached["graph"]
+
+    # read after the version, a graph built while the groups change is tagged with the old version and rebuilt next time
+    graph = _load_graph(notebook_id)
+    redis_client.set(_graph_key(notebook_id), json.dumps({"version": version, "graph": graph}), ex=TEAMMATE_GRAPH_TTL)
+    _remember_graph(notebook_id, version, graph)
+    return graph
+
+
+# the members of the groups of the user in the notebook, the user excluded
+def get_user_teammates(notebook_id, user_id):
+    return _get_graph(notebook_id)["teammates"].get(user_id, [])
+
+
+def get_user_groups(notebook_id, user_id):
+    return _get_graph(notebook_id)["groups"].get(user_id, [])
+
+
+# to call once the groups of a notebook are committed
+def invalidate_teammate_graph(notebook_id):
+    pipe = redis_client.pipeline()
+    pipe.incr(_version_key(notebook_id))
+    pipe.delete(_graph_key(notebook_id))
+    pipe.execute()
@@ -1,42 +1,59 @@
-from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask import Blueprint, request, jsonify
 import json
-from app import db, redis_client
+from app import db
 from app.models.models import (
     Notebook,
     Event,
     CellExecution,
-    CellClickEvent,
     NotebookClickEvent,
     CellAlteration,
-    UserGroupAssociation,
     UserGroups,
     PendingUpdateInteraction,
     PendingUpdateAction,
+    LatestCellExecution,
 )
+from app.models.auth import is_notebook_authorized
 from app.utils.utils import get_fetch_real_time, get_time_boundaries
-from sqlalchemy import func, and_, select, or_
-from sqlalchemy.orm import with_polymorphic
-from flask_jwt_extended import jwt_required, current_user
-import csv
-from io import StringIO
+from app.utils.progress import ProgressSnapshot, build_snapshots
+from app.utils.cache import (
+    get_progress_snapshots,
+    append_progress_snapshots,
+    cached_dashboard_response,
+)
+from app.utils.dashboard_views import (
+    getConnectedStudentUserIds,
+    connectedStudentsFilter,
+    getGroupsUserIdsSubquery,
+    getEventTimeFilter,
+    getViewFilters,
+    getCellExecutionData,
+    getCellAccessTimeData,
+    getCellAccessTimeHistogramData,
+    getCellDurationTimeData,
+    getTocData,
+)
+from app.utils.export import (
+    csv_export_response,
+    columnar_export_available,
+    columnar_export_response,
+    event_export_columns,
+    unknown_export_columns,
+    notebook_csv_statement,
+    notebook_columnar_statement,
+    COLUMNAR_FORMATS,
+)
+from app.utils.export_jobs import (
+    EXPORT_FORMATS,
+    submit_export_job,
+    get_export_job,
+    export_job_status,
+    export_job_download_response,
+)
+from sqlalchemy import func, and_, select, bindparam, any_, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import aliased
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, timedelta, timezone
-from dataclasses import dataclass
-from collections import defaultdict
-import statistics
-
-
-@dataclass
-class ProgressSnapshot:
-    timestamp: datetime
-    mean: float
-    median: float
-    q1: float
-    q3: float
-    n_users: int
-
-
-# keyed by (notebook_id, time_start_iso)
-_progress_cache: dict[tuple, list[ProgressSnapshot]] = {}
 
 
 dashboard_bp = Blueprint("dashboard", __name__)
@@ -57,50 +74,33 @@ def auth_check():
     notebook_id = request.view_args.get("notebook_id")
 
     # abort the request if the provided notebook_id is not among the loggedin user authorized notebooks
-    if all(
-        entry.notebook_id != notebook_id for entry in current_user.authorized_notebooks
-    ):
+    if not is_notebook_authorized(get_jwt_identity(), notebook_id):
         return jsonify({"status": "no_user_permission"}), 403
 
 
 ### Common utils for the queries
 
 
-def getConnectedStudentUserIds(notebook_id):
-    connected_student_ids = redis_client.smembers(
-        f"connected_students:{notebook_id}"
-    )  # Stored in the cache as bytes
-    return [user_id.decode("utf-8") for user_id in connected_student_ids]
-
-
-def getGroupsUserIdsSubquery(notebook_id, groups):
-    group_pks = [f"{group_name}-{notebook_id}" for group_name in groups]
-
-    return (
-        db.session.query(UserGroupAssociation.c.user_id)
-        .filter(UserGroupAssociation.c.group_pk.in_(group_pks))
-        .subquery()
-    )
-
-
+# snapshots every minute from from_time to to_time, of the positions reached since window_start
 def compute_snapshots(
     notebook_id: str,
     cell_order: list,
+    window_start: datetime,
     from_time: datetime,
     to_time: datetime,
     selected_groups,
 ) -> list[ProgressSnapshot]:
-    cell_position = {cid: i + 1 for i, cid in enumerate(cell_order)}
-
+    # the executions before from_time are needed too, they give the positions of the users at from_time
     query = db.session.query(
         CellExecution.user_id,
         CellExecution.orig_cell_id,
         CellExecution.t_start,
     ).filter(
         CellExecution.notebook_id == notebook_id,
-        CellExecution.t_start >= from_time,
+        CellExecution.t_start >= window_start,
         CellExecution.t_start <= to_time,
-    ).order_by(CellExecution.user_id, CellExecution.t_start)
+        Event.event_time >= window_start,
+    ).order_by(CellExecution.t_start, CellExecution.id)
 
     if selected_groups:
         query = query.filter(
@@ -109,40 +109,7 @@ def compute_snapshots(
             )
         )
 
-    rows = query.all()
-
-    user_events: dict[str, list[tuple]] = defaultdict(list)
-    for user_id, orig_cell_id, t_start in rows:
-        user_events[user_id].append((t_start, orig_cell_id))
-
-    snapshots = []
-    t = from_time
-    while t <= to_time:
-        positions = []
-        for uid, evts in user_events.items():
-            past = [cid for ts, cid in evts if ts <= t]
-            if past:
-                pos = cell_position.get(past[-1])
-                if pos is not None:
-                    positions.append(pos)
-
-        if positions:
-            if len(positions) == 1:
-                v = float(positions[0])
-                snapshots.append(ProgressSnapshot(t, v, v, v, v, 1))
-            else:
-                qs = statistics.quantiles(positions, n=4)
-                snapshots.append(ProgressSnapshot(
-                    timestamp=t,
-                    mean=statistics.mean(positions),
-                    median=statistics.median(positions),
-                    q1=qs[0],
-                    q3=qs[2],
-                    n_users=len(positions),
-                ))
-        t += timedelta(minutes=1)
-
-    return snapshots
+    return build_snapshots(query.all(), cell_order, from_time, to_time)
 
 
 ### Routes ###
@@ -161,228 +128,32 @@ def checkNotebook(notebook_id):
 ### Notebook dashboard ###
 
 
-@dashboard_bp.route("/<notebook_id>/user_code_execution", methods=["GET"])
-def listNotebookCellExecution(notebook_id):
-
-    t_start, t_end = get_time_boundaries(request.args)
-    # if t_end is defined, real time is ignored and set to False since what happens in real-time is not included anymore
-    fetch_real_time = get_fetch_real_time(request.args, t_end)
-    if fetch_real_time:
-        connected_students = getConnectedStudentUserIds(notebook_id)
-    else:
-        connected_students = None
-    selected_groups = request.args.get("selectedGroups", None)
-    if selected_groups:
-        selected_groups = json.loads(selected_groups)
-
-    # get cell click information
-    cell_click_subq = db.session.query(
-        CellClickEvent.cell_id,
-        func.count(CellClickEvent.user_id).label("cell_click_count"),
-    ).filter(
-        CellClickEvent.notebook_id == notebook_id,
-        and_(
-            CellClickEvent.time > t_start if t_start is not None else True,
-            CellClickEvent.time <= t_end if t_end is not None else True,
-        ),
-    )
-
-    if fetch_real_time:
-        cell_click_subq = cell_click_subq.filter(
-            CellClickEvent.user_id.in_(connected_students)
-        )
-
-    if selected_groups:
-        cell_click_subq = cell_click_subq.filter(
-            CellClickEvent.user_id.in_(
-                select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
-            )
-        )
-
-    cell_click_subq = cell_click_subq.group_by(CellClickEvent.cell_id).subquery()
+# the routes below read the per-minute CellRollup rows instead of aggregating the raw events, except /user_cell_time
 
-    # get code execution information
-    code_exec_subq = db.session.query(
-        CellExecution.cell_id,
-        func.count(CellExecution.user_id).label("code_exec_count"),
-        func.count(CellExecution.user_id)
-        .filter(CellExecution.status == "ok")
-        .label("code_exec_ok_count"),
-    ).filter(
-        CellExecution.cell_type == "CodeExecution",
-        CellExecution.notebook_id == notebook_id,
-        and_(
-            CellExecution.t_finish > t_start if t_start is not None else True,
-            CellExecution.t_finish <= t_end if t_end is not None else True,
-        ),
-    )
-
-    if fetch_real_time:
-        code_exec_subq = code_exec_subq.filter(
-            CellClickEvent.user_id.in_(connected_students)
-        )
 
-    if selected_groups:
-        code_exec_subq = code_exec_subq.filter(
-            CellClickEvent.user_id.in_(
-                select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
-            )
-        )
-
-    code_exec_subq = code_exec_subq.group_by(CellExecution.cell_id).subquery()
-
-    # get data from subqueries
-    data = (
-        db.session.query(
-            cell_click_subq.c.cell_id,
-            (cell_click_subq.c.cell_click_count).label("cell_click_pct"),
-            (code_exec_subq.c.code_exec_count).label("code_exec_pct"),
-            (code_exec_subq.c.code_exec_ok_count).label("code_exec_ok_pct"),
-        )
-        .join(code_exec_subq, cell_click_subq.c.cell_id == code_exec_subq.c.cell_id)
-        .all()
-    )
-
-    return jsonify(
-        [
-            {
-                "cell": cell,
-                "cell_click_pct": cell_click_pct,
-                "code_exec_pct": code_exec_pct,
-                "code_exec_ok_pct": code_exec_ok_pct,
-            }
-            for cell, cell_click_pct, code_exec_pct, code_exec_ok_pct in data
-        ]
-    )
+@dashboard_bp.route("/<notebook_id>/user_code_execution", methods=["GET"])
+@cached_dashboard_response
+def listNotebookCellExecution(notebook_id):
+    return jsonify(getCellExecutionData(notebook_id, *getViewFilters(request.args)))
 
 
 @dashboard_bp.route("/<notebook_id>/user_cell_time", methods=["GET"])
+@cached_dashboard_response
 def listNotebookCellAccessTime(notebook_id):
+    return jsonify(getCellAccessTimeData(notebook_id, *getViewFilters(request.args)))
 
-    t_start, t_end = get_time_boundaries(request.args)
-    # if t_end is defined, real time is ignored and set to False since what happens in real-time is not included anymore
-    fetch_real_time = get_fetch_real_time(request.args, t_end)
-    selected_groups = request.args.get("selectedGroups", None)
-    if selected_groups:
-        selected_groups = json.loads(selected_groups)
 
-    cell_click_events = db.session.query(
-        CellClickEvent.cell_id,
-        func.array_agg(CellClickEvent.click_duration).label("durations"),
-    ).filter(
-        CellClickEvent.notebook_id == notebook_id,
-        and_(
-            CellClickEvent.time > t_start if t_start is not None else True,
-            CellClickEvent.time <= t_end if t_end is not None else True,
-        ),
-        CellClickEvent.click_type == "OFF",
-        CellClickEvent.click_duration.isnot(None),
-    )  # use isnot to check for non-null values
-
-    if fetch_real_time:
-        cell_click_events = cell_click_events.filter(
-            CellClickEvent.user_id.in_(getConnectedStudentUserIds(notebook_id))
-        )
-
-    if selected_groups:
-        cell_click_events = cell_click_events.filter(
-            CellClickEvent.user_id.in_(
-                select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
-            )
-        )
-
-    cell_click_events = cell_click_events.group_by(CellClickEvent.cell_id).all()
-
-    return jsonify(
-        [
-            {"cell": cell, "durations": durations}
-            for cell, durations in cell_click_events
-        ]
-    )
+@dashboard_bp.route("/<notebook_id>/user_cell_time_histogram", methods=["GET"])
+@cached_dashboard_response
+def listNotebookCellAccessTimeHistogram(notebook_id):
+    return jsonify(getCellAccessTimeHistogramData(notebook_id, *getViewFilters(request.args)))
 
 
 @dashboard_bp.route("/<notebook_id>/user_cell_duration_time", methods=["GET"])
+@cached_dashboard_response
 def listNotebookCellDurationTime(notebook_id):
+    return jsonify(getCellDurationTimeData(notebook_id, *getViewFilters(request.args)))
 
-    t_start, t_end = get_time_boundaries(request.args)
-    # if t_end is defined, real time is ignored and set to False since what happens in real-time is not included anymore
-    fetch_real_time = get_fetch_real_time(request.args, t_end)
-    selected_groups = request.args.get("selectedGroups", None)
-    if selected_groups:
-        selected_groups = json.loads(selected_groups)
-
-    # subquery to average cell focus duration per user
-    per_user_avg_subquery = (
-        db.session.query(
-            CellClickEvent.cell_id,
-            CellClickEvent.user_id,
-            func.avg(CellClickEvent.click_duration).label("user_avg_duration"),
-        )
-        .filter(
-            CellClickEvent.notebook_id == notebook_id,
-            and_(
-                CellClickEvent.time > t_start if t_start is not None else True,
-                CellClickEvent.time <= t_end if t_end is not None else True,
-            ),
-            CellClickEvent.click_type == "OFF",
-            CellClickEvent.click_duration.isnot(None),
-            CellClickEvent.click_duration
-            <= 5000,  # durations longer than this can be considered outliers
-        )
-        .group_by(CellClickEvent.cell_id, CellClickEvent.user_id)
-        .subquery()
-    )
-
-    # main query to average the user averages per cell
-    cell_click_events_query = db.session.query(
-        per_user_avg_subquery.c.cell_id.label("cell"),
-        func.avg(per_user_avg_subquery.c.user_avg_duration).label("average_duration"),
-        func.count(per_user_avg_subquery.c.user_id).label("user_count"),
-    ).group_by(per_user_avg_subquery.c.cell_id)
-
-    # query to compute the total count of distinct users
-    filtered_user_ids_query = db.session.query(
-        func.distinct(per_user_avg_subquery.c.user_id)
-    )
-
-    if fetch_real_time:
-        connected_user_ids = getConnectedStudentUserIds(notebook_id)
-        cell_click_events_query = cell_click_events_query.filter(
-            per_user_avg_subquery.c.user_id.in_(connected_user_ids)
-        )
-        filtered_user_ids_query = filtered_user_ids_query.filter(
-            per_user_avg_subquery.c.user_id.in_(connected_user_ids)
-        )
-
-    if selected_groups:
-        group_user_ids_subquery = select(
-            getGroupsUserIdsSubquery(notebook_id, selected_groups)
-        )
-        cell_click_events_query = cell_click_events_query.filter(
-            per_user_avg_subquery.c.user_id.in_(group_user_ids_subquery)
-        )
-        filtered_user_ids_query = filtered_user_ids_query.filter(
-            per_user_avg_subquery.c.user_id.in_(group_user_ids_subquery)
-        )
-
-    cell_click_events = cell_click_events_query.all()
-
-    # calculate total user count
-    total_user_count = filtered_user_ids_query.count()
-
-    return jsonify(
-        {
-            "durations": [
-                {
-                    "average_duration": avg_duration,
-                    "cell": cell,
-                    "user_count": user_count,
-                }
-                for cell, avg_duration, user_count in cell_click_events
-            ],
-            "total_user_count": total_user_count,
-        }
-    )
 
 @dashboard_bp.route("/<notebook_id>/cell_execution_progress", methods=["POST"])
 def getUserExecutionProgress(notebook_id):
@@ -395,22 +166,32 @@ def getUserExecutionProgress(notebook_id):
     now = datetime.now(timezone.utc).replace(tzinfo=None)
     effective_end = min(time_end, now)
 
-    cache_key = (notebook_id, data["time_start"])
-    cached = _progress_cache.get(cache_key, [])
+    # shared by all the workers, only the minutes that were not computed yet are added to it
+    cached, computed_until = get_progress_snapshots(
+        notebook_id, data["time_start"], cell_order, selected_groups
+    )
 
-    if cached:
-        new_from = cached[-1].timestamp + timedelta(minutes=1)
+    if computed_until:
+        new_from = computed_until + timedelta(minutes=1)
     else:
         new_from = time_start
 
     if new_from <= effective_end:
         new_snapshots = compute_snapshots(
             notebook_id, cell_order,
-            new_from, effective_end,
+            time_start, new_from, effective_end,
             selected_groups,
         )
+        # last minute of the grid that was computed
+        new_until = new_from + (effective_end - new_from) // timedelta(minutes=1) * timedelta(minutes=1)
+        append_progress_snapshots(
+            notebook_id, data["time_start"], cell_order, selected_groups,
+            new_snapshots, computed_until, new_until,
+        )
         cached = cached + new_snapshots
-        _progress_cache[cache_key] = cached
+
+    # the cache can go further than the requested end if it was filled by a request with a later end
+    cached = [s for s in cached if s.timestamp <= effective_end]
 
     return jsonify({
         "timestamps": [s.timestamp.isoformat() for s in cached],
@@ -425,7 +206,53 @@ def getUserExecutionProgress(notebook_id):
 ### Cell dashboard ###
 
 
+# sort key of the attempts and whether it is descending, for each sortBy
+ATTEMPT_SORTS = {
+    "inputAsc": ("input_length", False),
+    "inputDesc": ("input_length", True),
+    "outputAsc": ("output_length", False),
+    "outputDesc": ("output_length", True),
+    "timeAsc": ("exec_id", False),
+    "timeDesc": ("exec_id", True),
+}
+
+
+# the sort keys, from the executions or from the LatestCellExecution rows
+def attemptSortColumns(model):
+    if model is LatestCellExecution:
+        return {
+            "input_length": LatestCellExecution.input_length,
+            "output_length": LatestCellExecution.output_length,
+            "exec_id": LatestCellExecution.exec_id,
+        }
+    return {
+        "input_length": func.length(CellExecution.cell_input),
+        "output_length": func.coalesce(CellExecution.cell_output_length, 0),
+        "exec_id": CellExecution.id,
+    }
+
+
+# the id breaks the ties, so every attempt has a single place in the order
+def attemptKey(sort_column, id_column):
+    return (id_column,) if sort_column is id_column else (sort_column, id_column)
+
+
+def attemptOrder(sort_column, id_column, descending):
+    return [column.desc() if descending else column.asc() for column in attemptKey(sort_column, id_column)]
+
+
+# the cursor is the (sort key, id) of the last attempt of the previous page, the offset is only used without one
+def paginateAttempts(query, sort_column, id_column, descending, cursor, limit, offset):
+    query = query.order_by(*attemptOrder(sort_column, id_column, descending))
+    if cursor is None:
+        return query.offset(offset).limit(limit)
+    key = attemptKey(sort_column, id_column)
+    position, cursor = tuple_(*key), tuple_(*cursor[-len(key):])
+    return query.filter(position < cursor if descending else position > cursor).limit(limit)
+
+
 @dashboard_bp.route("/<notebook_id>/cell/<cell_id>", methods=["GET"])
+@cached_dashboard_response
 def listAttemptsPerCell(notebook_id, cell_id):
     t_start, t_end = get_time_boundaries(request.args)
     # if t_end is defined, real time is ignored and set to False since what happens in real-time is not included anymore
@@ -434,74 +261,112 @@ def listAttemptsPerCell(notebook_id, cell_id):
     if selected_groups:
         selected_groups = json.loads(selected_groups)
 
-    sort_by = request.args.get("sortBy", "timeDesc")
-    match sort_by:
-        case "inputAsc":
-            sort_condition = func.length(CellExecution.cell_input).asc()
-        case "inputDesc":
-            sort_condition = func.length(CellExecution.cell_input).desc()
-        case "outputAsc":
-            sort_condition = CellExecution.cell_output_length.asc()
-        case "outputDesc":
-            sort_condition = CellExecution.cell_output_length.desc()
-        case "timeAsc":
-            sort_condition = CellExecution.id.asc()
-        case _:  # default, including timeDesc
-            sort_condition = CellExecution.id.desc()
-
+    sort_key, descending = ATTEMPT_SORTS.get(
+        request.args.get("sortBy", "timeDesc"), ATTEMPT_SORTS["timeDesc"]
+    )
     limit = request.args.get("limit", 20, type=int)
     offset = request.args.get("offset", 0, type=int)
+    # keyset pagination : the next page starts after the attempt with that exec_id, whatever the page number
+    after = request.args.get("after", None, type=int)
 
-    # only t_start exists for markdown executions so filter on that column
-    subq = db.session.query(
-        CellExecution.user_id, func.max(CellExecution.id).label("last_id")
-    ).filter(
-        CellExecution.notebook_id == notebook_id,
-        CellExecution.cell_id == cell_id,
-        and_(
-            CellExecution.t_start > t_start if t_start is not None else True,
-            CellExecution.t_start <= t_end if t_end is not None else True,
-        ),
-    )
+    cursor = None
+    if after is not None:
+        cursor_row = (
+            db.session.query(attemptSortColumns(CellExecution)[sort_key])
+            .filter(
+                CellExecution.notebook_id == notebook_id,
+                CellExecution.cell_id == cell_id,
+                CellExecution.id == after,
+            )
+            .first()
+        )
+        if cursor_row is None:
+            return jsonify("Unknown execution to paginate after"), 400
+        cursor = cursor_row[0], after
+
+    # without an end to the window, the last attempt of each user is the one kept up to date in LatestCellExecution
+    if t_end is None:
+        latest_columns = attemptSortColumns(LatestCellExecution)
+        latest = db.session.query(
+            LatestCellExecution.exec_id, LatestCellExecution.event_time
+        ).filter(
+            LatestCellExecution.notebook_id == notebook_id,
+            LatestCellExecution.cell_id == cell_id,
+            LatestCellExecution.t_start > t_start if t_start is not None else True,
+        )
+
+        if fetch_real_time:
+            latest = latest.filter(connectedStudentsFilter(LatestCellExecution.user_id, notebook_id))
+
+        if selected_groups:
+            latest = latest.filter(
+                LatestCellExecution.user_id.in_(
+                    select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
+                )
+            )
 
-    if fetch_real_time:
-        subq = subq.filter(
-            CellExecution.user_id.in_(getConnectedStudentUserIds(notebook_id))
+        # the page is selected on the index of the sort, only its rows are then read from the Event table
+        latest = paginateAttempts(
+            latest, latest_columns[sort_key], LatestCellExecution.exec_id, descending, cursor, limit, offset
+        ).subquery()
+        join_condition = and_(
+            CellExecution.id == latest.c.exec_id,
+            CellExecution.event_time == latest.c.event_time,
         )
 
-    if selected_groups:
-        subq = subq.filter(
-            CellExecution.user_id.in_(
-                select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
-            )
+    else:
+        # only t_start exists for markdown executions so filter on that column
+        latest = db.session.query(
+            CellExecution.user_id, func.max(CellExecution.id).label("last_id")
+        ).filter(
+            CellExecution.notebook_id == notebook_id,
+            CellExecution.cell_id == cell_id,
+            and_(
+                CellExecution.t_start > t_start if t_start is not None else True,
+                CellExecution.t_start <= t_end,
+            ),
+            # executions end after they start, so only the lower bound holds on event_time
+            getEventTimeFilter(t_start, None),
         )
 
-    subq = subq.group_by(CellExecution.user_id).subquery()
+        if fetch_real_time:
+            latest = latest.filter(connectedStudentsFilter(CellExecution.user_id, notebook_id))
 
-    result = (
-        db.session.query(
-            CellExecution.id.label("exec_id"),
-            CellExecution.user_id,
-            CellExecution.cell_type,
-            CellExecution.cell_input,
-            CellExecution.t_start,
-            CellExecution.t_finish,
-            CellExecution.language_mimetype,
-            CellExecution.status,
-            CellExecution.cell_output_model,
-            CellExecution.cell_output_length,
+        if selected_groups:
+            latest = latest.filter(
+                CellExecution.user_id.in_(
+                    select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
+                )
+            )
+
+        latest = latest.group_by(CellExecution.user_id).subquery()
+        join_condition = and_(
+            CellExecution.user_id == latest.c.user_id,
+            CellExecution.id == latest.c.last_id,
         )
-        .join(
-            subq,
-            and_(
-                CellExecution.user_id == subq.c.user_id,
-                CellExecution.id == subq.c.last_id,
-            ),
+
+    result = db.session.query(
+        CellExecution.id.label("exec_id"),
+        CellExecution.user_id,
+        CellExecution.cell_type,
+        CellExecution.cell_input,
+        CellExecution.t_start,
+        CellExecution.t_finish,
+        CellExecution.language_mimetype,
+        CellExecution.status,
+        CellExecution.cell_output_preview,
+        CellExecution.cell_output_truncated,
+        CellExecution.cell_output_length,
+    ).join(latest, join_condition)
+
+    execution_columns = attemptSortColumns(CellExecution)
+    if t_end is None:
+        # the page is already selected, only sort its rows
+        result = result.order_by(*attemptOrder(execution_columns[sort_key], CellExecution.id, descending))
+    else:
+        result = paginateAttempts(
+            result, execution_columns[sort_key], CellExecution.id, descending, cursor, limit, offset
         )
-        .order_by(sort_condition)
-        .limit(limit)
-        .offset(offset)
-    )
 
     # check if markdown or code execution to include the extra entries related to a code execution
     result_list = [
@@ -514,7 +379,9 @@ def listAttemptsPerCell(notebook_id, cell_id):
                 "t_finish": t_finish.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
                 "language_mimetype": language_mimetype,
                 "status": status,
-                "cell_output_model": cell_output_model,
+                # the full outputs of truncated previews are fetched with getCellExecutionOutput
+                "cell_output_model": cell_output_preview,
+                "cell_output_truncated": bool(cell_output_truncated),
                 "cell_output_length": cell_output_length,
             }
             if cell_type == "CodeExecution"
@@ -526,71 +393,35 @@ def listAttemptsPerCell(notebook_id, cell_id):
                 "t_finish": t_start.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
             }
         )
-        for exec_id, user_id, cell_type, cell_input, t_start, t_finish, language_mimetype, status, cell_output_model, cell_output_length in result
+        for exec_id, user_id, cell_type, cell_input, t_start, t_finish, language_mimetype, status, cell_output_preview, cell_output_truncated, cell_output_length in result
     ]
 
     return jsonify(result_list)
 
 
-### ToC dashboard ###
-
-
-@dashboard_bp.route("/<notebook_id>/toc", methods=["GET"])
-def getNotebookToc(notebook_id):
-
-    t_start, t_end = get_time_boundaries(request.args)
-    # if t_end is defined, real time is ignored and set to False since what happens in real-time is not included anymore
-    fetch_real_time = get_fetch_real_time(request.args, t_end)
-    selected_groups = request.args.get("selectedGroups", None)
-    if selected_groups:
-        selected_groups = json.loads(selected_groups)
-
-    # retrieve the ids of the last event for each user_id
-    subquery = db.session.query(
-        CellClickEvent.user_id, func.max(CellClickEvent.id).label("last_event_id")
-    ).filter(
-        CellClickEvent.notebook_id == notebook_id,
-        CellClickEvent.click_type == "ON",
-        and_(
-            CellClickEvent.time > t_start if t_start is not None else True,
-            CellClickEvent.time <= t_end if t_end is not None else True,
-        ),
-    )
-
-    if fetch_real_time:
-        subquery = subquery.filter(
-            CellClickEvent.user_id.in_(getConnectedStudentUserIds(notebook_id))
+@dashboard_bp.route("/<notebook_id>/execution/<int:exec_id>/output", methods=["GET"])
+def getCellExecutionOutput(notebook_id, exec_id):
+    output = (
+        db.session.query(CellExecution.cell_output_model)
+        .filter(
+            CellExecution.notebook_id == notebook_id,
+            CellExecution.id == exec_id,
         )
+        .first()
+    )
+    if output is None:
+        return jsonify({"status": "not_found"}), 404
 
-    if selected_groups:
-        subquery = subquery.filter(
-            CellClickEvent.user_id.in_(
-                select(getGroupsUserIdsSubquery(notebook_id, selected_groups))
-            )
-        )
+    return jsonify({"exec_id": exec_id, "cell_output_model": output.cell_output_model})
 
-    subquery = subquery.group_by(CellClickEvent.user_id).subquery()
 
-    # first join with the previous subquery to only keep the rows with an id = last_event_id, then group by orig_cell_id
-    query = (
-        db.session.query(
-            CellClickEvent.orig_cell_id,
-            func.count(func.distinct(CellClickEvent.user_id)).label("user_count"),
-        )
-        .join(
-            subquery,
-            and_(
-                CellClickEvent.user_id == subquery.c.user_id,
-                CellClickEvent.id == subquery.c.last_event_id,
-            ),
-        )
-        .group_by(CellClickEvent.orig_cell_id)
-    )
+### ToC dashboard ###
 
-    location_count = {}
-    for orig_cell_id, user_count in query:
-        location_count[orig_cell_id] = user_count
 
+@dashboard_bp.route("/<notebook_id>/toc", methods=["GET"])
+@cached_dashboard_response
+def getNotebookToc(notebook_id):
+    location_count = getTocData(notebook_id, *getViewFilters(request.args))
     return jsonify({"status": "success", "data": {"location_count": location_count}})
 
 
@@ -616,91 +447,96 @@ def downloadNotebookDataCSV(notebook_id):
         t1 = datetime.strptime(t1_str, "%Y-%m-%dT%H:%M:%S.%f%z")
         t2 = datetime.strptime(t2_str, "%Y-%m-%dT%H:%M:%S.%f%z")
 
-        polymorphic_join = with_polymorphic(
-            Event, [CellExecution, CellClickEvent, NotebookClickEvent, CellAlteration]
-        )
+        return csv_export_response(notebook_csv_statement(notebook_id, t1, t2), f"log_{notebook_id}.csv")
 
-        rows = (
-            db.session.query(polymorphic_join)
-            .filter(Event.notebook_id == notebook_id)
-            .filter(
-                or_(
-                    and_(
-                        CellExecution.t_start.between(t1, t2),
-                        CellExecution.cell_type == "MarkdownExecution",
-                    ),
-                    and_(
-                        CellExecution.t_finish.between(t1, t2),
-                        CellExecution.cell_type == "CodeExecution",
-                    ),
-                    CellClickEvent.time.between(t1, t2),
-                    NotebookClickEvent.time.between(t1, t2),
-                    CellAlteration.time.between(t1, t2),
-                )
-            )
-            .yield_per(2000)
-        )
+    except Exception as e:
+        return f"An error occurred while downloading the data: {str(e)}", 500
 
-        def generate():
-            data = StringIO()
-            w = csv.writer(data)
-
-            columns = [
-                "id",
-                "__tablename__",
-                "notebook_id",
-                "user_id",
-                "status",
-                "cell_input",  # 'cell_output_model',
-                "cell_type",
-                "cell_id",
-                "orig_cell_id",
-                "click_type",
-                "click_duration",
-                "alteration_type",
-                "time (UTC !)",
-            ]
-
-            # write header
-            w.writerow(columns)
-            yield data.getvalue()
-            data.seek(0)
-            data.truncate(0)
-
-            # write each log item
-            for row in rows:
-
-                # time is encoded in t_start or t_finish in CellExecution rows, not in time
-                time_value = (
-                    getattr(row, "time", None)
-                    or getattr(row, "t_finish", None)
-                    or getattr(row, "t_start", None)
-                )
 
-                w.writerow(
-                    (
-                        list(getattr(row, column, None) for column in columns[:-1])
-                        + [time_value.isoformat() if time_value else None]
-                    )
-                )
-                yield data.getvalue()
-                data.seek(0)
-                data.truncate(0)
-
-        # stream the response as the data is generated
-        response = Response(stream_with_context(generate()), mimetype="text/csv")
-        # add the filename
-        response.headers.set(
-            "Content-Disposition", "attachment", filename=f"log_{notebook_id}.csv"
-        )
-        response.headers.set("Access-Control-Expose-Headers", "Content-Disposition")
+# same data as download_csv, as parquet (format=parquet, the default) or an arrow IPC stream (format=arrow), with
+# typed columns, optionally restricted to the comma-separated columns and to the events between t1 and/or t2
+@dashboard_bp.route("/<notebook_id>/download_columnar", methods=["GET"])
+def downloadNotebookDataColumnar(notebook_id):
+
+    export_format = request.args.get("format", "parquet")
+    if export_format not in COLUMNAR_FORMATS:
+        return f"Unknown format '{export_format}', expected one of {', '.join(COLUMNAR_FORMATS)}", 400
+    if not columnar_export_available():
+        return "The columnar exports require pyarrow, which is not installed", 501
 
-        return response
+    columns_arg = request.args.get("columns")
+    names = columns_arg.split(",") if columns_arg else list(event_export_columns())
+    unknown = unknown_export_columns(names)
+    if unknown:
+        return f"Unknown columns: {', '.join(unknown)}", 400
+
+    try:
+
+        t1_str = request.args.get("t1")
+        t2_str = request.args.get("t2")
+        t1 = datetime.strptime(t1_str, "%Y-%m-%dT%H:%M:%S.%f%z") if t1_str else None
+        t2 = datetime.strptime(t2_str, "%Y-%m-%dT%H:%M:%S.%f%z") if t2_str else None
+
+        statement, kinds = notebook_columnar_statement(notebook_id, names, t1, t2)
+        return columnar_export_response(statement, kinds, export_format, f"log_{notebook_id}")
 
     except Exception as e:
         return f"An error occurred while downloading the data: {str(e)}", 500
 
 
+### Export jobs, run by exporter.py ###
+
+
+# queues an export of the same data as download_csv and download_columnar, the JSON body holding its format (csv,
+# parquet or arrow), and the optional t1, t2 and columns (a list, for the columnar formats)
+@dashboard_bp.route("/<notebook_id>/export_jobs", methods=["POST"])
+def submitExportJob(notebook_id):
+    data = request.get_json(silent=True) or {}
+
+    export_format = data.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        return f"Unknown format '{export_format}', expected one of {', '.join(EXPORT_FORMATS)}", 400
+
+    params = {}
+    for bound in ("t1", "t2"):
+        if data.get(bound):
+            try:
+                datetime.strptime(data[bound], "%Y-%m-%dT%H:%M:%S.%f%z")
+            except (TypeError, ValueError):
+                return f"Invalid {bound}", 400
+            params[bound] = data[bound]
+
+    if export_format in COLUMNAR_FORMATS:
+        if not columnar_export_available():
+            return "The columnar exports require pyarrow, which is not installed", 501
+        params["columns"] = data.get("columns") or list(event_export_columns())
+        unknown = unknown_export_columns(params["columns"])
+        if unknown:
+            return f"Unknown columns: {', '.join(unknown)}", 400
+
+    job_id = submit_export_job(notebook_id, export_format, params)
+    return jsonify(export_job_status(job_id, get_export_job(job_id))), 202
+
+
+@dashboard_bp.route("/<notebook_id>/export_jobs/<job_id>", methods=["GET"])
+def getExportJob(notebook_id, job_id):
+    job = get_export_job(job_id)
+    if job is None or job["notebook_id"] != notebook_id:
+        return jsonify({"status": "not_found"}), 404
+    return jsonify(export_job_status(job_id, job))
+
+
+# supports Range requests to resume interrupted downloads
+@dashboard_bp.route("/<notebook_id>/export_jobs/<job_id>/download", methods=["GET"])
+def downloadExportJob(notebook_id, job_id):
+    job = get_export_job(job_id)
+    if job is None or job["notebook_id"] != notebook_id:
+        return jsonify({"status": "not_found"}), 404
+    if job["status"] != "done":
+        return jsonify(export_job_status(job_id, job)), 409
+    return export_job_download_response(job_id, job)
+
+
 @dashboard_bp.route("/<notebook_id>/getgroups", methods=["GET"])
 def getGroups(notebook_id):
     group_names = (
@@ -713,156 +549,114 @@ def getGroups(notebook_id):
     return jsonify(group_names)
 
 
+# the responses of the students to the updates pushed by the teacher
+TEACHER_UPDATE_RESPONSES = [PendingUpdateAction.UPDATE_NOW, PendingUpdateAction.UPDATE_LATER]
+# what the students who chose to update later did with the update afterwards
+DELAYED_UPDATE_ACTIONS = [
+    PendingUpdateAction.APPLY_SINGLE,
+    PendingUpdateAction.REMOVE_SINGLE,
+    PendingUpdateAction.UPDATE_ALL,
+    PendingUpdateAction.DELETE_ALL,
+]
+
+
 @dashboard_bp.route("/<notebook_id>/pending_updates_stats", methods=["GET"])
 @jwt_required()
 def getPendingUpdatesStats(notebook_id):
-    # Query to get the latest update per cell_id
-    # First, find the latest timestamp for each cell_id
-    latest_updates_subquery = (
+    # the responses to the teacher updates, each with the latest update of its cell
+    teacher_responses = (
         db.session.query(
             PendingUpdateInteraction.cell_id,
-            func.max(PendingUpdateInteraction.timestamp).label("max_timestamp"),
+            PendingUpdateInteraction.update_id,
+            PendingUpdateInteraction.action,
+            PendingUpdateInteraction.timestamp,
+            func.first_value(PendingUpdateInteraction.update_id)
+            .over(
+                partition_by=PendingUpdateInteraction.cell_id,
+                order_by=(
+                    PendingUpdateInteraction.timestamp.desc(),
+                    PendingUpdateInteraction.update_id.desc(),
+                ),
+            )
+            .label("latest_update_id"),
         )
         .filter(
             PendingUpdateInteraction.notebook_id == notebook_id,
             PendingUpdateInteraction.update_id.isnot(None),
-            PendingUpdateInteraction.action.in_(
-                [PendingUpdateAction.UPDATE_NOW, PendingUpdateAction.UPDATE_LATER]
-            ),
-            PendingUpdateInteraction.sender_type == "teacher",  # Only teacher updates
-        )
-        .group_by(PendingUpdateInteraction.cell_id)
-        .subquery()
-    )
-
-    # Then get the update_id for those latest timestamps
-    latest_update_ids_subquery = (
-        db.session.query(
-            PendingUpdateInteraction.cell_id, PendingUpdateInteraction.update_id
-        )
-        .join(
-            latest_updates_subquery,
-            db.and_(
-                PendingUpdateInteraction.cell_id == latest_updates_subquery.c.cell_id,
-                PendingUpdateInteraction.timestamp
-                == latest_updates_subquery.c.max_timestamp,
-            ),
-        )
-        .filter(
-            PendingUpdateInteraction.notebook_id == notebook_id,
-            PendingUpdateInteraction.action.in_(
-                [PendingUpdateAction.UPDATE_NOW, PendingUpdateAction.UPDATE_LATER]
-            ),
+            PendingUpdateInteraction.action.in_(TEACHER_UPDATE_RESPONSES),
             PendingUpdateInteraction.sender_type == "teacher",  # Only teacher updates
         )
-        .distinct()
         .subquery()
     )
 
-    # Now query to count actions per cell_id using only the latest update_id
+    # count the responses to the latest update of each cell
     results = (
         db.session.query(
-            PendingUpdateInteraction.cell_id,
-            PendingUpdateInteraction.update_id,
-            PendingUpdateInteraction.action,
-            func.count(PendingUpdateInteraction.user_id),
-            func.min(PendingUpdateInteraction.timestamp),
-        )
-        .join(
-            latest_update_ids_subquery,
-            db.and_(
-                PendingUpdateInteraction.cell_id
-                == latest_update_ids_subquery.c.cell_id,
-                PendingUpdateInteraction.update_id
-                == latest_update_ids_subquery.c.update_id,
-            ),
-        )
-        .filter(
-            PendingUpdateInteraction.notebook_id == notebook_id,
-            PendingUpdateInteraction.action.in_(
-                [PendingUpdateAction.UPDATE_NOW, PendingUpdateAction.UPDATE_LATER]
-            ),
-            PendingUpdateInteraction.sender_type == "teacher",  # Only teacher updates
-        )
-        .group_by(
-            PendingUpdateInteraction.cell_id,
-            PendingUpdateInteraction.update_id,
-            PendingUpdateInteraction.action,
-        )
+            teacher_responses.c.cell_id,
+            teacher_responses.c.update_id,
+            func.count().filter(teacher_responses.c.action == PendingUpdateAction.UPDATE_NOW),
+            func.count().filter(teacher_responses.c.action == PendingUpdateAction.UPDATE_LATER),
+            func.min(teacher_responses.c.timestamp),
+        )
+        .filter(teacher_responses.c.update_id == teacher_responses.c.latest_update_id)
+        .group_by(teacher_responses.c.cell_id, teacher_responses.c.update_id)
         .all()
     )
 
-    stats = {}
-    for cell_id, update_id, action, count, timestamp in results:
-        # Group by cell_id instead of update_id
-        if cell_id not in stats:
-            stats[cell_id] = {
-                "update_id": update_id,  # Store the latest update_id for this cell
-                "cell_id": cell_id,
-                "timestamp": timestamp.isoformat(),
-                "update_now": 0,
-                "update_later": 0,
-            }
-
-        if action == PendingUpdateAction.UPDATE_NOW:
-            stats[cell_id]["update_now"] = count
-        elif action == PendingUpdateAction.UPDATE_LATER:
-            stats[cell_id]["update_later"] = count
-
-    # Fetch detailed actions for students who selected "Update Later"
-    for cell_id in stats.keys():
-        # Get the update_id for this cell
-        update_id = stats[cell_id]["update_id"]
+    stats = {
+        cell_id: {
+            "update_id": update_id,  # Store the latest update_id for this cell
+            "cell_id": cell_id,
+            "timestamp": timestamp.isoformat(),
+            "update_now": update_now,
+            "update_later": update_later,
+            "detailed_actions": [],
+        }
+        for cell_id, update_id, update_now, update_later, timestamp in results
+    }
 
-        # First, get all users who clicked "Update Later" for this update
-        users_who_delayed = (
-            db.session.query(PendingUpdateInteraction.user_id)
-            .filter(
-                PendingUpdateInteraction.notebook_id == notebook_id,
-                PendingUpdateInteraction.update_id == update_id,
-                PendingUpdateInteraction.action == PendingUpdateAction.UPDATE_LATER,
-                PendingUpdateInteraction.sender_type
-                == "teacher",  # Only teacher updates
-            )
-            .distinct()
-            .all()
+    if stats:
+        # the subsequent actions of the students who clicked "Update Later", on all the latest updates at once
+        delayed = aliased(PendingUpdateInteraction)
+        update_ids = bindparam(
+            "update_ids", list({cell_stats["update_id"] for cell_stats in stats.values()}), type_=ARRAY(db.String)
         )
-
-        delayed_user_ids = {user_id for (user_id,) in users_who_delayed}
-
-        # Get all subsequent actions from those users (APPLY_SINGLE, REMOVE_SINGLE, UPDATE_ALL, DELETE_ALL)
         subsequent_actions = (
             db.session.query(
+                PendingUpdateInteraction.update_id,
                 PendingUpdateInteraction.user_id,
                 PendingUpdateInteraction.action,
                 PendingUpdateInteraction.timestamp,
             )
             .filter(
                 PendingUpdateInteraction.notebook_id == notebook_id,
-                PendingUpdateInteraction.update_id == update_id,
-                PendingUpdateInteraction.action.in_(
-                    [
-                        PendingUpdateAction.APPLY_SINGLE,
-                        PendingUpdateAction.REMOVE_SINGLE,
-                        PendingUpdateAction.UPDATE_ALL,
-                        PendingUpdateAction.DELETE_ALL,
-                    ]
-                ),
-                PendingUpdateInteraction.user_id.in_(delayed_user_ids),
-                PendingUpdateInteraction.sender_type
-                == "teacher",  # Only teacher updates
+                PendingUpdateInteraction.update_id == any_(update_ids),
+                PendingUpdateInteraction.action.in_(DELAYED_UPDATE_ACTIONS),
+                PendingUpdateInteraction.sender_type == "teacher",  # Only teacher updates
+                db.session.query(delayed.id)
+                .filter(
+                    delayed.notebook_id == notebook_id,
+                    delayed.update_id == PendingUpdateInteraction.update_id,
+                    delayed.action == PendingUpdateAction.UPDATE_LATER,
+                    delayed.user_id == PendingUpdateInteraction.user_id,
+                    delayed.sender_type == "teacher",
+                )
+                .exists(),
             )
             .all()
         )
 
-        stats[cell_id]["detailed_actions"] = [
-            {
-                "user_id": user_id,
-                "action": action.value,
-                "timestamp": timestamp.isoformat(),
-            }
-            for user_id, action, timestamp in subsequent_actions
-        ]
+        actions_per_update = {}
+        for update_id, user_id, action, timestamp in subsequent_actions:
+            actions_per_update.setdefault(update_id, []).append(
+                {
+                    "user_id": user_id,
+                    "action": action.value,
+                    "timestamp": timestamp.isoformat(),
+                }
+            )
+        for cell_stats in stats.values():
+            cell_stats["detailed_actions"] = actions_per_update.get(cell_stats["update_id"], [])
 
     # Sort by timestamp descending
     sorted_stats = sorted(stats.values(), key=lambda x: x["timestamp"], reverse=True)
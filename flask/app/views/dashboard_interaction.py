@@ -1,9 +1,9 @@
-from flask import Blueprint, jsonify, request, Response, stream_with_context
+from flask import Blueprint, jsonify, request
 import datetime
 from app import db
-from app.models.models import DashboardEvent
-import csv
-from io import StringIO
+from app.models.models import DashboardEvent, ClickType
+from app.utils.export import csv_export_response, iso_time, enum_repr
+from sqlalchemy import select
 from flask_jwt_extended import jwt_required, current_user
 
 dashboard_interaction_bp = Blueprint('dashboard_interaction', __name__)
@@ -44,41 +44,17 @@ def download_TA_interactiondata_CSV():
         t1 = datetime.datetime.strptime(t1_str,'%Y-%m-%dT%H:%M:%S.%f%z')
         t2 = datetime.datetime.strptime(t2_str,'%Y-%m-%dT%H:%M:%S.%f%z')
 
-        rows = db.session.query(DashboardEvent).filter(DashboardEvent.timestamp.between(t1, t2)).yield_per(2000)
-
-        def generate():
-            data = StringIO()
-            w = csv.writer(data)
-
-            columns = [
-                'id', 'dashboard_user_id', 'click_type', 'signal_origin', 'notebook_id', 'time (UTC !)'
-            ]
-
-            # write header
-            w.writerow(columns)
-            yield data.getvalue()
-            data.seek(0)
-            data.truncate(0)
-
-            # write each log item
-            for row in rows:
-
-                time_value = getattr(row, 'timestamp', None)
-
-                w.writerow((
-                    list(getattr(row, column, None) for column in columns[:-1]) + [time_value.isoformat() if time_value else None]
-                ))
-                yield data.getvalue()
-                data.seek(0)
-                data.truncate(0)
-        
-        # stream the response as the data is generated
-        response = Response(stream_with_context(generate()), mimetype='text/csv')
-        # add the filename
-        response.headers.set("Content-Disposition", "attachment", filename=f"log_TA_interaction.csv")
-        response.headers.set('Access-Control-Expose-Headers', 'Content-Disposition')
-        
-        return response
+        dashboard_events = DashboardEvent.__table__.c
+        statement = select(
+            dashboard_events.id,
+            dashboard_events.dashboard_user_id,
+            enum_repr(dashboard_events.click_type, ClickType).label('click_type'),
+            dashboard_events.signal_origin,
+            dashboard_events.notebook_id,
+            iso_time(dashboard_events.timestamp).label('time (UTC !)'),
+        ).where(dashboard_events.timestamp.between(t1, t2))
+
+        return csv_export_response(statement, "log_TA_interaction.csv")
 
     except Exception as e:
         return f"An error occurred while downloading the data: {str(e)}", 500
\ No newline at end of file
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models.models import Notebook, Event
+from app.utils.cache import invalidate_notebook, invalidate_all_notebooks
 import os
 
 delete_bp = Blueprint('delete', __name__)
@@ -58,6 +59,8 @@ delete_bp.before_request(payload_check_middleware)
 #         # perform the delete operation
 #         deleted_count = Notebook.query.filter_by(notebook_id=notebook_id).delete()
 #         db.session.commit()
+#         # the notebook is not reported as existing anymore, /send rejects its events
+#         invalidate_notebook(notebook_id)
 
 #         if deleted_count == 0 : 
 #             return f"No entries found for notebook_id: {notebook_id}", 404
@@ -76,6 +79,7 @@ delete_bp.before_request(payload_check_middleware)
 #         # clear the Notebook table
 #         Notebook.query.delete()
 #         db.session.commit()
+#         invalidate_all_notebooks()
         
 #         return 'Cleared notebooks and events successfully', 200
 #     except Exception as e:
@@ -90,6 +94,7 @@ delete_bp.before_request(payload_check_middleware)
 #         db.drop_all()
 #         # create the tables again
 #         db.create_all()
+#         invalidate_all_notebooks()
 #         return 'Database reset successfully', 200
 #     except Exception as e:
 #         db.session.rollback()
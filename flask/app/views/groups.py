@@ -1,9 +1,13 @@
 from flask import Blueprint, request, jsonify
-from app import db, redis_client
-from app.models.models import UserGroups, Users, UserGroupAssociation, TeammateLocation
-from datetime import datetime, timedelta, timezone
+from app import db
+from app.models.models import UserGroups, Users, UserGroupAssociation, ConnectionType
 from app.utils.utils import hash_user_id_with_salt
-from app.views.dashboard import getGroupsUserIdsSubquery
+from app.utils.dashboard_views import getGroupsUserIdsSubquery
+from app.utils.cache import invalidate_dashboard_cache
+from app.utils.teammates import get_user_teammates, invalidate_teammate_graph
+from app.utils.group_rooms import enter_group_room, leave_group_room, close_group_room
+from app.utils.presence import active_users, is_active
+from app.utils.locations import set_location, clear_location, get_connected_locations
 import json
 from sqlalchemy import func
 
@@ -40,6 +44,9 @@ def add_group():
 
         db.session.add(group)
         db.session.commit()
+        invalidate_dashboard_cache(data.get("notebook_id"))
+        invalidate_teammate_graph(data.get("notebook_id"))
+        enter_group_room(data.get("notebook_id"), group.group_pk, user_ids)
         return jsonify(f"Group {data.get('group_name', None)} added")
 
     except Exception as e:
@@ -57,6 +64,9 @@ def delete_group():
         if group:
             db.session.delete(group)
             db.session.commit()
+            invalidate_dashboard_cache(data.get("notebook_id"))
+            invalidate_teammate_graph(data.get("notebook_id"))
+            close_group_room(group_pk)
             return jsonify(f"Group {data.get('group_name', None)} deleted"), 200
         else:
             return jsonify("Group not found"), 404
@@ -101,6 +111,10 @@ def update_group():
                     group.group_users.remove(user)
 
             db.session.commit()
+            invalidate_dashboard_cache(data.get("notebook_id"))
+            invalidate_teammate_graph(data.get("notebook_id"))
+            enter_group_room(data.get("notebook_id"), group_pk, users_to_add)
+            leave_group_room(data.get("notebook_id"), group_pk, users_to_remove)
             return jsonify(f"Group {group.group_name} updated"), 200
         else:
             return jsonify("Group not found"), 404
@@ -158,34 +172,7 @@ def get_teammates(user_id):
     # incoming user_id is unhashed
     hashed_user_id = hash_user_id_with_salt(user_id)
 
-    # find groups in this notebook that the user belongs to
-    group_pk_rows = (
-        db.session.query(UserGroupAssociation.c.group_pk)
-        .join(UserGroups, UserGroupAssociation.c.group_pk == UserGroups.group_pk)
-        .filter(
-            UserGroupAssociation.c.user_id == hashed_user_id,
-            UserGroups.notebook_id == notebook_id,
-        )
-        .distinct()
-        .all()
-    )
-    group_pks = [r[0] for r in group_pk_rows]
-
-    if not group_pks:
-        return jsonify([]), 200
-
-    # find all users in those groups excluding the given user
-    teammate_rows = (
-        db.session.query(Users.user_id)
-        .join(UserGroupAssociation, UserGroupAssociation.c.user_id == Users.user_id)
-        .filter(
-            UserGroupAssociation.c.group_pk.in_(group_pks),
-            Users.user_id != hashed_user_id,
-        )
-        .distinct()
-        .all()
-    )
-    teammates = [r[0] for r in teammate_rows]
+    teammates = get_user_teammates(notebook_id, hashed_user_id)
 
     return jsonify(teammates), 200
 
@@ -200,46 +187,16 @@ def get_connected_teammates(user_id):
     # Hash the incoming user_id
     hashed_user_id = hash_user_id_with_salt(user_id)
 
-    # Find groups in this notebook that the user belongs to
-    group_pk_rows = (
-        db.session.query(UserGroupAssociation.c.group_pk)
-        .join(UserGroups, UserGroupAssociation.c.group_pk == UserGroups.group_pk)
-        .filter(
-            UserGroupAssociation.c.user_id == hashed_user_id,
-            UserGroups.notebook_id == notebook_id,
-        )
-        .distinct()
-        .all()
-    )
-    group_pks = [r[0] for r in group_pk_rows]
-
-    if not group_pks:
-        return jsonify([]), 200
-
-    # Find all users in those groups excluding the given user (these are HASHED)
-    teammate_rows = (
-        db.session.query(UserGroupAssociation.c.user_id)
-        .filter(
-            UserGroupAssociation.c.group_pk.in_(group_pks),
-            UserGroupAssociation.c.user_id != hashed_user_id,
-        )
-        .distinct()
-        .all()
-    )
-    all_teammates_hashed = {r[0] for r in teammate_rows}
+    # Find all users in the groups of the user, excluding the given user (these are HASHED)
+    all_teammates_hashed = set(get_user_teammates(notebook_id, hashed_user_id))
 
     # Return early if no teammates
     if not all_teammates_hashed:
         return jsonify([]), 200
 
-    # Get currently connected students from Redis cache
+    # Get currently connected students (with a recent heartbeat) from Redis cache
     # NOTE: These are ALREADY HASHED (see sockets.py handle_connect)
-    connected_student_ids_raw = redis_client.smembers(
-        f"connected_students:{notebook_id}"
-    )
-
-    # Decode bytes to strings - NO hashing needed since they're already hashed
-    connected_set_hashed = {uid.decode("utf-8") for uid in connected_student_ids_raw}
+    connected_set_hashed = set(active_users(ConnectionType.STUDENT, notebook_id))
 
     # Filter teammates to only those who are currently connected
     connected_teammates = list(all_teammates_hashed & connected_set_hashed)
@@ -320,30 +277,9 @@ def update_user_location():
     hashed_user_id = hash_user_id_with_salt(user_id)
 
     try:
-        # Upsert the location
-        existing = TeammateLocation.query.filter_by(
-            user_id=hashed_user_id, notebook_id=notebook_id
-        ).first()
-
-        if existing:
-            existing.cell_id = cell_id
-            existing.cell_index = cell_index
-            existing.updated_at = datetime.now(timezone.utc)
-        else:
-            new_location = TeammateLocation(
-                user_id=hashed_user_id,
-                notebook_id=notebook_id,
-                cell_id=cell_id,
-                cell_index=cell_index,
-                updated_at=datetime.now(timezone.utc),
-            )
-            db.session.add(new_location)
-
-        db.session.commit()
-
+        set_location(notebook_id, hashed_user_id, cell_id, cell_index)
         return jsonify({"status": "success"}), 200
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 
@@ -358,68 +294,15 @@ def get_teammates_locations():
 
     hashed_user_id = hash_user_id_with_salt(user_id)
 
-    # Find groups the user belongs to
-    group_pk_rows = (
-        db.session.query(UserGroupAssociation.c.group_pk)
-        .join(UserGroups, UserGroupAssociation.c.group_pk == UserGroups.group_pk)
-        .filter(
-            UserGroupAssociation.c.user_id == hashed_user_id,
-            UserGroups.notebook_id == notebook_id,
-        )
-        .distinct()
-        .all()
-    )
-    group_pks = [r[0] for r in group_pk_rows]
-
-    if not group_pks:
-        return jsonify([]), 200
-
     # Find all teammates (users in same groups)
-    teammate_rows = (
-        db.session.query(UserGroupAssociation.c.user_id)
-        .filter(
-            UserGroupAssociation.c.group_pk.in_(group_pks),
-            UserGroupAssociation.c.user_id != hashed_user_id,
-        )
-        .distinct()
-        .all()
-    )
-    teammate_ids = [r[0] for r in teammate_rows]
+    teammate_ids = get_user_teammates(notebook_id, hashed_user_id)
 
     # Return early if no teammates
     if not teammate_ids:
         return jsonify([]), 200
 
-    # Get connected teammates from Redis
-    connected_student_ids_raw = redis_client.smembers(
-        f"connected_students:{notebook_id}"
-    )
-    connected_set = {uid.decode("utf-8") for uid in connected_student_ids_raw}
-
-    # Filter to only connected teammates
-    connected_teammates = [tid for tid in teammate_ids if tid in connected_set]
-
-    # Return early if no connected teammates
-    if not connected_teammates:
-        return jsonify([]), 200
-
-    # Get their locations (only recent - within last 5 minutes)
-    cutoff_time = datetime.now(timezone.utc) - timedelta(minutes=5)
-    locations = TeammateLocation.query.filter(
-        TeammateLocation.user_id.in_(connected_teammates),
-        TeammateLocation.notebook_id == notebook_id,
-        TeammateLocation.updated_at >= cutoff_time,
-    ).all()
-
-    result = [
-        {
-            "userId": loc.user_id,
-            "cellId": loc.cell_id,
-            "cellIndex": loc.cell_index,
-            "updatedAt": loc.updated_at.isoformat(),
-        }
-        for loc in locations
-    ]
+    # Get the recent locations of the connected teammates (within the last 5 minutes)
+    result = get_connected_locations(notebook_id, teammate_ids)
 
     return jsonify(result), 200
 
@@ -434,8 +317,7 @@ def get_user_role(user_id):
     hashed_user_id = hash_user_id_with_salt(user_id)
 
     # Check if user is connected as a teacher
-    teacher_key = f"connected_teachers:{notebook_id}"
-    is_teacher = redis_client.sismember(teacher_key, hashed_user_id)
+    is_teacher = is_active(ConnectionType.TEACHER, notebook_id, hashed_user_id)
 
     if is_teacher:
         return jsonify({"role": "teacher"}), 200
@@ -455,11 +337,7 @@ def clear_user_location():
     hashed_user_id = hash_user_id_with_salt(user_id)
 
     try:
-        TeammateLocation.query.filter_by(
-            user_id=hashed_user_id, notebook_id=notebook_id
-        ).delete()
-        db.session.commit()
+        clear_location(notebook_id, hashed_user_id)
         return jsonify({"status": "success"}), 200
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": str(e)}), 500
@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify, render_template
 from app import db
-from app.models.auth import AuthUsers, AuthNotebooks
+from app.models.auth import AuthUsers, AuthNotebooks, invalidate_authorized_notebooks
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity, current_user
 from app.utils.utils import hash_user_id_with_salt
 
@@ -110,6 +110,7 @@ def enable_notebooks_for_user(username):
                 user.authorized_notebooks.append(notebook)
 
         db.session.commit()
+        invalidate_authorized_notebooks(user.id)
         return jsonify({'message': f"{len(notebook_ids)} notebook(s) authorized for user {username}"}), 200
 
     except Exception as e:
@@ -138,6 +139,7 @@ def disable_notebooks_for_user(username):
                 user.authorized_notebooks.remove(notebook)
 
         db.session.commit()
+        invalidate_authorized_notebooks(user.id)
         return jsonify({'message': f"{len(notebook_ids)} notebook(s) deauthorized for user {username}"}), 200
 
     except Exception as e:
@@ -161,6 +163,7 @@ def enable_users_for_notebook(notebook_id):
             db.session.add(notebook)
 
         # whitelist users for the given notebook
+        user_ids = []
         for username in usernames:
             username_hash = hash_user_id_with_salt(username)
             # check if the user exists in AuthUsers
@@ -172,8 +175,10 @@ def enable_users_for_notebook(notebook_id):
             # check if the user is already authorized for the notebook, authorize if not
             if user and user not in notebook.authorized_users:
                 notebook.authorized_users.append(user)
+                user_ids.append(user.id)
         
         db.session.commit()
+        invalidate_authorized_notebooks(*user_ids)
         return jsonify({'message': f"{notebook_id} notebook authorized for {len(usernames)} user(s)"}), 200
     
     except Exception as e:
@@ -195,13 +200,16 @@ def disable_users_for_notebook(notebook_id):
             return jsonify({'error': f'Notebook {notebook_id} not found'}), 404
 
         # deauthorize users for the given notebook
+        user_ids = []
         for username in usernames:
             username_hash = hash_user_id_with_salt(username)
             user = AuthUsers.query.filter_by(username_hash=username_hash).first()
             if user and user in notebook.authorized_users:
                 notebook.authorized_users.remove(user)
+                user_ids.append(user.id)
 
         db.session.commit()
+        invalidate_authorized_notebooks(*user_ids)
         return jsonify({'message': f"{notebook_id} notebook deauthorized for {len(usernames)} user(s)"}), 200
 
     except Exception as e:
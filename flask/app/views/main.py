@@ -1,5 +1,7 @@
 from flask import Blueprint, jsonify
 import os
+from app.utils.cache import notebook_cache_stats
+from app.utils.location_updates import location_update_stats
 
 main_bp = Blueprint('main', __name__)
 
@@ -12,3 +14,14 @@ def health_check():
 def get_hostname():
     return jsonify({'hostname': os.uname().nodename})
 
+
+
+# counters of the notebook existence cache of the instance dealing with the request
+@main_bp.route('/notebook_cache_stats')
+def get_notebook_cache_stats():
+    return jsonify({'hostname': os.uname().nodename, **notebook_cache_stats})
+
+# counters of the location updates of the sockets of the instance dealing with the request, the coalesced ones were dropped
+@main_bp.route('/location_update_stats')
+def get_location_update_stats():
+    return jsonify({'hostname': os.uname().nodename, **location_update_stats})
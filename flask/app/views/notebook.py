@@ -3,12 +3,13 @@ import json
 import datetime
 from app import db
 from app.models.models import Notebook
-from app.models.auth import AuthNotebooks
+from app.models.auth import AuthNotebooks, invalidate_authorized_notebooks
 from io import BytesIO
 import zipfile
 import nbformat
 from app.utils.storage import upload_file_to_volume, download_file_from_volume
 from app.utils.constants import Selectors 
+from app.utils.cache import register_notebook
 import uuid
 import os
 from flask_jwt_extended import jwt_required, current_user
@@ -76,6 +77,8 @@ def postS3Notebook():
             auth_notebook.authorized_users.append(current_user)
 
         db.session.commit()
+        invalidate_authorized_notebooks(current_user.id)
+        register_notebook(notebook_id)
 
         # upload notebook file only if database insertion was successful
         upload_file_to_volume(os.environ.get('S3_BUCKET_NAME'), s3_object_key, zip_buffer)
@@ -1,19 +1,15 @@
 from flask import Blueprint, request, jsonify
-import datetime
-from app import db, socketio
-from app.models.models import (
-    CellExecution,
-    CellClickEvent,
-    ConnectionType,
-    NotebookClickEvent,
-    CellAlteration,
-    Notebook,
-    PendingUpdateInteraction,
-    PendingUpdateAction,
+from app import db
+from app.utils.constants import MAX_PAYLOAD_SIZE, MAX_BATCH_EVENTS, INGEST_MODE
+from app.utils.cache import notebook_exists
+from app.utils.dashboard_push import request_dashboard_refresh
+from app.utils.ingest import (
+    build_event,
+    save_event,
+    save_events,
+    INGEST_UNAVAILABLE_ERRORS,
+    INGEST_ROW_ERRORS,
 )
-from app.utils.constants import MAX_PAYLOAD_SIZE
-from app.utils.cache import check_refresh_cache
-from app.utils.utils import hash_user_id_with_salt
 
 send_bp = Blueprint("send", __name__)
 
@@ -36,8 +32,7 @@ def payload_check_middleware():
     notebook_id = data.get("notebook_id")
 
     # check if the notebook_id exists in the database
-    notebook = Notebook.query.filter_by(notebook_id=notebook_id).first()
-    if not notebook:
+    if not notebook_exists(notebook_id):
         return jsonify("Notebook not found"), 404
 
     return
@@ -53,17 +48,14 @@ def websocket_post_to_client(response):
     if request.method == "OPTIONS":
         return response  # let OPTIONS preflight requests through
 
+    # in stream mode the events are not in the database yet, the flusher sends the refresh once they are
+    if INGEST_MODE == "stream":
+        return response
+
     notebook_id = request.get_json().get("notebook_id")
     # go through only if the POST request added something to the database
     if (200 <= response.status_code < 300) and notebook_id:
-
-        # to limit frequency of refresh requests
-        should_send_refresh_request = check_refresh_cache(notebook_id)
-
-        if should_send_refresh_request:
-            # broadcast refresh dashboard message to all teachers in the notebook room
-            room_name = ConnectionType.TEACHER.name.lower() + "_" + notebook_id
-            socketio.emit("refreshDashboard", to=room_name)
+        request_dashboard_refresh(notebook_id)
 
     return response
 
@@ -74,30 +66,9 @@ send_bp.after_request(websocket_post_to_client)
 @send_bp.route("/exec/code", methods=["POST"])
 def postCodeExec():
     data = request.get_json()
-    hashed_user_id = hash_user_id_with_salt(data["user_id"])
 
     try:
-
-        new_code_exec = CellExecution(
-            notebook_id=data["notebook_id"],
-            user_id=hashed_user_id,
-            cell_id=data["cell_id"],
-            orig_cell_id=data["orig_cell_id"],
-            t_start=datetime.datetime.strptime(
-                data["t_start"], "%Y-%m-%dT%H:%M:%S.%f%z"
-            ),
-            cell_input=data["cell_input"],
-            cell_type="CodeExecution",
-            language_mimetype=data["language_mimetype"],
-            t_finish=datetime.datetime.strptime(
-                data["t_finish"], "%Y-%m-%dT%H:%M:%S.%f%z"
-            ),
-            status=data["status"],
-            cell_output_model=data["cell_output_model"],
-            cell_output_length=data["cell_output_length"],
-        )
-        db.session.add(new_code_exec)
-        db.session.commit()
+        save_event("exec/code", data)
         return jsonify("Code OK")
 
     except Exception as e:
@@ -108,20 +79,9 @@ def postCodeExec():
 @send_bp.route("/exec/markdown", methods=["POST"])
 def postMarkdownExec():
     data = request.get_json()
-    hashed_user_id = hash_user_id_with_salt(data["user_id"])
 
     try:
-        new_md_exec = CellExecution(
-            notebook_id=data["notebook_id"],
-            user_id=hashed_user_id,
-            cell_id=data["cell_id"],
-            orig_cell_id=data["orig_cell_id"],
-            t_start=datetime.datetime.strptime(data["time"], "%Y-%m-%dT%H:%M:%S.%f%z"),
-            cell_input=data["cell_content"],
-            cell_type="MarkdownExecution",
-        )
-        db.session.add(new_md_exec)
-        db.session.commit()
+        save_event("exec/markdown", data)
         return jsonify("Markdown OK")
 
     except Exception as e:
@@ -132,21 +92,9 @@ def postMarkdownExec():
 @send_bp.route("/clickevent/cell", methods=["POST"])
 def postCellClickEvent():
     data = request.get_json()
-    hashed_user_id = hash_user_id_with_salt(data["user_id"])
 
     try:
-        new_click_event = CellClickEvent(
-            notebook_id=data["notebook_id"],
-            user_id=hashed_user_id,
-            cell_id=data["cell_id"],
-            orig_cell_id=data["orig_cell_id"],
-            time=datetime.datetime.strptime(data["time"], "%Y-%m-%dT%H:%M:%S.%f%z"),
-            click_duration=data["click_duration"],
-            click_type=data["click_type"],
-        )
-
-        db.session.add(new_click_event)
-        db.session.commit()
+        save_event("clickevent/cell", data)
         return jsonify("CellClick OK")
 
     except Exception as e:
@@ -157,19 +105,9 @@ def postCellClickEvent():
 @send_bp.route("/clickevent/notebook", methods=["POST"])
 def postNotebookClickEvent():
     data = request.get_json()
-    hashed_user_id = hash_user_id_with_salt(data["user_id"])
 
     try:
-        new_click_event = NotebookClickEvent(
-            notebook_id=data["notebook_id"],
-            user_id=hashed_user_id,
-            time=datetime.datetime.strptime(data["time"], "%Y-%m-%dT%H:%M:%S.%f%z"),
-            click_duration=data["click_duration"],
-            click_type=data["click_type"],
-        )
-
-        db.session.add(new_click_event)
-        db.session.commit()
+        save_event("clickevent/notebook", data)
         return jsonify("NotebookClick OK")
 
     except Exception as e:
@@ -180,19 +118,9 @@ def postNotebookClickEvent():
 @send_bp.route("/alter", methods=["POST"])
 def postAlterEvent():
     data = request.get_json()
-    hashed_user_id = hash_user_id_with_salt(data["user_id"])
 
     try:
-        new_alter_event = CellAlteration(
-            notebook_id=data["notebook_id"],
-            user_id=hashed_user_id,
-            cell_id=data["cell_id"],
-            alteration_type=data["alteration_type"],
-            time=datetime.datetime.strptime(data["time"], "%Y-%m-%dT%H:%M:%S.%f%z"),
-        )
-
-        db.session.add(new_alter_event)
-        db.session.commit()
+        save_event("alter", data)
         return jsonify("Alteration OK")
 
     except Exception as e:
@@ -210,36 +138,67 @@ def postPendingUpdateInteraction():
     """
     data = request.get_json()
 
-    hashed_user_id = hash_user_id_with_salt(data["user_id"])
+    try:
+        save_event("pending_update_interaction", data)
+        return jsonify("PendingUpdateInteraction OK")
+
+    except Exception as e:
+        db.session.rollback()
+        return f"An error occurred: {str(e)}", 500
 
-    # Hash the sender if provided
-    sender_hashed = None
-    sender_type = data.get("sender_type")  # Get sender_type from frontend
-    if data.get("sender"):
-        sender_hashed = hash_user_id_with_salt(data["sender"])
 
-    cell_id = data.get("cell_id")
-    update_id = data.get("update_id")
-    action = data.get("action")
+@send_bp.route("/batch", methods=["POST"])
+def postBatch():
+    """Record a buffer of mixed events of a single notebook in one transaction.
+
+    Expects {"notebook_id": ..., "events": [{"type": ..., **payload}, ...]} where
+    each type is one of the single-event /send routes (e.g. "exec/code",
+    "clickevent/cell") and each payload is what that route would receive.
+    Returns the status of every event, in the order they were sent.
+    """
+    data = request.get_json()
+    notebook_id = data["notebook_id"]
+    events = data.get("events")
+
+    if not isinstance(events, list) or not events:
+        return jsonify("No events provided"), 400
+    if len(events) > MAX_BATCH_EVENTS:
+        return jsonify(f"Too many events, the limit is {MAX_BATCH_EVENTS}"), 413
+
+    statuses = []
+    # (index in the batch, typed event) of the events that could be built
+    new_events = []
+    for index, event in enumerate(events):
+        try:
+            # the notebook was checked once for the whole batch, so it is enforced on every event
+            event_data = {**event, "notebook_id": notebook_id}
+            new_events.append(
+                (index, (event["type"], event_data, build_event(event["type"], event_data)))
+            )
+            statuses.append({"status": "ok"})
+        except Exception as e:
+            statuses.append({"status": "error", "error": str(e)})
+
+    if not new_events:
+        return jsonify({"events": statuses}), 400
 
     try:
-        action_enum = PendingUpdateAction[action]
-
-        new_interaction = PendingUpdateInteraction(
-            notebook_id=data["notebook_id"],
-            user_id=hashed_user_id,
-            cell_id=cell_id,  # optional
-            update_id=update_id,
-            action=action_enum,
-            sender=sender_hashed,  # hashed sender user_id
-            sender_type=sender_type,  # 'teacher' or 'teammate'
-            timestamp=datetime.datetime.strptime(
-                data["time"], "%Y-%m-%dT%H:%M:%S.%f%z"
-            ),
-        )
-        db.session.add(new_interaction)
-        db.session.commit()
-        return jsonify("PendingUpdateInteraction OK")
+        try:
+            save_events([typed_event for _, typed_event in new_events])
+        except INGEST_UNAVAILABLE_ERRORS:
+            raise
+        except INGEST_ROW_ERRORS:
+            db.session.rollback()
+            # a row rejected by the database does not fail the others, they are saved one by one to find it
+            for index, typed_event in new_events:
+                try:
+                    save_events([typed_event])
+                except INGEST_UNAVAILABLE_ERRORS:
+                    raise
+                except INGEST_ROW_ERRORS as e:
+                    db.session.rollback()
+                    statuses[index] = {"status": "error", "error": str(e)}
+        return jsonify({"events": statuses})
 
     except Exception as e:
         db.session.rollback()
@@ -1,8 +1,15 @@
 from flask_socketio import send, join_room, leave_room, ConnectionRefusedError, emit
-from app import socketio, redis_client
-from app.models.models import ConnectionType, Notebook, TeammateLocation, db
-from flask import request, session
+from app import socketio
+from app.models.models import ConnectionType, db
+from flask import request, session, current_app
 from app.utils.utils import hash_user_id_with_salt
+from app.utils.cache import notebook_exists, invalidate_dashboard_cache
+from app.utils.locations import clear_location
+from app.utils.location_updates import submit_location, discard_socket
+from app.utils.presence import mark_connected, mark_disconnected
+from app.utils.group_rooms import register_student_socket, unregister_student_socket, emit_to_teammates
+from app.utils.dashboard_push import authorized_dashboard_user, subscribe_dashboard, unsubscribe_dashboard, subscription_room
+from app.utils.constants import DASHBOARD_UPDATE_MODE
 from datetime import datetime, timezone
 
 
@@ -25,13 +32,15 @@ def handle_connect():
         raise ConnectionRefusedError("Missing required identifiers")
 
     # check that the notebook is registered
-    notebook = Notebook.query.filter_by(notebook_id=notebook_id).first()
-    if not notebook:
+    if not notebook_exists(notebook_id):
         # notebook not registered
         raise ConnectionRefusedError("Notebook not registered")
 
-    # add to the appropriate list of connected users in the redis cache
-    redis_client.sadd(f"connected_{con_type.name.lower()}s:{notebook_id}", user_id)
+    # add to the appropriate list of connected users in the redis cache, refreshed by the heartbeats of the worker
+    mark_connected(con_type, notebook_id, user_id, request.sid)
+    # the real-time dashboard views only include the connected students
+    if con_type == ConnectionType.STUDENT:
+        invalidate_dashboard_cache(notebook_id)
     # add to the all-students or all-teachers room
     room_name = con_type.name.lower() + "_" + notebook_id
     join_room(room_name)
@@ -45,6 +54,8 @@ def handle_connect():
 
     # Notify teammates of new connection
     if con_type == ConnectionType.STUDENT:
+        # add to the rooms of the groups of the student, where the teammate events are sent
+        register_student_socket(notebook_id, user_id, request.sid)
         emit(
             "teammate_connected",
             {"userId": user_id},
@@ -69,60 +80,27 @@ def handle_disconnect():
 
     if user_id:
         # remove from the list of connected users
-        redis_client.srem(f"connected_{con_type.name.lower()}s:{notebook_id}", user_id)
+        mark_disconnected(con_type, notebook_id, user_id, request.sid)
+        if con_type == ConnectionType.STUDENT:
+            invalidate_dashboard_cache(notebook_id)
 
     # Notify teammates of disconnection before leaving the room
     room_name = con_type.name.lower() + "_" + notebook_id
     if con_type == ConnectionType.STUDENT:
-        # Clear location from database
+        # Clear location, after dropping the one waiting to be sent
+        discard_socket(request.sid)
         if user_id and notebook_id:
-            try:
-                TeammateLocation.query.filter_by(
-                    user_id=user_id, notebook_id=notebook_id
-                ).delete()
-                db.session.commit()
-            except Exception as e:
-                db.session.rollback()
-
-        # Get teammates in the same groups to notify them
-        from app.models.models import UserGroups, UserGroupAssociation
-
-        group_pk_rows = (
-            db.session.query(UserGroupAssociation.c.group_pk)
-            .join(UserGroups, UserGroupAssociation.c.group_pk == UserGroups.group_pk)
-            .filter(
-                UserGroupAssociation.c.user_id == user_id,
-                UserGroups.notebook_id == notebook_id,
-            )
-            .distinct()
-            .all()
-        )
-        group_pks = [r[0] for r in group_pk_rows]
-
-        if group_pks:
-            teammate_rows = (
-                db.session.query(UserGroupAssociation.c.user_id)
-                .filter(
-                    UserGroupAssociation.c.group_pk.in_(group_pks),
-                    UserGroupAssociation.c.user_id != user_id,
-                )
-                .distinct()
-                .all()
-            )
-            teammate_ids = [r[0] for r in teammate_rows]
-
-            # Notify each teammate
-            for teammate_id in teammate_ids:
-                emit(
-                    "teammate_disconnected",
-                    {"userId": user_id},
-                    to=f"student_{teammate_id}_{notebook_id}",
-                )
-                emit(
-                    "teammate_location_cleared",
-                    {"userId": user_id},
-                    to=f"student_{teammate_id}_{notebook_id}",
-                )
+            clear_location(notebook_id, user_id)
+
+        # Notify the teammates in the same groups, once per group
+        if user_id:
+            emit_to_teammates(notebook_id, user_id, "teammate_disconnected", {"userId": user_id})
+            emit_to_teammates(notebook_id, user_id, "teammate_location_cleared", {"userId": user_id})
+            unregister_student_socket(notebook_id, user_id, request.sid)
+
+    if session.get("dashboard_subscription", None):
+        unsubscribe_dashboard(notebook_id, session["dashboard_subscription"])
+        del session["dashboard_subscription"]
 
     # remove from the rooms
     room_name = con_type.name.lower() + "_" + notebook_id
@@ -139,6 +117,49 @@ def handle_disconnect():
         del session["notebook_id"]
 
 
+@socketio.on("subscribe_dashboard")
+def handle_subscribe_dashboard(data):
+    """Subscribe a teacher to the notebook dashboard views pushed after new events.
+
+    Expects the dashboard access token and the arguments of the views (t1,
+    selectedGroups, displayRealTime). Acknowledges with the current views, then
+    dashboardUpdate events bring the changes. Only in the 'push' DASHBOARD_UPDATE_MODE.
+    """
+    if DASHBOARD_UPDATE_MODE != "push":
+        return {"status": "disabled"}
+
+    notebook_id = session.get("notebook_id", None)
+    if session.get("con_type", None) != ConnectionType.TEACHER.name or not notebook_id:
+        return {"status": "error"}
+
+    # the socket connection itself is not authenticated, the views require the same permission as the dashboard routes
+    if authorized_dashboard_user(data.get("token"), notebook_id) is None:
+        return {"status": "no_user_permission"}
+
+    # a new subscription replaces the previous one, e.g. when the teacher selects other groups
+    previous = session.get("dashboard_subscription", None)
+    if previous:
+        leave_room(subscription_room(notebook_id, previous))
+        unsubscribe_dashboard(notebook_id, previous)
+
+    digest, views = subscribe_dashboard(notebook_id, data)
+    join_room(subscription_room(notebook_id, digest))
+    session["dashboard_subscription"] = digest
+
+    return {"status": "success", "full": True, "views": views}
+
+
+@socketio.on("unsubscribe_dashboard")
+def handle_unsubscribe_dashboard():
+    """Stop pushing the notebook dashboard views to a teacher."""
+    notebook_id = session.get("notebook_id", None)
+    digest = session.get("dashboard_subscription", None)
+    if notebook_id and digest:
+        leave_room(subscription_room(notebook_id, digest))
+        unsubscribe_dashboard(notebook_id, digest)
+        del session["dashboard_subscription"]
+
+
 @socketio.on("sendmessage")
 def handle_sendmessage(message):
     """Handle simple message echo (legacy endpoint)."""
@@ -263,68 +284,10 @@ def handle_update_location(data):
         return
 
     try:
-        # Update or create location in database
-        location = TeammateLocation.query.filter_by(
-            user_id=user_id, notebook_id=notebook_id
-        ).first()
-
-        if location:
-            location.cell_id = cell_id
-            location.cell_index = cell_index
-            location.updated_at = datetime.now(timezone.utc)
-        else:
-            location = TeammateLocation(
-                user_id=user_id,
-                notebook_id=notebook_id,
-                cell_id=cell_id,
-                cell_index=cell_index,
-                updated_at=datetime.now(timezone.utc),
-            )
-            db.session.add(location)
-
-        db.session.commit()
-
-        # Get teammates in the same groups
-        from app.models.models import UserGroups, UserGroupAssociation
-
-        # Find groups the user belongs to
-        group_pk_rows = (
-            db.session.query(UserGroupAssociation.c.group_pk)
-            .join(UserGroups, UserGroupAssociation.c.group_pk == UserGroups.group_pk)
-            .filter(
-                UserGroupAssociation.c.user_id == user_id,
-                UserGroups.notebook_id == notebook_id,
-            )
-            .distinct()
-            .all()
-        )
-        group_pks = [r[0] for r in group_pk_rows]
-
-        if not group_pks:
-            return
-
-        # Find all teammates in the same groups
-        teammate_rows = (
-            db.session.query(UserGroupAssociation.c.user_id)
-            .filter(
-                UserGroupAssociation.c.group_pk.in_(group_pks),
-                UserGroupAssociation.c.user_id != user_id,
-            )
-            .distinct()
-            .all()
-        )
-        teammate_ids = [r[0] for r in teammate_rows]
-
-        # Broadcast to each teammate's personal room
-        for teammate_id in teammate_ids:
-            teammate_room = f"student_{teammate_id}_{notebook_id}"
-            emit(
-                "teammate_location_update",
-                {"userId": user_id, "cellId": cell_id, "cellIndex": cell_index},
-                to=teammate_room,
-            )
-    except Exception as e:
-        db.session.rollback()
+        # stored and broadcast to the rooms of the groups of the student, at a bounded rate
+        submit_location(request.sid, notebook_id, user_id, cell_id, cell_index)
+    except Exception:
+        current_app.logger.exception(f"Location update of {user_id} in {notebook_id} failed")
 
 
 @socketio.on("group_message")
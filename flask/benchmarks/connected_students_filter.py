@@ -0,0 +1,106 @@
+"""Compares the real-time filter of the dashboard queries as an IN list (one parameter per connected student) and as
+a single array parameter (= ANY(:connected_user_ids)), on a temporary table shaped like CellRollup.
+
+Needs the database of the .env, run from the flask/ directory with : python -m benchmarks.connected_students_filter
+"""
+import argparse
+import random
+import statistics
+import time
+from hashlib import sha256
+from sqlalchemy import Table, Column, MetaData, String, Integer, select, func, bindparam, any_
+from sqlalchemy.dialects.postgresql import ARRAY
+from app import create_app, db
+
+NOTEBOOK_ID = "benchmark_notebook"
+
+rollups = Table(
+    "benchmark_rollups",
+    MetaData(),
+    Column("notebook_id", String(100)),
+    Column("cell_id", String(100)),
+    Column("user_id", String(100)),
+    Column("click_count", Integer),
+    prefixes=["TEMPORARY"],
+)
+
+
+def user_id(i):
+    # same length as the hashed user ids
+    return sha256(f"student_{i}".encode("utf-8")).hexdigest()
+
+
+def fill_rollups(connection, n_students, n_cells, seed=0):
+    rng = random.Random(seed)
+    rollups.create(connection)
+    connection.execute(
+        rollups.insert(),
+        [
+            {"notebook_id": NOTEBOOK_ID, "cell_id": f"cell_{cell}", "user_id": user_id(student), "click_count": rng.randrange(1, 10)}
+            for student in range(n_students)
+            for cell in range(n_cells)
+        ],
+    )
+    connection.exec_driver_sql("CREATE INDEX ON benchmark_rollups (notebook_id, user_id)")
+    connection.exec_driver_sql("ANALYZE benchmark_rollups")
+
+
+def cell_clicks_query(user_filter):
+    return (
+        select(rollups.c.cell_id, func.sum(rollups.c.click_count))
+        .where(rollups.c.notebook_id == NOTEBOOK_ID, user_filter)
+        .group_by(rollups.c.cell_id)
+    )
+
+
+def in_list_filter(connected_user_ids):
+    return rollups.c.user_id.in_(connected_user_ids)
+
+
+def array_filter(connected_user_ids):
+    return rollups.c.user_id == any_(
+        bindparam("connected_user_ids", connected_user_ids, type_=ARRAY(String))
+    )
+
+
+# returns the median planning time, execution time and total time of the query (as seen by the client) in ms
+def measure(connection, query, repeats):
+    # the expanding IN parameters are rendered the way they are sent to the database, one per value
+    compiled = query.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    planning, execution, total = [], [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        connection.exec_driver_sql(compiled.string, compiled.params).all()
+        total.append((time.perf_counter() - start) * 1000)
+
+        (plan,) = connection.exec_driver_sql(
+            "EXPLAIN (ANALYZE, FORMAT JSON) " + compiled.string, compiled.params
+        ).scalar()
+        planning.append(plan["Planning Time"])
+        execution.append(plan["Execution Time"])
+    return statistics.median(planning), statistics.median(execution), statistics.median(total), len(compiled.string)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--students", type=int, default=10000, help="students with rollups in the notebook")
+    parser.add_argument("--cells", type=int, default=30)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context(), db.engine.connect() as connection:
+        fill_rollups(connection, args.students, args.cells)
+
+        for n_connected in [50, 500, 5000]:
+            connected_user_ids = [user_id(i) for i in random.Random(n_connected).sample(range(args.students), n_connected)]
+            for name, user_filter in [("IN list", in_list_filter), ("ANY array", array_filter)]:
+                planning, execution, total, sql_length = measure(
+                    connection, cell_clicks_query(user_filter(connected_user_ids)), args.repeats
+                )
+                print(
+                    f"{n_connected} connected, {name} : planning {planning:.2f}ms, execution {execution:.2f}ms, "
+                    f"total {total:.2f}ms, SQL of {sql_length} characters"
+                )
+
+        connection.rollback()
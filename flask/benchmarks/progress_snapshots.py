@@ -0,0 +1,99 @@
+"""Compares the sweep-line build_snapshots with the previous per-minute rescan on synthetic classrooms.
+
+Run from the flask/ directory with : python -m benchmarks.progress_snapshots
+"""
+import argparse
+import random
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from app.utils.progress import ProgressSnapshot, build_snapshots
+
+
+# the previous implementation, rescanning the executions of every user at every minute
+def reference_build_snapshots(executions, cell_order, from_time, to_time):
+    cell_position = {cid: i + 1 for i, cid in enumerate(cell_order)}
+
+    user_events = defaultdict(list)
+    for user_id, orig_cell_id, t_start in executions:
+        user_events[user_id].append((t_start, orig_cell_id))
+
+    snapshots = []
+    t = from_time
+    while t <= to_time:
+        positions = []
+        for uid, evts in user_events.items():
+            past = [cid for ts, cid in evts if ts <= t]
+            if past:
+                pos = cell_position.get(past[-1])
+                if pos is not None:
+                    positions.append(pos)
+
+        if positions:
+            if len(positions) == 1:
+                v = float(positions[0])
+                snapshots.append(ProgressSnapshot(t, v, v, v, v, 1))
+            else:
+                qs = statistics.quantiles(positions, n=4)
+                snapshots.append(ProgressSnapshot(
+                    timestamp=t,
+                    mean=statistics.mean(positions),
+                    median=statistics.median(positions),
+                    q1=qs[0],
+                    q3=qs[2],
+                    n_users=len(positions),
+                ))
+        t += timedelta(minutes=1)
+
+    return snapshots
+
+
+# students progressing through the notebook at their own pace, sometimes going back to earlier cells
+def synthetic_classroom(n_students, n_cells, duration, executions_per_student, seed=0):
+    rng = random.Random(seed)
+    cell_order = [f"cell_{i}" for i in range(n_cells)]
+    from_time = datetime(2024, 1, 1, 8, 0)
+    seconds = int(duration.total_seconds())
+
+    executions = []
+    for student in range(n_students):
+        position = 0
+        for t in sorted(rng.randrange(seconds) for _ in range(executions_per_student)):
+            if rng.random() < 0.1:
+                position = rng.randrange(position + 1)
+            else:
+                position = min(position + rng.randrange(3), n_cells - 1)
+            # a few executions of cells that are not in the notebook anymore
+            cell_id = cell_order[position] if rng.random() > 0.02 else "deleted_cell"
+            executions.append((f"student_{student}", cell_id, from_time + timedelta(seconds=t)))
+
+    executions.sort(key=lambda execution: execution[2])
+    return executions, cell_order, from_time, from_time + duration
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cells", type=int, default=60)
+    parser.add_argument("--executions-per-student", type=int, default=150)
+    args = parser.parse_args()
+
+    for n_students, hours in [(30, 1), (100, 2), (200, 3)]:
+        classroom = synthetic_classroom(
+            n_students, args.cells, timedelta(hours=hours), args.executions_per_student
+        )
+        reference, reference_time = timed(reference_build_snapshots, *classroom)
+        snapshots, sweep_time = timed(build_snapshots, *classroom)
+        assert snapshots == reference, "the sweep-line snapshots differ from the reference"
+
+        print(
+            f"{n_students} students, {hours}h, {len(classroom[0])} executions : "
+            f"reference {reference_time:.3f}s, sweep-line {sweep_time:.3f}s "
+            f"(x{reference_time / sweep_time:.0f})"
+        )
@@ -0,0 +1,8 @@
+from app import create_app
+from app.utils.export_jobs import run_export_worker
+
+# runs the queued export jobs, to run alongside the app. Several exporters can run side by side
+if __name__ == "__main__":
+    application = create_app()
+    with application.app_context():
+        run_export_worker()
@@ -0,0 +1,12 @@
+from gevent import monkey
+monkey.patch_all()
+
+from app import create_app
+from app.utils.ingest import run_flusher
+
+# drains the ingestion stream into the database, to run alongside the app when INGEST_MODE=stream
+# (patched like the app: the dashboard refreshes and pushes it requests run in greenlets, which need the redis calls to yield)
+if __name__ == "__main__":
+    application = create_app()
+    with application.app_context():
+        run_flusher()
@@ -3,8 +3,10 @@ monkey.patch_all()
 
 from flask import Flask
 from app import create_app, db
+from app.utils.partitions import maintain_event_partitions
 
 if __name__ == "__main__":
     application = create_app()
     with application.app_context():
-        db.create_all()
\ No newline at end of file
+        db.create_all()
+        maintain_event_partitions()
\ No newline at end of file
@@ -0,0 +1,17 @@
+import argparse
+from app import create_app
+from app.utils.partitions import maintain_event_partitions
+from app.utils.constants import EVENT_PARTITION_WEEKS_AHEAD
+
+# pre-creates the weekly Event partitions and detaches the old ones, the flushers already create the coming partitions
+# periodically (see run_scheduled_partition_maintenance), so it is run by hand to detach the old ones
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the weekly partitions of the Event table")
+    parser.add_argument("--weeks-ahead", type=int, default=EVENT_PARTITION_WEEKS_AHEAD, help="number of future weeks to create a partition for")
+    parser.add_argument("--retention-weeks", type=int, default=None, help="detach the partitions that ended more than this number of weeks ago")
+    parser.add_argument("--drop", action="store_true", help="drop the old partitions instead of keeping them as standalone archive tables")
+    args = parser.parse_args()
+
+    application = create_app()
+    with application.app_context():
+        maintain_event_partitions(args.weeks_ahead, args.retention_weeks, args.drop)
@@ -0,0 +1,123 @@
+"""Partition the Event table by week on event_time
+
+Revision ID: 3f1e6b9d2a47
+Revises: 8cf7da9b8aac
+Create Date: 2026-10-17 18:11:05.240116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1e6b9d2a47'
+down_revision = '8cf7da9b8aac'
+branch_labels = None
+depends_on = None
+
+# the enum types already exist
+EventKind = postgresql.ENUM('Event', 'CellExecution', 'ClickEvent', 'CellClickEvent', 'NotebookClickEvent', 'CellAlteration', name='eventkind', create_type=False)
+ClickType = postgresql.ENUM('ON', 'OFF', name='clicktype', create_type=False)
+AlterationType = postgresql.ENUM('ADD', 'REMOVE', name='alterationtype', create_type=False)
+
+COLUMNS = (
+    'id, notebook_id, user_id, event_type, cell_id, orig_cell_id, t_start, cell_input, cell_type, '
+    'language_mimetype, t_finish, status, cell_output_model, cell_output_length, time, click_duration, '
+    'click_type, alteration_type'
+)
+
+
+def event_columns():
+    return [
+        # the existing sequence is reused, so the ids keep increasing from where they were
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('\"Event_id_seq\"'::regclass)"), nullable=False),
+        sa.Column('notebook_id', sa.String(length=100), nullable=False),
+        sa.Column('user_id', sa.String(length=100), nullable=False),
+        sa.Column('event_type', EventKind, nullable=False),
+        sa.Column('cell_id', sa.String(length=100), nullable=True),
+        sa.Column('orig_cell_id', sa.String(length=100), nullable=True),
+        sa.Column('t_start', sa.DateTime(), nullable=True),
+        sa.Column('cell_input', sa.Text(), nullable=True),
+        sa.Column('cell_type', sa.String(length=32), nullable=True),
+        sa.Column('language_mimetype', sa.String(length=50), nullable=True),
+        sa.Column('t_finish', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('cell_output_model', sa.PickleType(), nullable=True),
+        sa.Column('cell_output_length', sa.Integer(), nullable=True),
+        sa.Column('time', sa.DateTime(), nullable=True),
+        sa.Column('click_duration', sa.Float(), nullable=True),
+        sa.Column('click_type', ClickType, nullable=True),
+        sa.Column('alteration_type', AlterationType, nullable=True),
+    ]
+
+
+def upgrade():
+    # the index and constraint names are unique per schema, free them for the new table
+    op.drop_index('idx_event_notebook_user', table_name='Event')
+    op.drop_index('idx_event_notebook_type', table_name='Event')
+    op.rename_table('Event', 'Event_unpartitioned')
+    op.execute("ALTER TABLE \"Event_unpartitioned\" RENAME CONSTRAINT \"Event_pkey\" TO \"Event_unpartitioned_pkey\"")
+
+    op.create_table('Event',
+    *event_columns(),
+    sa.Column('event_time', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id', 'event_time'),
+    postgresql_partition_by='RANGE (event_time)'
+    )
+    op.execute("ALTER SEQUENCE \"Event_id_seq\" OWNED BY \"Event\".id")
+
+    ### weekly partitions from the first event to a few weeks ahead, and a default one for the rest
+    op.execute("CREATE TABLE \"Event_default\" PARTITION OF \"Event\" DEFAULT")
+    op.execute("""
+        DO $$
+        DECLARE
+            monday date;
+        BEGIN
+            FOR monday IN
+                SELECT generate_series(
+                    date_trunc('week', (SELECT COALESCE(MIN(COALESCE(time, t_finish, t_start)), now()) FROM "Event_unpartitioned")),
+                    date_trunc('week', now()) + interval '4 weeks',
+                    interval '1 week'
+                )::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF "Event" FOR VALUES FROM (%L) TO (%L)',
+                    'Event_p' || to_char(monday, 'YYYYMMDD'), monday, monday + 7
+                );
+            END LOOP;
+        END $$;
+    """)
+
+    op.execute(
+        f"INSERT INTO \"Event\" ({COLUMNS}, event_time) "
+        # same fallback as default_event_time for the rows without any time, e.g. plain Event rows
+        f"SELECT {COLUMNS}, COALESCE(time, t_finish, t_start, now()) FROM \"Event_unpartitioned\""
+    )
+    op.drop_table('Event_unpartitioned')
+
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.create_index('idx_event_notebook_user', ['notebook_id', 'user_id'], unique=False)
+        batch_op.create_index('idx_event_notebook_type', ['notebook_id', 'event_type'], unique=False)
+        batch_op.create_index('idx_event_notebook_time', ['notebook_id', 'event_time'], unique=False)
+
+
+def downgrade():
+    op.rename_table('Event', 'Event_partitioned')
+    op.execute("ALTER TABLE \"Event_partitioned\" RENAME CONSTRAINT \"Event_pkey\" TO \"Event_partitioned_pkey\"")
+    op.drop_index('idx_event_notebook_user', table_name='Event_partitioned')
+    op.drop_index('idx_event_notebook_type', table_name='Event_partitioned')
+    op.drop_index('idx_event_notebook_time', table_name='Event_partitioned')
+
+    op.create_table('Event',
+    *event_columns(),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("ALTER SEQUENCE \"Event_id_seq\" OWNED BY \"Event\".id")
+    op.execute(f"INSERT INTO \"Event\" ({COLUMNS}) SELECT {COLUMNS} FROM \"Event_partitioned\"")
+    # drops the partitions along with the parent table
+    op.drop_table('Event_partitioned')
+
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.create_index('idx_event_notebook_user', ['notebook_id', 'user_id'], unique=False)
+        batch_op.create_index('idx_event_notebook_type', ['notebook_id', 'event_type'], unique=False)
@@ -0,0 +1,57 @@
+"""LatestCellExecution table with the last execution of each user on each cell, for the cell dashboard
+
+Revision ID: 5d0a7c2e8b94
+Revises: e2b94d7c3f18
+Create Date: 2026-10-17 21:41:15.902361
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d0a7c2e8b94'
+down_revision = 'e2b94d7c3f18'
+branch_labels = None
+depends_on = None
+
+INCLUDED_COLUMNS = ['user_id', 't_start', 'event_time']
+
+
+def upgrade():
+    op.create_table('LatestCellExecution',
+    sa.Column('notebook_id', sa.String(length=100), nullable=False),
+    sa.Column('cell_id', sa.String(length=100), nullable=False),
+    sa.Column('user_id', sa.String(length=100), nullable=False),
+    sa.Column('exec_id', sa.Integer(), nullable=False),
+    sa.Column('event_time', sa.DateTime(), nullable=False),
+    sa.Column('t_start', sa.DateTime(), nullable=False),
+    sa.Column('input_length', sa.Integer(), nullable=False),
+    sa.Column('output_length', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('notebook_id', 'cell_id', 'user_id')
+    )
+
+    ### backfill with the last execution (highest id) of each user on each cell
+    op.execute("""
+        INSERT INTO "LatestCellExecution" (notebook_id, cell_id, user_id, exec_id, event_time, t_start, input_length, output_length)
+        SELECT DISTINCT ON (notebook_id, cell_id, user_id)
+            notebook_id, cell_id, user_id, id, event_time, t_start,
+            COALESCE(length(cell_input), 0), COALESCE(cell_output_length, 0)
+        FROM "Event"
+        WHERE event_type = 'CellExecution'
+        ORDER BY notebook_id, cell_id, user_id, id DESC
+    """)
+
+    with op.batch_alter_table('LatestCellExecution', schema=None) as batch_op:
+        batch_op.create_index('idx_latestexec_time', ['notebook_id', 'cell_id', 'exec_id'], unique=False, postgresql_include=INCLUDED_COLUMNS)
+        batch_op.create_index('idx_latestexec_input', ['notebook_id', 'cell_id', 'input_length', 'exec_id'], unique=False, postgresql_include=INCLUDED_COLUMNS)
+        batch_op.create_index('idx_latestexec_output', ['notebook_id', 'cell_id', 'output_length', 'exec_id'], unique=False, postgresql_include=INCLUDED_COLUMNS)
+
+
+def downgrade():
+    with op.batch_alter_table('LatestCellExecution', schema=None) as batch_op:
+        batch_op.drop_index('idx_latestexec_output')
+        batch_op.drop_index('idx_latestexec_input')
+        batch_op.drop_index('idx_latestexec_time')
+
+    op.drop_table('LatestCellExecution')
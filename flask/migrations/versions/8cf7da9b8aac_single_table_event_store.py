@@ -0,0 +1,170 @@
+"""Merge the event subclass tables into a single Event table
+
+Revision ID: 8cf7da9b8aac
+Revises: 0b56e41f01e8
+Create Date: 2026-10-17 17:02:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8cf7da9b8aac'
+down_revision = '0b56e41f01e8'
+branch_labels = None
+depends_on = None
+
+EVENT_KINDS = ('Event', 'CellExecution', 'ClickEvent', 'CellClickEvent', 'NotebookClickEvent', 'CellAlteration')
+
+# the enum types already exist, they were created with the ClickEvent and CellAlteration tables
+ClickType = postgresql.ENUM('ON', 'OFF', name='clicktype', create_type=False)
+AlterationType = postgresql.ENUM('ADD', 'REMOVE', name='alterationtype', create_type=False)
+
+
+def upgrade():
+    # widen the Event table with the (nullable) columns of every kind of event
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cell_id', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('orig_cell_id', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('t_start', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('cell_input', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('cell_type', sa.String(length=32), nullable=True))
+        batch_op.add_column(sa.Column('language_mimetype', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('t_finish', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('status', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('cell_output_model', sa.PickleType(), nullable=True))
+        batch_op.add_column(sa.Column('cell_output_length', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('time', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('click_duration', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('click_type', ClickType, nullable=True))
+        batch_op.add_column(sa.Column('alteration_type', AlterationType, nullable=True))
+
+    ### backfill from the subclass tables, the ids are kept so nothing refers to a different row
+    op.execute(
+        "UPDATE \"Event\" e SET cell_id = c.cell_id, orig_cell_id = c.orig_cell_id, t_start = c.t_start, "
+        "cell_input = c.cell_input, cell_type = c.cell_type, language_mimetype = c.language_mimetype, "
+        "t_finish = c.t_finish, status = c.status, cell_output_model = c.cell_output_model, "
+        "cell_output_length = c.cell_output_length "
+        "FROM \"CellExecution\" c WHERE e.id = c.id"
+    )
+    op.execute(
+        "UPDATE \"Event\" e SET time = c.time, click_duration = c.click_duration, click_type = c.click_type "
+        "FROM \"ClickEvent\" c WHERE e.id = c.id"
+    )
+    op.execute(
+        "UPDATE \"Event\" e SET cell_id = c.cell_id, orig_cell_id = c.orig_cell_id "
+        "FROM \"CellClickEvent\" c WHERE e.id = c.id"
+    )
+    op.execute(
+        "UPDATE \"Event\" e SET cell_id = c.cell_id, alteration_type = c.alteration_type, time = c.time "
+        "FROM \"CellAlteration\" c WHERE e.id = c.id"
+    )
+
+    op.drop_table('CellClickEvent')
+    op.drop_table('NotebookClickEvent')
+    op.drop_table('ClickEvent')
+    op.drop_table('CellAlteration')
+    op.drop_table('CellExecution')
+
+    ### compact discriminator : the event type becomes a native enum
+    sa.Enum(*EVENT_KINDS, name='eventkind').create(op.get_bind())
+    op.execute("ALTER TABLE \"Event\" ALTER COLUMN event_type TYPE eventkind USING event_type::eventkind")
+
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.create_index('idx_event_notebook_type', ['notebook_id', 'event_type'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.drop_index('idx_event_notebook_type')
+
+    op.execute("ALTER TABLE \"Event\" ALTER COLUMN event_type TYPE VARCHAR(32) USING event_type::text")
+    sa.Enum(name='eventkind').drop(op.get_bind())
+
+    op.create_table('CellExecution',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cell_id', sa.String(length=100), nullable=False),
+    sa.Column('orig_cell_id', sa.String(length=100), nullable=False),
+    sa.Column('t_start', sa.DateTime(), nullable=False),
+    sa.Column('cell_input', sa.Text(), nullable=False),
+    sa.Column('cell_type', sa.String(length=32), nullable=False),
+    sa.Column('language_mimetype', sa.String(length=50), nullable=True),
+    sa.Column('t_finish', sa.DateTime(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('cell_output_model', sa.PickleType(), nullable=True),
+    sa.Column('cell_output_length', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['id'], ['Event.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('CellAlteration',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cell_id', sa.String(length=100), nullable=False),
+    sa.Column('alteration_type', AlterationType, nullable=False),
+    sa.Column('time', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['id'], ['Event.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('ClickEvent',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('time', sa.DateTime(), nullable=False),
+    sa.Column('click_duration', sa.Float(), nullable=True),
+    sa.Column('click_type', ClickType, nullable=False),
+    sa.ForeignKeyConstraint(['id'], ['Event.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('NotebookClickEvent',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['id'], ['ClickEvent.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('CellClickEvent',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cell_id', sa.String(length=100), nullable=False),
+    sa.Column('orig_cell_id', sa.String(length=100), nullable=False),
+    sa.ForeignKeyConstraint(['id'], ['ClickEvent.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    ### split the rows back into the subclass tables
+    op.execute(
+        "INSERT INTO \"CellExecution\" (id, cell_id, orig_cell_id, t_start, cell_input, cell_type, language_mimetype, "
+        "t_finish, status, cell_output_model, cell_output_length) "
+        "SELECT id, cell_id, orig_cell_id, t_start, cell_input, cell_type, language_mimetype, "
+        "t_finish, status, cell_output_model, cell_output_length "
+        "FROM \"Event\" WHERE event_type = 'CellExecution'"
+    )
+    op.execute(
+        "INSERT INTO \"CellAlteration\" (id, cell_id, alteration_type, time) "
+        "SELECT id, cell_id, alteration_type, time FROM \"Event\" WHERE event_type = 'CellAlteration'"
+    )
+    op.execute(
+        "INSERT INTO \"ClickEvent\" (id, time, click_duration, click_type) "
+        "SELECT id, time, click_duration, click_type FROM \"Event\" "
+        "WHERE event_type IN ('ClickEvent', 'CellClickEvent', 'NotebookClickEvent')"
+    )
+    op.execute(
+        "INSERT INTO \"NotebookClickEvent\" (id) "
+        "SELECT id FROM \"Event\" WHERE event_type = 'NotebookClickEvent'"
+    )
+    op.execute(
+        "INSERT INTO \"CellClickEvent\" (id, cell_id, orig_cell_id) "
+        "SELECT id, cell_id, orig_cell_id FROM \"Event\" WHERE event_type = 'CellClickEvent'"
+    )
+
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.drop_column('alteration_type')
+        batch_op.drop_column('click_type')
+        batch_op.drop_column('click_duration')
+        batch_op.drop_column('time')
+        batch_op.drop_column('cell_output_length')
+        batch_op.drop_column('cell_output_model')
+        batch_op.drop_column('status')
+        batch_op.drop_column('t_finish')
+        batch_op.drop_column('language_mimetype')
+        batch_op.drop_column('cell_type')
+        batch_op.drop_column('t_start')
+        batch_op.drop_column('orig_cell_id')
+        batch_op.drop_column('cell_input')
+        batch_op.drop_column('cell_id')
@@ -0,0 +1,132 @@
+"""Store cell_output_model as lz4 compressed JSONB with a preview column
+
+Revision ID: a6d20c4e9b31
+Revises: 3f1e6b9d2a47
+Create Date: 2026-10-17 19:02:37.551820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import json
+import pickle
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d20c4e9b31'
+down_revision = '3f1e6b9d2a47'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+# frozen copy of app.utils.ingest.build_output_preview as of this revision, so the migration does not depend on the app
+PREVIEW_MAX_SIZE = 16384
+PREVIEW_TEXT_LENGTH = 2000
+
+
+def _truncate_text(text):
+    if isinstance(text, list):
+        text = "".join(text)
+    return text[:PREVIEW_TEXT_LENGTH]
+
+
+def _trim_output(output):
+    trimmed = {"output_type": output.get("output_type")}
+    if "name" in output:
+        trimmed["name"] = output["name"]
+        trimmed["text"] = _truncate_text(output.get("text", ""))
+    if "data" in output:
+        plain_text = output["data"].get("text/plain")
+        trimmed["data"] = {"text/plain": _truncate_text(plain_text)} if plain_text else {}
+        trimmed["metadata"] = {}
+        if "execution_count" in output:
+            trimmed["execution_count"] = output["execution_count"]
+    if "ename" in output:
+        trimmed["ename"] = output["ename"]
+        trimmed["evalue"] = _truncate_text(output.get("evalue", ""))
+        trimmed["traceback"] = [_truncate_text("\n".join(output.get("traceback", [])))]
+    return trimmed
+
+
+def build_output_preview(output_model):
+    if not output_model or len(json.dumps(output_model)) <= PREVIEW_MAX_SIZE:
+        return output_model, False
+
+    preview = []
+    size = 0
+    for output in output_model:
+        trimmed = _trim_output(output)
+        size += len(json.dumps(trimmed))
+        if size > PREVIEW_MAX_SIZE:
+            break
+        preview.append(trimmed)
+    return preview, True
+
+
+# converts the outputs of the executions batch by batch (keyset on id) since they can only be (un)pickled in python
+def convert_outputs(convert, write_preview):
+    if write_preview:
+        query = sa.text(
+            "UPDATE \"Event\" SET cell_output_converted = CAST(:output AS jsonb), "
+            "cell_output_preview = CAST(:preview AS jsonb), cell_output_truncated = :truncated "
+            "WHERE id = :id AND event_time = :event_time"
+        )
+    else:
+        query = sa.text("UPDATE \"Event\" SET cell_output_converted = :output WHERE id = :id AND event_time = :event_time")
+
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.text(
+                "SELECT id, event_time, cell_output_model FROM \"Event\" "
+                "WHERE id > :last_id AND cell_output_model IS NOT NULL ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": BATCH_SIZE},
+        ).all()
+        if not rows:
+            break
+
+        batch = []
+        for row in rows:
+            output_model = convert(row.cell_output_model)
+            params = {"id": row.id, "event_time": row.event_time, "output": output_model}
+            if write_preview:
+                preview, truncated = build_output_preview(json.loads(output_model))
+                params.update(preview=json.dumps(preview), truncated=truncated)
+            batch.append(params)
+        # a single executemany per batch, pipelined by psycopg
+        connection.execute(query, batch)
+
+        last_id = rows[-1].id
+
+
+def upgrade():
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cell_output_converted', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+        batch_op.add_column(sa.Column('cell_output_preview', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+        batch_op.add_column(sa.Column('cell_output_truncated', sa.Boolean(), nullable=True))
+
+    # compress before writing, so the converted values are stored with lz4 instead of the default pglz
+    op.execute("ALTER TABLE \"Event\" ALTER COLUMN cell_output_converted SET COMPRESSION lz4")
+
+    convert_outputs(lambda pickled: json.dumps(pickle.loads(pickled)), write_preview=True)
+
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.drop_column('cell_output_model')
+        batch_op.alter_column('cell_output_converted', new_column_name='cell_output_model')
+
+
+def downgrade():
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cell_output_converted', postgresql.BYTEA(), nullable=True))
+
+    # the JSONB values are already decoded by psycopg
+    convert_outputs(lambda output_model: pickle.dumps(output_model), write_preview=False)
+
+    with op.batch_alter_table('Event', schema=None) as batch_op:
+        batch_op.drop_column('cell_output_model')
+        batch_op.alter_column('cell_output_converted', new_column_name='cell_output_model')
+        batch_op.drop_column('cell_output_truncated')
+        batch_op.drop_column('cell_output_preview')
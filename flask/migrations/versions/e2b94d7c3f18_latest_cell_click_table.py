@@ -0,0 +1,40 @@
+"""LatestCellClick table with the last ON cell click of each user, for the ToC dashboard
+
+Revision ID: e2b94d7c3f18
+Revises: c81f3e5a7d62
+Create Date: 2026-10-17 21:03:47.120934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b94d7c3f18'
+down_revision = 'c81f3e5a7d62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('LatestCellClick',
+    sa.Column('notebook_id', sa.String(length=100), nullable=False),
+    sa.Column('user_id', sa.String(length=100), nullable=False),
+    sa.Column('cell_id', sa.String(length=100), nullable=False),
+    sa.Column('orig_cell_id', sa.String(length=100), nullable=False),
+    sa.Column('time', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('notebook_id', 'user_id')
+    )
+
+    ### backfill with the last ON cell click of each user
+    op.execute("""
+        INSERT INTO "LatestCellClick" (notebook_id, user_id, cell_id, orig_cell_id, time)
+        SELECT DISTINCT ON (notebook_id, user_id) notebook_id, user_id, cell_id, orig_cell_id, time
+        FROM "Event"
+        WHERE event_type = 'CellClickEvent' AND click_type = 'ON'
+        ORDER BY notebook_id, user_id, time DESC, id DESC
+    """)
+
+
+def downgrade():
+    op.drop_table('LatestCellClick')
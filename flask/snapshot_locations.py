@@ -0,0 +1,10 @@
+from app import create_app
+from app.utils.locations import snapshot_locations
+
+# copies the current teammate locations from redis to the TeammateLocation table, to run periodically (e.g. in a cron
+# job) when they are needed for analyses
+if __name__ == "__main__":
+    application = create_app()
+    with application.app_context():
+        n_locations = snapshot_locations()
+        application.logger.info(f"{n_locations} teammate location(s) copied to TeammateLocation")
@@ -1,3 +1,4 @@
+from app.utils.constants import INGEST_MODE
 from conftest import notebook_id, user_id, cell_id, t_start, t_finish, status, cell_input, cell_output_model, cell_output_length, cell_content, language_mimetype, click_duration
 
 URL_prefix = '/send'
@@ -113,3 +114,83 @@ def test_post_alter_event(test_client):
     assert response_get.status_code == 405
 
 
+def test_post_batch(test_client):
+    """
+    GIVEN a Flask application
+    WHEN a POST request is made to '/send/batch' with mixed events
+    THEN check that every event gets its own status
+    """
+    payload = {
+        "notebook_id": notebook_id,
+        "events": [
+            {
+                "type": "clickevent/cell",
+                "user_id": user_id,
+                "cell_id": cell_id,
+                "orig_cell_id": cell_id,
+                "time": t_start,
+                "click_duration": click_duration,
+                "click_type": 'ON'
+            },
+            {
+                "type": "alter",
+                "user_id": user_id,
+                "cell_id": cell_id,
+                "alteration_type": 'ADD',
+                "time": t_start
+            },
+            {
+                "type": "unknown",
+                "user_id": user_id
+            }
+        ]
+    }
+
+    response = test_client.post(URL_prefix+'/batch', json=payload)
+    assert response.status_code == 200
+    assert [e["status"] for e in response.json["events"]] == ['ok', 'ok', 'error']
+
+    response_empty = test_client.post(URL_prefix+'/batch', json={"notebook_id": notebook_id, "events": []})
+    assert response_empty.status_code == 400
+
+    response_get = test_client.get(URL_prefix+'/batch')
+    assert response_get.status_code == 405
+
+def test_post_batch_invalid_events(test_client):
+    """
+    GIVEN a Flask application
+    WHEN a POST request is made to '/send/batch' with an invalid click type and a cell id too long for the database
+    THEN check that only the invalid events get an error status
+    """
+    def cell_click(click_type, click_cell_id):
+        return {
+            "type": "clickevent/cell",
+            "user_id": user_id,
+            "cell_id": click_cell_id,
+            "orig_cell_id": click_cell_id,
+            "time": t_start,
+            "click_duration": click_duration,
+            "click_type": click_type
+        }
+
+    payload = {
+        "notebook_id": notebook_id,
+        "events": [
+            cell_click('ON', cell_id),
+            cell_click('FOO', cell_id),
+            cell_click('OFF', cell_id),
+        ]
+    }
+
+    response = test_client.post(URL_prefix+'/batch', json=payload)
+    assert response.status_code == 200
+    assert [e["status"] for e in response.json["events"]] == ['ok', 'error', 'ok']
+    assert 'ClickType' in response.json["events"][1]["error"]
+
+    # rejected by the database rather than while building the events, by the flusher in stream mode
+    if INGEST_MODE == 'stream':
+        return
+    payload["events"][1] = cell_click('ON', 'x' * 101)
+    response = test_client.post(URL_prefix+'/batch', json=payload)
+    assert response.status_code == 200
+    assert [e["status"] for e in response.json["events"]] == ['ok', 'error', 'ok']
@@ -0,0 +1,267 @@
+import csv
+import gzip
+import io
+import os
+from datetime import timezone
+import pytest
+from app import db, redis_client
+from sqlalchemy.orm import with_polymorphic
+from app.models.models import Event, CellExecution, CellClickEvent, NotebookClickEvent, CellAlteration, ClickType, AlterationType
+from app.utils.constants import EXPORT_JOB_QUEUE_KEY, EXPORT_FILES_KEY
+from app.utils.export import csv_export_response, notebook_csv_statement, columnar_export_response, notebook_columnar_statement
+from app.utils.export_jobs import submit_export_job, get_export_job, run_export_job, export_job_download_response
+from app.utils.storage import delete_from_volume
+
+# the export helpers are called directly, the dashboard routes requiring a dashboard account authorized for the notebook
+export_notebook_id = 'notebook_export'
+export_user_id = 'user_export'
+
+CSV_COLUMNS = [
+    'id',
+    '__tablename__',
+    'notebook_id',
+    'user_id',
+    'status',
+    'cell_input',
+    'cell_type',
+    'cell_id',
+    'orig_cell_id',
+    'click_type',
+    'click_duration',
+    'alteration_type',
+    'time (UTC !)',
+]
+
+@pytest.fixture(scope='module')
+def export_events(app):
+    events = [
+        CellExecution(
+            notebook_id=export_notebook_id,
+            user_id=export_user_id,
+            cell_id='cell_a',
+            orig_cell_id='cell_a',
+            cell_type='CodeExecution',
+            language_mimetype='text/x-python',
+            t_start='2023-05-29T13:55:52.811566',
+            t_finish='2023-05-29T13:55:55.055059',
+            status='ok',
+            cell_input='print("a, b")\nprint(1)',
+            cell_output_model=[],
+            cell_output_length=0,
+        ),
+        CellExecution(
+            notebook_id=export_notebook_id,
+            user_id=export_user_id,
+            cell_id='cell_b',
+            orig_cell_id='cell_b',
+            cell_type='MarkdownExecution',
+            # no microseconds, which isoformat() left out
+            t_start='2023-05-29T13:56:00',
+            cell_input='# Title',
+        ),
+        CellClickEvent(
+            notebook_id=export_notebook_id,
+            user_id=export_user_id,
+            cell_id='cell_a',
+            orig_cell_id='cell_a',
+            time='2023-05-29T13:57:01.5',
+            click_type=ClickType.OFF,
+            # integral durations were written with a .0
+            click_duration=2.0,
+        ),
+        CellClickEvent(
+            notebook_id=export_notebook_id,
+            user_id=export_user_id,
+            cell_id='cell_b',
+            orig_cell_id='cell_b',
+            time='2023-05-29T13:57:03.25',
+            click_type=ClickType.OFF,
+            click_duration=1.234,
+        ),
+        CellAlteration(
+            notebook_id=export_notebook_id,
+            user_id=export_user_id,
+            cell_id='cell_c',
+            alteration_type=AlterationType.ADD,
+            time='2023-05-29T13:58:00.000001',
+        ),
+    ]
+    db.session.add_all(events)
+    db.session.commit()
+    yield events
+
+    Event.query.filter_by(notebook_id=export_notebook_id).delete()
+    db.session.commit()
+
+def reference_csv_rows(notebook_id):
+    # the rows written by csv.writer from the ORM objects, before the exports were streamed with COPY
+    data = io.StringIO()
+    writer = csv.writer(data)
+    writer.writerow(CSV_COLUMNS)
+    polymorphic_join = with_polymorphic(Event, [CellExecution, CellClickEvent, NotebookClickEvent, CellAlteration])
+    rows = db.session.query(polymorphic_join).filter(Event.notebook_id == notebook_id).order_by(Event.id)
+    for row in rows:
+        time_value = getattr(row, 'time', None) or getattr(row, 't_finish', None) or getattr(row, 't_start', None)
+        writer.writerow(
+            [row.event_type if column == '__tablename__' else getattr(row, column, None) for column in CSV_COLUMNS[:-1]]
+            + [time_value.isoformat() if time_value else None]
+        )
+    return list(csv.reader(io.StringIO(data.getvalue())))
+
+def exported_csv_rows(body):
+    header, *rows = csv.reader(io.StringIO(body.decode('utf-8')))
+    return [header] + sorted(rows, key=lambda row: int(row[0]))
+
+def test_csv_export_matches_former_csv(app, export_events):
+    """
+    GIVEN the events of a notebook
+    WHEN they are exported in CSV with COPY
+    THEN check that the header and the rows are the ones the former csv.writer export wrote
+    """
+    with app.test_request_context('/'):
+        response = csv_export_response(notebook_csv_statement(export_notebook_id, None, None), 'log.csv')
+        body = response.get_data()
+
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == 'attachment; filename=log.csv'
+    assert 'Content-Encoding' not in response.headers
+    assert exported_csv_rows(body) == reference_csv_rows(export_notebook_id)
+
+def test_csv_export_gzip(app, export_events):
+    """
+    GIVEN the events of a notebook
+    WHEN they are exported in CSV by a client accepting gzip
+    THEN check that the response is gzip encoded and decodes to the plain export
+    """
+    statement = notebook_csv_statement(export_notebook_id, None, None)
+    with app.test_request_context('/'):
+        plain = csv_export_response(statement, 'log.csv').get_data()
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip, deflate'}):
+        response = csv_export_response(statement, 'log.csv')
+        body = response.get_data()
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(body) == plain
+
+def read_columnar(body, format):
+    pa = pytest.importorskip('pyarrow')
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(pa.BufferReader(body))
+    return pa.ipc.open_stream(body).read_all()
+
+@pytest.mark.parametrize('format, filename', [('parquet', 'log.parquet'), ('arrow', 'log.arrows')])
+def test_columnar_export(app, export_events, format, filename):
+    """
+    GIVEN the events of a notebook
+    WHEN some of their columns are exported in parquet or as an arrow stream
+    THEN check that the export holds the values of the events
+    """
+    pytest.importorskip('pyarrow')
+    names = ['id', 'event_type', 'user_id', 'click_type', 'click_duration', 'time']
+    with app.test_request_context('/'):
+        statement, kinds = notebook_columnar_statement(export_notebook_id, names, None, None)
+        response = columnar_export_response(statement, kinds, format, 'log')
+        body = response.get_data()
+
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == f'attachment; filename={filename}'
+    table = read_columnar(body, format)
+    assert table.column_names == names
+
+    expected = [
+        {
+            'id': event.id,
+            'event_type': event.event_type,
+            'user_id': export_user_id,
+            'click_type': event.click_type.name if getattr(event, 'click_type', None) else None,
+            'click_duration': getattr(event, 'click_duration', None),
+            'time': (getattr(event, 'time', None) or getattr(event, 't_finish', None) or event.t_start).replace(tzinfo=timezone.utc),
+        }
+        for event in export_events
+    ]
+    assert sorted(table.to_pylist(), key=lambda row: row['id']) == sorted(expected, key=lambda row: row['id'])
+
+@pytest.fixture
+def export_job(app, export_events, monkeypatch):
+    # the export files are written to the local volume
+    monkeypatch.setenv('LOCAL_DEV', 'true')
+    params = {'t1': None, 't2': None, 'columns': None}
+    job_id = submit_export_job(export_notebook_id, 'csv', params)
+    yield job_id, params
+
+    job = get_export_job(job_id)
+    if job and 'object_key' in job:
+        delete_from_volume(os.environ.get('S3_BUCKET_NAME'), job['object_key'])
+        redis_client.zrem(EXPORT_FILES_KEY, job['object_key'])
+    redis_client.lrem(EXPORT_JOB_QUEUE_KEY, 0, job_id)
+    redis_client.delete(f'export_job:{job_id}')
+
+def test_export_job_dedupe(app, export_job):
+    """
+    GIVEN an export job queued for a notebook
+    WHEN the same export is submitted again, then another one
+    THEN check that the same export is given the queued job and the other one a new job
+    """
+    job_id, params = export_job
+    assert submit_export_job(export_notebook_id, 'csv', dict(params)) == job_id
+    assert get_export_job(job_id)['status'] == 'queued'
+
+    other_job_id = submit_export_job(export_notebook_id, 'parquet', dict(params, columns=['id']))
+    assert other_job_id != job_id
+    redis_client.lrem(EXPORT_JOB_QUEUE_KEY, 0, other_job_id)
+    redis_client.delete(f'export_job:{other_job_id}')
+
+def test_export_job_range_resume(app, export_job):
+    """
+    GIVEN a done export job
+    WHEN its file is downloaded whole, then from an offset with If-Range set to the job id
+    THEN check that the second download is the end of the file with a 206 status code
+    """
+    job_id, params = export_job
+    run_export_job(job_id)
+    job = get_export_job(job_id)
+    assert job['status'] == 'done'
+    # the job is over, the same export gets a new job
+    new_job_id = submit_export_job(export_notebook_id, 'csv', dict(params))
+    assert new_job_id != job_id
+    redis_client.lrem(EXPORT_JOB_QUEUE_KEY, 0, new_job_id)
+    redis_client.delete(f'export_job:{new_job_id}')
+
+    with app.test_request_context('/'):
+        response = export_job_download_response(job_id, job)
+        full = response.get_data()
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag'] == f'"{job_id}"'
+    assert len(full) == int(job['size'])
+    assert exported_csv_rows(full) == reference_csv_rows(export_notebook_id)
+
+    with app.test_request_context('/', headers={'Range': 'bytes=10-', 'If-Range': f'"{job_id}"'}):
+        response = export_job_download_response(job_id, job)
+        body = response.get_data()
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 10-{len(full) - 1}/{len(full)}'
+    assert body == full[10:]
+
+def test_export_job_range_other_file(app, export_job):
+    """
+    GIVEN a done export job
+    WHEN its file is downloaded with a Range and an If-Range for another file, then with a Range past its end
+    THEN check that the whole file is sent, then that the range is not satisfiable
+    """
+    job_id, _ = export_job
+    run_export_job(job_id)
+    job = get_export_job(job_id)
+
+    with app.test_request_context('/', headers={'Range': 'bytes=10-', 'If-Range': '"another_job"'}):
+        response = export_job_download_response(job_id, job)
+        body = response.get_data()
+    assert response.status_code == 200
+    assert len(body) == int(job['size'])
+
+    with app.test_request_context('/', headers={'Range': f'bytes={job["size"]}-'}):
+        response = export_job_download_response(job_id, job)
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{job["size"]}'
@@ -0,0 +1,91 @@
+import json
+import pytest
+from sqlalchemy.exc import OperationalError
+from app import db, redis_client
+from app.models.models import Event
+from app.utils import ingest
+from app.utils.constants import INGEST_STREAM_KEY, INGEST_DEAD_LETTER_STREAM_KEY, INGEST_CONSUMER_GROUP
+from conftest import cell_id, t_start, click_duration
+
+ingest_notebook_id = 'notebook_ingest'
+consumer_name = 'test_flusher'
+
+def click_payload(click_type, click_cell_id=cell_id):
+    return {
+        "notebook_id": ingest_notebook_id,
+        "user_id": 'hashed_user',
+        "cell_id": click_cell_id,
+        "orig_cell_id": click_cell_id,
+        "time": t_start,
+        "click_duration": click_duration,
+        "click_type": click_type
+    }
+
+def pending_ids():
+    pending = redis_client.xpending_range(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, '-', '+', 100, consumername=consumer_name)
+    return {entry['message_id'] for entry in pending}
+
+@pytest.fixture
+def read_entries(app):
+    # pushes the payloads to the stream, and reads them as the flusher does
+    ingest.ensure_consumer_group()
+    # the entries left by the other tests are not read
+    redis_client.xgroup_setid(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, '$')
+    pushed_ids = []
+
+    def read(payloads):
+        for payload in payloads:
+            pushed_ids.append(redis_client.xadd(INGEST_STREAM_KEY, {"type": "clickevent/cell", "data": json.dumps(payload)}))
+        response = redis_client.xreadgroup(INGEST_CONSUMER_GROUP, consumer_name, {INGEST_STREAM_KEY: '>'}, count=len(payloads))
+        return response[0][1]
+
+    yield read
+
+    if pushed_ids:
+        redis_client.xack(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, *pushed_ids)
+        redis_client.xdel(INGEST_STREAM_KEY, *pushed_ids)
+    Event.query.filter_by(notebook_id=ingest_notebook_id).delete()
+    db.session.commit()
+
+def test_flush_dead_letters_invalid_rows(read_entries):
+    """
+    GIVEN a valid stream entry and an entry with a cell id too long for the database
+    WHEN they are flushed
+    THEN check that the valid one is inserted, the invalid one is dead-lettered, and both are acknowledged
+    """
+    dead_letters_before = redis_client.xlen(INGEST_DEAD_LETTER_STREAM_KEY)
+    entries = read_entries([click_payload('ON'), click_payload('OFF', 'x' * 101)])
+
+    assert ingest.flush_entries(entries) == {ingest_notebook_id}
+
+    assert Event.query.filter_by(notebook_id=ingest_notebook_id).count() == 1
+    assert redis_client.xlen(INGEST_DEAD_LETTER_STREAM_KEY) == dead_letters_before + 1
+    last_dead_letter = redis_client.xrevrange(INGEST_DEAD_LETTER_STREAM_KEY, count=1)[0][1]
+    assert last_dead_letter[b'entry_id'] == entries[1][0]
+    assert pending_ids() == set()
+
+def test_flush_leaves_entries_pending_when_database_unavailable(read_entries, monkeypatch):
+    """
+    GIVEN valid stream entries
+    WHEN they are flushed while the database is unavailable, then claimed and flushed again
+    THEN check that nothing is dead-lettered or acknowledged on the first flush, and that the entries are inserted on the second
+    """
+    dead_letters_before = redis_client.xlen(INGEST_DEAD_LETTER_STREAM_KEY)
+    entries = read_entries([click_payload('ON'), click_payload('OFF')])
+
+    def unavailable(events):
+        raise OperationalError('INSERT', {}, Exception('server closed the connection unexpectedly'))
+
+    with monkeypatch.context() as patch:
+        patch.setattr(ingest, '_insert_events', unavailable)
+        with pytest.raises(OperationalError):
+            ingest.flush_entries(entries)
+
+    assert Event.query.filter_by(notebook_id=ingest_notebook_id).count() == 0
+    assert redis_client.xlen(INGEST_DEAD_LETTER_STREAM_KEY) == dead_letters_before
+    assert pending_ids() == {entry_id for entry_id, _ in entries}
+
+    _, claimed, *_ = redis_client.xautoclaim(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, consumer_name, min_idle_time=0)
+    assert ingest.flush_entries(claimed) == {ingest_notebook_id}
+    assert Event.query.filter_by(notebook_id=ingest_notebook_id).count() == 2
+    assert pending_ids() == set()
@@ -0,0 +1,144 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from app.models.models import Event, CellClickEvent, CellExecution, CellRollup, LatestCellClick, LatestCellExecution
+from app.utils import ingest
+from app.utils.constants import CELL_DURATION_OUTLIER_LIMIT, OFF_CLICK_DURATION_BINS
+from app.utils.rollups import duration_bin
+from app.utils.dashboard_views import getCellExecutionData, getCellAccessTimeHistogramData, getCellDurationTimeData
+
+rollup_notebook_id = 'notebook_rollup'
+
+def click(user_id, cell_id, time, click_type, click_duration=None):
+    return ('clickevent/cell', {
+        "notebook_id": rollup_notebook_id,
+        "user_id": user_id,
+        "cell_id": cell_id,
+        "orig_cell_id": cell_id,
+        "time": time,
+        "click_duration": click_duration,
+        "click_type": click_type
+    })
+
+def code_exec(user_id, cell_id, t_finish, status):
+    return ('exec/code', {
+        "notebook_id": rollup_notebook_id,
+        "user_id": user_id,
+        "language_mimetype": 'text/x-python',
+        "cell_id": cell_id,
+        "orig_cell_id": cell_id,
+        "t_start": t_finish,
+        "t_finish": t_finish,
+        "status": status,
+        "cell_input": 'print(1)',
+        "cell_output_model": [],
+        "cell_output_length": 0
+    })
+
+@pytest.fixture(scope='module')
+def rollup_events(app):
+    payloads = [
+        click('user_a', 'cell_1', '2023-06-01T10:00:10.000000Z', 'ON'),
+        click('user_a', 'cell_1', '2023-06-01T10:00:50.000000Z', 'OFF', 0.5),
+        code_exec('user_a', 'cell_1', '2023-06-01T10:00:55.000000Z', 'ok'),
+        click('user_b', 'cell_1', '2023-06-01T10:01:30.000000Z', 'OFF', 45.0),
+        code_exec('user_b', 'cell_1', '2023-06-01T10:01:40.000000Z', 'error'),
+        # an outlier, left out of the average durations
+        click('user_b', 'cell_2', '2023-06-01T10:02:05.000000Z', 'OFF', CELL_DURATION_OUTLIER_LIMIT + 1.0),
+        click('user_a', 'cell_2', '2023-06-01T10:03:05.000000Z', 'OFF', 3.0),
+        code_exec('user_a', 'cell_2', '2023-06-01T10:03:20.000000Z', 'ok'),
+    ]
+    # inserted in the request transaction, whatever the INGEST_MODE of the test environment
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(ingest, 'INGEST_MODE', 'sync')
+        # in two transactions, so some rollup rows are updated rather than inserted
+        for chunk in (payloads[:4], payloads[4:]):
+            ingest.save_events([(event_type, data, ingest.build_event(event_type, data)) for event_type, data in chunk])
+    yield
+
+    for model in (Event, CellRollup, LatestCellClick, LatestCellExecution):
+        model.query.filter_by(notebook_id=rollup_notebook_id).delete()
+    db.session.commit()
+
+def raw_events(t_start, t_end):
+    # the rollups are per minute, the window is widened to the minutes it starts and ends in
+    query = Event.query.filter(Event.notebook_id == rollup_notebook_id)
+    if t_start is not None:
+        query = query.filter(Event.event_time >= t_start.replace(second=0, microsecond=0))
+    if t_end is not None:
+        query = query.filter(Event.event_time < t_end.replace(second=0, microsecond=0) + timedelta(minutes=1))
+    return query.all()
+
+def off_clicks(events):
+    return [
+        event for event in events
+        if isinstance(event, CellClickEvent) and event.click_type.name == 'OFF' and event.click_duration is not None
+    ]
+
+time_windows = [
+    (None, None),
+    # mid-minute bounds, the whole minutes of 10:00 and 10:02 are included
+    (datetime(2023, 6, 1, 10, 0, 30), datetime(2023, 6, 1, 10, 2, 0, 500000)),
+    (datetime(2023, 6, 1, 10, 1, 59), None),
+]
+
+@pytest.mark.parametrize('t_start, t_end', time_windows)
+def test_cell_execution_rollups(rollup_events, t_start, t_end):
+    """
+    GIVEN cell clicks and code executions ingested in two transactions
+    WHEN the cell execution view is read from the rollups, in a time window
+    THEN check that its counts are the ones of the raw events of the minutes of the window
+    """
+    counts = defaultdict(lambda: [0, 0, 0])
+    for event in raw_events(t_start, t_end):
+        if isinstance(event, CellClickEvent):
+            counts[event.cell_id][0] += 1
+        elif isinstance(event, CellExecution) and event.cell_type == 'CodeExecution':
+            counts[event.cell_id][1] += 1
+            counts[event.cell_id][2] += event.status == 'ok'
+    expected = {cell: tuple(count) for cell, count in counts.items() if count[0] > 0 and count[1] > 0}
+
+    view = getCellExecutionData(rollup_notebook_id, t_start, t_end, False, None)
+    assert {
+        row['cell']: (row['cell_click_pct'], row['code_exec_pct'], row['code_exec_ok_pct']) for row in view
+    } == expected
+
+@pytest.mark.parametrize('t_start, t_end', time_windows)
+def test_cell_access_time_histogram_rollups(rollup_events, t_start, t_end):
+    """
+    GIVEN off clicks ingested in two transactions
+    WHEN the access time histograms are read from the rollups, in a time window
+    THEN check that they are the counts of the durations of the raw events of the minutes of the window
+    """
+    expected = {}
+    for event in off_clicks(raw_events(t_start, t_end)):
+        counts = expected.setdefault(event.cell_id, [0] * len(OFF_CLICK_DURATION_BINS))
+        counts[duration_bin(event.click_duration)] += 1
+
+    view = getCellAccessTimeHistogramData(rollup_notebook_id, t_start, t_end, False, None)
+    assert all(row['bins'] == list(OFF_CLICK_DURATION_BINS) for row in view)
+    assert {row['cell']: row['counts'] for row in view} == expected
+
+@pytest.mark.parametrize('t_start, t_end', time_windows)
+def test_cell_duration_time_rollups(rollup_events, t_start, t_end):
+    """
+    GIVEN off clicks ingested in two transactions
+    WHEN the average durations are read from the rollups, in a time window
+    THEN check that they are the averages of the per-user averages of the raw events of the minutes of the window
+    """
+    user_durations = defaultdict(list)
+    for event in off_clicks(raw_events(t_start, t_end)):
+        if event.click_duration <= CELL_DURATION_OUTLIER_LIMIT:
+            user_durations[(event.cell_id, event.user_id)].append(event.click_duration)
+    cell_averages = defaultdict(list)
+    for (cell, _), durations in user_durations.items():
+        cell_averages[cell].append(sum(durations) / len(durations))
+
+    view = getCellDurationTimeData(rollup_notebook_id, t_start, t_end, False, None)
+    assert view['total_user_count'] == len({user for _, user in user_durations})
+    assert {
+        row['cell']: (pytest.approx(row['average_duration']), row['user_count']) for row in view['durations']
+    } == {
+        cell: (sum(averages) / len(averages), len(averages)) for cell, averages in cell_averages.items()
+    }
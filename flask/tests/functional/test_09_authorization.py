@@ -0,0 +1,111 @@
+import pytest
+from flask_jwt_extended import create_access_token
+from app import db, redis_client
+from app.models import auth
+from app.models.auth import AuthUsers, AuthNotebooks, is_notebook_authorized, invalidate_authorized_notebooks
+from app.utils.utils import hash_user_id_with_salt
+
+auth_username = 'auth_test_user'
+authorized_notebook_id = 'notebook_authorized'
+other_notebook_id = 'notebook_not_authorized'
+
+@pytest.fixture
+def auth_user(app):
+    user = AuthUsers(username_hash=hash_user_id_with_salt(auth_username), password='password')
+    # superuser to disable its own notebooks
+    user.is_superuser = True
+    user.authorized_notebooks.append(AuthNotebooks(notebook_id=authorized_notebook_id))
+    db.session.add_all([user, AuthNotebooks(notebook_id=other_notebook_id)])
+    db.session.commit()
+    # read before the tests that delete the user
+    user_id = user.id
+    yield user
+
+    db.session.rollback()
+    user = db.session.get(AuthUsers, user_id)
+    if user is not None:
+        user.authorized_notebooks.clear()
+        db.session.delete(user)
+    AuthNotebooks.query.filter(AuthNotebooks.notebook_id.in_([authorized_notebook_id, other_notebook_id])).delete()
+    db.session.commit()
+    invalidate_authorized_notebooks(user_id)
+
+def auth_headers(user):
+    return {'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+
+def test_notebook_authorization(test_client, auth_user):
+    """
+    GIVEN a user authorized on a notebook
+    WHEN the dashboard routes of that notebook and of another one are requested, before and after the cache is filled
+    THEN check that only the authorized notebook is let through
+    """
+    assert is_notebook_authorized(auth_user.id, authorized_notebook_id)
+    assert not is_notebook_authorized(auth_user.id, other_notebook_id)
+    # answered from the cached set
+    assert redis_client.exists(f'authorized_notebooks:{auth_user.id}')
+    assert is_notebook_authorized(auth_user.id, authorized_notebook_id)
+    assert not is_notebook_authorized(auth_user.id, other_notebook_id)
+
+    headers = auth_headers(auth_user)
+    # not registered as a Notebook, but let through by the authorization check
+    assert test_client.get(f'/dashboard/{authorized_notebook_id}/check', headers=headers).status_code == 404
+    response = test_client.get(f'/dashboard/{other_notebook_id}/check', headers=headers)
+    assert response.status_code == 403
+    assert response.json == {'status': 'no_user_permission'}
+
+def test_notebook_revocation(test_client, auth_user):
+    """
+    GIVEN a user authorized on a notebook, with its notebooks cached
+    WHEN the notebook is disabled for the user
+    THEN check that the user is not authorized on it anymore
+    """
+    headers = auth_headers(auth_user)
+    assert is_notebook_authorized(auth_user.id, authorized_notebook_id)
+
+    response = test_client.delete(
+        f'/jwt/disable_notebooks_for_user/{auth_username}', json={'notebook_ids': [authorized_notebook_id]}, headers=headers
+    )
+    assert response.status_code == 200
+
+    assert not is_notebook_authorized(auth_user.id, authorized_notebook_id)
+    assert test_client.get(f'/dashboard/{authorized_notebook_id}/check', headers=headers).status_code == 403
+
+def test_notebook_revocation_during_cache_miss(auth_user, monkeypatch):
+    """
+    GIVEN a user authorized on a notebook, without its notebooks cached
+    WHEN the notebook is disabled while a request that read the former notebooks is filling the cache
+    THEN check that the former notebooks are not cached, so the user is not authorized anymore afterwards
+    """
+    user_id = auth_user.id
+    read_notebook_ids = auth._authorized_notebook_ids
+
+    def read_then_revoke(user_id):
+        notebook_ids = read_notebook_ids(user_id)
+        auth_user.authorized_notebooks.clear()
+        db.session.commit()
+        invalidate_authorized_notebooks(user_id)
+        return notebook_ids
+
+    monkeypatch.setattr(auth, '_authorized_notebook_ids', read_then_revoke)
+    # the request in flight answers with what it read
+    assert is_notebook_authorized(user_id, authorized_notebook_id)
+    assert not redis_client.exists(f'authorized_notebooks:{user_id}')
+
+    monkeypatch.setattr(auth, '_authorized_notebook_ids', read_notebook_ids)
+    assert not is_notebook_authorized(user_id, authorized_notebook_id)
+
+def test_deleted_user(test_client, auth_user):
+    """
+    GIVEN a user whose notebooks are cached
+    WHEN the user is deleted and its token is used
+    THEN check that the request is answered with a 401
+    """
+    headers = auth_headers(auth_user)
+    assert is_notebook_authorized(auth_user.id, authorized_notebook_id)
+    assert test_client.get('/jwt/check', headers=headers).status_code == 200
+
+    auth_user.authorized_notebooks.clear()
+    db.session.delete(auth_user)
+    db.session.commit()
+
+    assert test_client.get('/jwt/check', headers=headers).status_code == 401
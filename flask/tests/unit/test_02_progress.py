@@ -0,0 +1,27 @@
+from datetime import timedelta
+from app.utils.progress import build_snapshots
+from benchmarks.progress_snapshots import reference_build_snapshots, synthetic_classroom
+
+def test_build_snapshots_matches_reference():
+    """
+    GIVEN executions of a synthetic classroom
+    WHEN the progress snapshots are built with the sweep-line
+    THEN check they are the same as the ones of the per-minute rescan
+    """
+    for seed in range(5):
+        classroom = synthetic_classroom(20, 15, timedelta(minutes=45), 30, seed=seed)
+        assert build_snapshots(*classroom) == reference_build_snapshots(*classroom)
+
+def test_build_snapshots_single_user():
+    """
+    GIVEN the executions of a single user
+    WHEN the progress snapshots are built
+    THEN check every statistic is the position of that user
+    """
+    executions, cell_order, from_time, to_time = synthetic_classroom(1, 10, timedelta(minutes=20), 10)
+    snapshots = build_snapshots(executions, cell_order, from_time, to_time)
+
+    assert snapshots
+    for snapshot in snapshots:
+        assert snapshot.n_users == 1
+        assert snapshot.mean == snapshot.median == snapshot.q1 == snapshot.q3
@@ -0,0 +1,33 @@
+from app.utils.dashboard_push import diff_views
+
+def test_diff_views_per_cell():
+    """
+    GIVEN the previous and current views of a subscription
+    WHEN they are compared
+    THEN check only the changed cell entries, the removed cells and the changed views are in the delta
+    """
+    previous = {
+        "user_cell_time": [{"cell": "a", "durations": [1.0]}, {"cell": "b", "durations": [2.0]}],
+        "toc": {"a": 2},
+    }
+    current = {
+        "user_cell_time": [{"cell": "a", "durations": [1.0, 3.0]}, {"cell": "c", "durations": [4.0]}],
+        "toc": {"a": 1, "c": 1},
+    }
+
+    assert diff_views(previous, current) == {
+        "user_cell_time": {
+            "upsert": [{"cell": "a", "durations": [1.0, 3.0]}, {"cell": "c", "durations": [4.0]}],
+            "remove": ["b"],
+        },
+        "toc": {"value": {"a": 1, "c": 1}},
+    }
+
+def test_diff_views_unchanged():
+    """
+    GIVEN views that did not change
+    WHEN they are compared
+    THEN check the delta is empty, so nothing is pushed
+    """
+    views = {"user_cell_duration_time": {"durations": [], "total_user_count": 0}, "toc": {}}
+    assert diff_views(views, views) == {}
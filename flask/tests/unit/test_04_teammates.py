@@ -0,0 +1,39 @@
+from app.utils.teammates import build_teammate_graph
+
+def test_build_teammate_graph():
+    """
+    GIVEN the (group, user) memberships of the groups of a notebook
+    WHEN the teammate graph is built
+    THEN check each user is mapped to the other members of all their groups, once each, and to their groups
+    """
+    memberships = [
+        ("g1-nb", "alice"),
+        ("g1-nb", "bob"),
+        ("g2-nb", "alice"),
+        ("g2-nb", "carol"),
+        ("g2-nb", "bob"),
+        ("g3-nb", "dave"),
+    ]
+
+    assert build_teammate_graph(memberships) == {
+        "teammates": {
+            "alice": ["bob", "carol"],
+            "bob": ["alice", "carol"],
+            "carol": ["alice", "bob"],
+            "dave": [],
+        },
+        "groups": {
+            "alice": ["g1-nb", "g2-nb"],
+            "bob": ["g1-nb", "g2-nb"],
+            "carol": ["g2-nb"],
+            "dave": ["g3-nb"],
+        },
+    }
+
+def test_build_teammate_graph_empty():
+    """
+    GIVEN a notebook without groups
+    WHEN the teammate graph is built
+    THEN check it is empty
+    """
+    assert build_teammate_graph([]) == {"teammates": {}, "groups": {}}